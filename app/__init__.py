@@ -1,7 +1,11 @@
+import os
 from flask import Flask
 from flask_migrate import Migrate
+from jinja2 import FileSystemBytecodeCache
 from config import Config
+from app.compression import init_compression
 from app.models import db, OptionalText
+from app.tenancy import init_tenancy
 
 __version__ = "0.1.0"
 
@@ -12,13 +16,34 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Must be set before the Jinja environment is first used
+    cache_dir = app.config.get("JINJA_CACHE_DIR") or os.path.join(app.instance_path, "jinja_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(cache_dir)}
+
     db.init_app(app)
     migrate.init_app(app, db)
+    init_tenancy(app)
+    init_compression(app)
+
+    from app.cli import register_commands
+    from app.services.archive import close_archive_sessions
+    from app.services.backup import start_backup_scheduler
+    from app.services.vat import start_vat_lookups
+    from app.services.webhooks import start_webhook_dispatcher
 
-    from app.routes import invoices, customers, settings
+    register_commands(app)
+    app.teardown_appcontext(close_archive_sessions)
+    start_backup_scheduler(app)
+    start_webhook_dispatcher(app)
+    start_vat_lookups(app)
+
+    from app.routes import invoices, customers, recurring, reconciliation, settings
 
     app.register_blueprint(invoices.bp)
     app.register_blueprint(customers.bp)
+    app.register_blueprint(recurring.bp)
+    app.register_blueprint(reconciliation.bp)
     app.register_blueprint(settings.bp)
 
     # Register main route
@@ -27,6 +52,10 @@ def create_app(config_class=Config):
         from flask import redirect, url_for
         return redirect(url_for("invoices.list_invoices"))
 
+    # Tenant databases are seeded by `flask tenants upgrade`
+    if "tenancy" in app.extensions:
+        return app
+
     with app.app_context():
         # Only seed if tables exist (after migrations have run)
         from sqlalchemy import inspect
@@ -0,0 +1,563 @@
+import functools
+import os
+import time
+from datetime import date
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+def tenant_option(command):
+    """Add a --tenant option that runs the command against that tenant's database."""
+
+    @click.option("--tenant", help="Tenant to run against when multi-tenancy is enabled.")
+    @functools.wraps(command)
+    def wrapper(*args, tenant=None, **kwargs):
+        if tenant is None:
+            return command(*args, **kwargs)
+
+        from app.tenancy import tenant_context
+
+        _selected_tenants([tenant])
+        with tenant_context(tenant):
+            return command(*args, **kwargs)
+
+    return wrapper
+
+
+@click.command("compile-templates")
+@with_appcontext
+def compile_templates_command():
+    """Precompile all templates into the Jinja bytecode cache."""
+    env = current_app.jinja_env
+    start = time.perf_counter()
+    names = env.list_templates(extensions=["html", "txt"])
+    for name in names:
+        env.get_template(name)
+    elapsed = time.perf_counter() - start
+    click.echo(f"Compiled {len(names)} templates in {elapsed:.2f}s.")
+
+
+@click.command("compress-static")
+@click.option("--check", is_flag=True, help="Only fail if any variant is older than its file, e.g. in a deploy script.")
+@with_appcontext
+def compress_static_command(check):
+    """Write precompressed .gz/.br variants of the static files, served instead of the originals."""
+    from app.compression import brotli, compress_static, stale_static_variants
+
+    if check:
+        stale = stale_static_variants(current_app.static_folder)
+        if stale:
+            raise click.ClickException(
+                f"{len(stale)} precompressed static files are out of date ({', '.join(stale)}); "
+                "run flask compress-static."
+            )
+        click.echo("Precompressed static files are up to date.")
+        return
+    for path, size, sizes in compress_static(current_app.static_folder, current_app.config["COMPRESS_MIN_SIZE"]):
+        variants = ", ".join(f"{encoding} {compressed:,} bytes" for encoding, compressed in sizes.items())
+        click.echo(f"{path}: {size:,} bytes" + (f" -> {variants}" if variants else ", left as is"))
+    if brotli is None:
+        click.echo("brotli is not installed, so only gzip variants were written.")
+
+
+@click.command("seed-sample-data")
+@click.option("--customers", default=100, show_default=True, help="Number of customers to create.")
+@click.option("--invoices-per-customer", default=10, show_default=True)
+@click.option("--items-per-invoice", default=3, show_default=True)
+@click.option("--seed", default=0, show_default=True, help="Random seed for reproducible data.")
+@with_appcontext
+def seed_sample_data_command(customers, invoices_per_customer, items_per_invoice, seed):
+    """Fill the database with generated customers and invoices for benchmarking."""
+    from app.services.sample_data import generate_sample_data
+
+    start = time.perf_counter()
+    count = generate_sample_data(customers, invoices_per_customer, items_per_invoice, seed=seed)
+    elapsed = time.perf_counter() - start
+    click.echo(f"Created {customers} customers and {count} invoices in {elapsed:.2f}s.")
+
+
+@click.command("run-recurring")
+@click.option("--period", help="Billing period as YYYY-MM (default: current month).")
+@click.option(
+    "--issue-date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Issue date (default: today, or the period's first day).",
+)
+@click.option("--draft", is_flag=True, help="Create drafts instead of issuing with numbers.")
+@with_appcontext
+@tenant_option
+def run_recurring_command(period, issue_date, draft):
+    """Generate all invoices due for a billing period from recurring invoices."""
+    from app.services.recurring import generate_recurring_invoices, parse_period, period_key
+
+    try:
+        period_start = parse_period(period) if period else date.today().replace(day=1)
+    except ValueError:
+        raise click.BadParameter("expected YYYY-MM", param_hint="--period")
+
+    start = time.perf_counter()
+    invoices = generate_recurring_invoices(
+        period_start,
+        issue_date=issue_date.date() if issue_date else None,
+        issue=not draft,
+    )
+    elapsed = time.perf_counter() - start
+
+    if not invoices:
+        click.echo(f"No recurring invoices due for {period_key(period_start)}.")
+        return
+
+    numbered = [invoice.number for invoice in invoices if invoice.number]
+    rate = len(invoices) / elapsed if elapsed else float("inf")
+    click.echo(
+        f"Generated {len(invoices)} invoices for {period_key(period_start)} "
+        f"in {elapsed:.2f}s ({rate:.0f} invoices/s)."
+    )
+    if numbered:
+        click.echo(f"Numbers {numbered[0]} to {numbered[-1]}.")
+
+
+@click.command("send-invoices")
+@click.option("--id", "invoice_ids", type=int, multiple=True, help="Send these invoices (default: all unsent issued ones).")
+@click.option("--workers", type=int, help="Processes rendering PDFs (default: one per CPU).")
+@click.option("--dry-run", is_flag=True, help="Only list the invoices that would be sent.")
+@with_appcontext
+@tenant_option
+def send_invoices_command(invoice_ids, workers, dry_run):
+    """Email issued invoices to their customers with the PDF attached."""
+    from app.models import Invoice
+    from app.services.delivery import DeliveryError, pending_invoices, send_invoices
+
+    if invoice_ids:
+        invoices = Invoice.query.filter(Invoice.id.in_(invoice_ids), Invoice.status != "draft").all()
+    else:
+        invoices = pending_invoices().all()
+    if dry_run:
+        for invoice in invoices:
+            click.echo(f"{invoice.display_number} -> {invoice.customer.email}")
+        click.echo(f"{len(invoices)} invoices would be sent.")
+        return
+
+    start = time.perf_counter()
+    try:
+        deliveries = send_invoices(invoices, workers=workers)
+    except DeliveryError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+
+    failed = [delivery for delivery in deliveries if delivery.status != "sent"]
+    for delivery in failed:
+        click.echo(f"Invoice #{delivery.invoice_id} to {delivery.recipient or '-'} failed: {delivery.error}", err=True)
+    click.echo(f"Sent {len(deliveries) - len(failed)} invoices, {len(failed)} failed, in {elapsed:.1f}s.")
+    if failed:
+        raise SystemExit(1)
+
+
+@click.command("run-dunning")
+@click.option("--date", "today", type=click.DateTime(["%Y-%m-%d"]), help="Run as of this date (default: today).")
+@click.option("--chunk-size", default=500, show_default=True, help="Invoices per committed chunk.")
+@click.option("--send", is_flag=True, help="Email the reminders instead of only recording them.")
+@click.option("--dry-run", is_flag=True, help="Only count the reminders that are due.")
+@with_appcontext
+@tenant_option
+def run_dunning_command(today, chunk_size, send, dry_run):
+    """Record or send escalating reminders for overdue invoices."""
+    from app.services.delivery import DeliveryError
+    from app.services.dunning import DunningError, due_summary, run_dunning
+
+    today = today.date() if today else None
+    try:
+        if dry_run:
+            summary = due_summary(today, send)
+            for level, (invoices, customers) in sorted(summary.items()):
+                click.echo(f"Level {level}: {invoices} invoices of {customers} customers.")
+            click.echo(f"{sum(invoices for invoices, _ in summary.values())} reminders are due.")
+            return
+        start = time.perf_counter()
+        result = run_dunning(today, chunk_size=chunk_size, send=send)
+    except (DunningError, DeliveryError) as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+
+    levels = ", ".join(f"level {level}: {count}" for level, count in sorted(result.levels.items()))
+    click.echo(
+        f"{'Sent' if send else 'Recorded'} {result.reminders - result.failed} reminders for {result.customers} customers"
+        f"{f' ({levels})' if levels else ''} in {elapsed:.1f}s."
+    )
+    if result.failed:
+        click.echo(f"{result.failed} reminders failed and will be retried on the next run.", err=True)
+        raise SystemExit(1)
+
+
+@click.command("dispatch-webhooks")
+@click.option("--once", is_flag=True, help="Send what is due and exit instead of polling.")
+@click.option("--interval", type=float, help="Seconds between polls (default: WEBHOOK_DISPATCH_INTERVAL).")
+@click.option("--batch-size", type=int, help="Events per request (default: WEBHOOK_BATCH_SIZE).")
+@with_appcontext
+def dispatch_webhooks_command(once, interval, batch_size):
+    """Send pending webhook events and delete old delivered ones, for every tenant when multi-tenancy is enabled."""
+    from app.services.webhooks import WebhookClient, dispatch_all
+
+    interval = interval or current_app.config.get("WEBHOOK_DISPATCH_INTERVAL") or 5
+    with WebhookClient(timeout=current_app.config.get("WEBHOOK_TIMEOUT", 10)) as client:
+        while True:
+            runs = dispatch_all(client, batch_size=batch_size)
+            if once and not runs:
+                click.echo("Another process is dispatching webhooks.")
+            for slug, run in runs.items():
+                if run.batches or once:
+                    click.echo(
+                        f"{slug + ': ' if slug else ''}{run.delivered} events delivered in {run.batches} batches, "
+                        f"{run.failed} to retry, {run.dead} dead."
+                    )
+                if run.pruned:
+                    click.echo(f"{slug + ': ' if slug else ''}{run.pruned} old delivered events deleted.")
+            if once:
+                return
+            time.sleep(interval)
+
+
+@click.command("validate-vat")
+@click.option("--concurrency", type=int, help="Lookups at a time (default: VAT_LOOKUP_CONCURRENCY).")
+@click.option("--refresh", is_flag=True, help="Check all numbers, not only those without a current result.")
+@with_appcontext
+@tenant_option
+def validate_vat_command(concurrency, refresh):
+    """Validate customers' VAT numbers and cache the results."""
+    from app.services.vat import VatError, validate_customers
+
+    start = time.perf_counter()
+    try:
+        result = validate_customers(concurrency=concurrency, refresh=refresh)
+    except VatError as e:
+        raise click.ClickException(str(e))
+    statuses = ", ".join(f"{status}: {count}" for status, count in sorted(result.statuses.items()))
+    click.echo(
+        f"Checked {result.numbers} VAT numbers with {result.lookups} registry lookups"
+        f"{f' ({statuses})' if statuses else ''} in {time.perf_counter() - start:.1f}s."
+    )
+
+
+@click.command("backup")
+@click.option("--dir", "directory", help="Backup directory (default: BACKUP_DIR or instance/backups).")
+@click.option("--no-compress", is_flag=True, help="Write a plain .db file instead of .db.gz.")
+@click.option("--keep", type=int, help="Backups to keep, older ones are deleted (default: BACKUP_KEEP).")
+@click.option("--no-verify", is_flag=True, help="Skip the integrity check of the copy.")
+@click.option("--list", "list_", is_flag=True, help="Only list existing backups.")
+@with_appcontext
+@tenant_option
+def backup_command(directory, no_compress, keep, no_verify, list_):
+    """Back up the database while the app keeps running."""
+    from app.services.backup import BackupError, backup_database, list_backups
+
+    try:
+        if list_:
+            for path in list_backups(directory):
+                click.echo(f"{path}  {os.path.getsize(path):,} bytes")
+            return
+        start = time.perf_counter()
+        path = backup_database(directory, compress=not no_compress, keep=keep, verify=not no_verify)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Backed up to {path} ({os.path.getsize(path):,} bytes) in {time.perf_counter() - start:.2f}s.")
+
+
+@click.command("restore")
+@click.argument("backup", type=click.Path(exists=True, dir_okay=False))
+@click.option("--no-backup", is_flag=True, help="Don't back up the current database first.")
+@click.confirmation_option(prompt="This replaces the whole database. Stop the app first. Continue?")
+@with_appcontext
+@tenant_option
+def restore_command(backup, no_backup):
+    """Replace the database with a backup made by `flask backup`."""
+    from app.services.backup import BackupError, backup_database, restore_database
+
+    try:
+        if not no_backup:
+            # Never rotated away by this backup
+            click.echo(f"Current database backed up to {backup_database(keep=0)}.")
+        restore_database(backup)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {backup}.")
+
+
+@click.command("statement")
+@click.argument("customer_id", type=int)
+@click.option("--from", "start", type=click.DateTime(["%Y-%m-%d"]), help="First issue date (default: open invoices only).")
+@click.option("--to", "end", type=click.DateTime(["%Y-%m-%d"]), help="Last issue date.")
+@click.option("--template", default="default", show_default=True, type=click.Choice(["default", "detailed", "minimal"]))
+@click.option("--out", help="Output file (default: statement-<customer>.pdf).")
+@with_appcontext
+@tenant_option
+def statement_command(customer_id, start, end, template, out):
+    """Write a customer's statement of invoices as one PDF."""
+    from app.models import db, Customer
+    from app.services.statements import generate_statement_pdf
+
+    customer = db.session.get(Customer, customer_id)
+    if customer is None:
+        raise click.ClickException(f"Customer {customer_id} not found.")
+    started = time.perf_counter()
+    pdf_bytes = generate_statement_pdf(
+        customer, start.date() if start else None, end.date() if end else None, template=template
+    )
+    out = out or f"statement-{customer_id}.pdf"
+    with open(out, "wb") as f:
+        f.write(pdf_bytes)
+    click.echo(f"Wrote {out} ({len(pdf_bytes):,} bytes) in {time.perf_counter() - started:.2f}s.")
+
+
+@click.command("reconcile")
+@click.argument("statement", type=click.Path(exists=True, dir_okay=False))
+@click.option("--currency", help="Currency of CSV statements without a currency column (default: native).")
+@click.option("--apply", "apply_", is_flag=True, help="Mark confidently matched invoices as paid.")
+@with_appcontext
+@tenant_option
+def reconcile_command(statement, currency, apply_):
+    """Match a bank statement (CAMT.053 or CSV) against open invoices."""
+    from app.services.reconciliation import (
+        CONFIDENT_SCORE, StatementError, apply_matches, match_transactions, parse_statement
+    )
+    from app.tenancy import tenant_setting
+
+    start = time.perf_counter()
+    with open(statement, "rb") as stream:
+        try:
+            transactions = parse_statement(statement, stream, currency or tenant_setting("NATIVE_CURRENCY"))
+            matches, unmatched = match_transactions(transactions)
+        except StatementError as e:
+            raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+
+    for match in matches:
+        transaction = match.transaction
+        note = f" ({match.note})" if match.note else ""
+        click.echo(
+            f"{transaction.bank_ref}: {transaction.amount} {transaction.currency} -> "
+            f"{match.invoice.number} by {match.method}, score {match.score:.2f}{note}"
+        )
+    click.echo(f"Matched {len(matches)} of {len(matches) + len(unmatched)} payments in {elapsed:.2f}s.")
+
+    if apply_:
+        confident = [match.invoice.id for match in matches if match.score >= CONFIDENT_SCORE]
+        paid = apply_matches(confident)
+        click.echo(f"Marked {paid} invoices as paid; review the other {len(matches) - len(confident)} in the app.")
+
+
+@click.command("backfill-snapshots")
+@click.option("--chunk-size", default=500, show_default=True, help="Invoices snapshotted per transaction.")
+@with_appcontext
+@tenant_option
+def backfill_snapshots_command(chunk_size):
+    """Snapshot issued invoices from before snapshots existed, using today's data."""
+    from app.models import db
+    from app.services.snapshots import capture_snapshots, missing_snapshots
+
+    total = 0
+    while True:
+        invoice_ids = [invoice_id for (invoice_id,) in missing_snapshots().limit(chunk_size)]
+        if not invoice_ids:
+            break
+        total += capture_snapshots(invoice_ids)
+        db.session.commit()
+        # Loaded invoices are no longer needed once their chunk is written
+        db.session.expunge_all()
+        click.echo(f"Snapshotted {total} invoices...")
+    click.echo(f"Done: {total} invoices snapshotted.")
+
+
+@click.group("analytics")
+def analytics_group():
+    """Columnar snapshots and year-end reports (requires pyarrow)."""
+
+
+def _default_snapshot_dir():
+    from app.tenancy import current_tenant
+
+    tenant = current_tenant()
+    if tenant is not None:
+        return os.path.join(current_app.instance_path, "snapshot", tenant.slug)
+    return os.path.join(current_app.instance_path, "snapshot")
+
+
+@analytics_group.command("export")
+@click.option("--out", "directory", help="Snapshot directory (default: instance/snapshot).")
+@click.option("--chunk-size", default=50_000, show_default=True, help="Rows read from the database at a time.")
+@with_appcontext
+@tenant_option
+def analytics_export_command(directory, chunk_size):
+    """Export customers, invoices and items to Parquet files."""
+    from app.services.analytics import export_snapshot
+
+    directory = directory or _default_snapshot_dir()
+    start = time.perf_counter()
+    try:
+        counts = export_snapshot(directory, chunk_size=chunk_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+    summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+    click.echo(f"Exported {summary} to {directory} in {elapsed:.2f}s.")
+
+
+@analytics_group.command("report")
+@click.argument("kind", type=click.Choice(["vat", "revenue", "currency"]))
+@click.option("--snapshot", "directory", help="Snapshot directory (default: instance/snapshot).")
+@click.option("--years", help="Issue year or range, e.g. 2025 or 2023-2025 (default: all).")
+@click.option("--include-drafts", is_flag=True)
+@with_appcontext
+@tenant_option
+def analytics_report_command(kind, directory, years, include_drafts):
+    """Print a VAT, revenue or currency report from a snapshot, as CSV."""
+    import pyarrow.csv
+    from app.services import analytics
+
+    year_range = None
+    if years:
+        first, _, last = years.partition("-")
+        year_range = (int(first), int(last or first))
+    statuses = ("draft", "issued", "paid") if include_drafts else ("issued", "paid")
+
+    start = time.perf_counter()
+    table = analytics.load_snapshot(directory or _default_snapshot_dir(), years=year_range, statuses=statuses)
+    report = {
+        "vat": analytics.vat_by_rate,
+        "revenue": analytics.revenue_by_customer_month,
+        "currency": analytics.currency_breakdown,
+    }[kind](table)
+    elapsed = time.perf_counter() - start
+
+    stdout = click.get_binary_stream("stdout")
+    pyarrow.csv.write_csv(report, stdout)
+    stdout.flush()
+    click.echo(f"{report.num_rows} rows from {table.num_rows} items in {elapsed * 1000:.0f} ms.", err=True)
+
+
+@click.group("archive")
+def archive_group():
+    """Move closed fiscal years out of the live database."""
+
+
+@archive_group.command("create")
+@click.argument("year", type=int)
+@with_appcontext
+@tenant_option
+def archive_create_command(year):
+    """Archive all invoices issued in YEAR. Every invoice of the year must be paid."""
+    from app.services.archive import ArchiveError, archive_year
+
+    start = time.perf_counter()
+    try:
+        count = archive_year(year)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Archived {count} invoices of {year} in {time.perf_counter() - start:.2f}s.")
+
+
+@archive_group.command("restore")
+@click.argument("year", type=int)
+@with_appcontext
+@tenant_option
+def archive_restore_command(year):
+    """Move the invoices of an archived YEAR back into the live database."""
+    from app.services.archive import ArchiveError, restore_year
+
+    try:
+        count = restore_year(year)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {count} invoices of {year}.")
+
+
+@archive_group.command("upgrade")
+@with_appcontext
+@tenant_option
+def archive_upgrade_command():
+    """Bring archive files up to the database's schema (done by flask db upgrade too)."""
+    from app.services.archive import upgrade_archives
+
+    years = upgrade_archives()
+    click.echo(f"Upgraded {len(years)} archives" + (f" ({', '.join(map(str, years))})." if years else "."))
+
+
+@archive_group.command("list")
+@with_appcontext
+@tenant_option
+def archive_list_command():
+    """List archived years."""
+    from app.models import ArchivedYear
+
+    for archived in ArchivedYear.query.order_by(ArchivedYear.year):
+        size = os.path.getsize(archived.path) if os.path.exists(archived.path) else 0
+        click.echo(
+            f"{archived.year}: {archived.invoice_count} invoices, last {archived.last_number}, "
+            f"{size / 1024:.0f} KiB, {archived.path}"
+        )
+
+
+@click.group("tenants")
+def tenants_group():
+    """Manage tenant databases (requires TENANTS_FILE)."""
+
+
+def _selected_tenants(slugs):
+    tenancy = current_app.extensions.get("tenancy")
+    if tenancy is None:
+        raise click.ClickException("Multi-tenancy is not enabled; set TENANTS_FILE.")
+    unknown = set(slugs) - set(tenancy.tenants)
+    if unknown:
+        raise click.ClickException(f"Unknown tenants: {', '.join(sorted(unknown))}")
+    return list(slugs) or sorted(tenancy.tenants)
+
+
+@tenants_group.command("list")
+@with_appcontext
+def tenants_list_command():
+    """Show tenants with their hosts, database and schema revision."""
+    from alembic.runtime.migration import MigrationContext
+    from app.models import db
+    from app.tenancy import tenant_context
+
+    for slug in _selected_tenants([]):
+        with tenant_context(slug) as tenant:
+            revision = MigrationContext.configure(db.session.connection()).get_current_revision()
+            hosts = ", ".join(tenant.hosts) or "-"
+            click.echo(f"{slug:<20} {revision or 'empty':<14} {hosts:<30} {tenant.database_url}")
+
+
+@tenants_group.command("upgrade")
+@click.argument("slugs", nargs=-1)
+@click.option("--revision", default="head", show_default=True)
+@with_appcontext
+def tenants_upgrade_command(slugs, revision):
+    """Run database migrations for the given tenants (default: all)."""
+    from flask_migrate import upgrade
+    from app import _seed_default_optional_texts
+    from app.tenancy import tenant_context
+
+    for slug in _selected_tenants(slugs):
+        click.echo(f"Upgrading {slug}...")
+        with tenant_context(slug):
+            upgrade(revision=revision)
+            _seed_default_optional_texts()
+
+
+def register_commands(app):
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(compress_static_command)
+    app.cli.add_command(seed_sample_data_command)
+    app.cli.add_command(run_recurring_command)
+    app.cli.add_command(send_invoices_command)
+    app.cli.add_command(run_dunning_command)
+    app.cli.add_command(dispatch_webhooks_command)
+    app.cli.add_command(validate_vat_command)
+    app.cli.add_command(statement_command)
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(backup_command)
+    app.cli.add_command(restore_command)
+    app.cli.add_command(backfill_snapshots_command)
+    app.cli.add_command(analytics_group)
+    app.cli.add_command(archive_group)
+    app.cli.add_command(tenants_group)
@@ -0,0 +1,170 @@
+"""Compress responses for clients on slow links.
+
+Text responses above ``COMPRESS_MIN_SIZE`` bytes are compressed with brotli
+or gzip, whichever the client prefers (brotli needs ``pip install -r
+requirements-compression.txt``). PDFs and other binary types are left as
+they are: they are compressed already. Static files are served from the
+``.br`` and ``.gz`` variants that ``flask compress-static`` writes at deploy
+time, so they cost no CPU per request.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from functools import lru_cache
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Encodings in order of preference when the client accepts several equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Suffix of the precompressed variant of a static file, per encoding
+STATIC_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Cache-Control max-age for static URLs with a content version, which change when the file does
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def init_compression(app):
+    app.after_request(compress_response)
+    app.add_template_global(static_url)
+    app.view_functions["static"] = send_static
+
+
+def negotiate():
+    """The best encoding the client accepts, or None."""
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, encoding, dynamic=True):
+    """Compress bytes; dynamic responses trade some ratio for speed."""
+    config = current_app.config
+    if encoding == "br":
+        quality = config.get("COMPRESS_BROTLI_QUALITY", 4) if dynamic else 11
+        return brotli.compress(data, quality=quality)
+    level = config.get("COMPRESS_GZIP_LEVEL", 6) if dynamic else 9
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response):
+    response.vary.add("Accept-Encoding")
+    config = current_app.config
+    if (
+        not config.get("COMPRESS_ENABLED", True)
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in config.get("COMPRESS_MIMETYPES", ())
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < config.get("COMPRESS_MIN_SIZE", 1024):
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def send_static(filename):
+    """Serve a static file, or its precompressed variant when the client accepts it."""
+    max_age = STATIC_MAX_AGE if request.args.get("v") else None
+    path = safe_join(current_app.static_folder, filename)
+    available = _fresh_variants(path) if path is not None else []
+    encoding = request.accept_encodings.best_match(available) if available else None
+    if encoding is None:
+        response = send_from_directory(current_app.static_folder, filename, max_age=max_age)
+    else:
+        response = send_from_directory(current_app.static_folder, filename + STATIC_SUFFIXES[encoding], max_age=max_age)
+        # Typed by the original file, not by the .gz/.br suffix
+        response.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _fresh_variants(path):
+    """Encodings with a precompressed variant of path at least as new as the file itself.
+
+    A variant older than its original is left over from an earlier deploy
+    and would serve outdated content, so the original is sent instead.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return []
+    available = []
+    for encoding, suffix in STATIC_SUFFIXES.items():
+        try:
+            if os.stat(path + suffix).st_mtime >= mtime:
+                available.append(encoding)
+        except OSError:
+            continue
+    return available
+
+
+def static_url(filename):
+    """URL of a static file with a content version, so browsers can cache it for a year."""
+    return url_for("static", filename=filename, v=_static_version(current_app.static_folder, filename))
+
+
+@lru_cache(maxsize=None)
+def _static_version(static_folder, filename):
+    # Static files only change on deploy, so hash each one once per process
+    with open(os.path.join(static_folder, filename), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def compress_static(static_folder, min_size=1024):
+    """Write .gz (and .br with brotli installed) variants of every static file.
+
+    Variants that wouldn't be smaller than the original are removed. Returns
+    [(path, original size, {encoding: compressed size})].
+    """
+    results = []
+    for directory, _, filenames in os.walk(static_folder):
+        for name in sorted(filenames):
+            if name.endswith(tuple(STATIC_SUFFIXES.values())):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            sizes = {}
+            for encoding, suffix in STATIC_SUFFIXES.items():
+                variant = path + suffix
+                if os.path.exists(variant):
+                    os.remove(variant)
+                if len(data) < min_size or (encoding == "br" and brotli is None):
+                    continue
+                compressed = compress(data, encoding, dynamic=False)
+                if len(compressed) < len(data):
+                    with open(variant, "wb") as f:
+                        f.write(compressed)
+                    sizes[encoding] = len(compressed)
+            results.append((os.path.relpath(path, static_folder), len(data), sizes))
+    return results
+
+
+def stale_static_variants(static_folder):
+    """Relative paths of .gz/.br variants that are older than their original file."""
+    stale = []
+    for directory, _, filenames in os.walk(static_folder):
+        for name in sorted(filenames):
+            if name.endswith(tuple(STATIC_SUFFIXES.values())):
+                continue
+            path = os.path.join(directory, name)
+            fresh = _fresh_variants(path)
+            for encoding, suffix in STATIC_SUFFIXES.items():
+                if encoding not in fresh and os.path.exists(path + suffix):
+                    stale.append(os.path.relpath(path + suffix, static_folder))
+    return stale
@@ -1,15 +1,39 @@
+import json
+import unicodedata
 from datetime import datetime, date
 from decimal import Decimal
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
+from app.tenancy import TenantSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": TenantSession})
+
+
+def normalize_name(value):
+    """Casefold, strip accents and collapse whitespace, for prefix search."""
+    if value is None:
+        return None
+    value = "".join(c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c))
+    return " ".join(value.casefold().split())
+
+
+def normalize_vat(value):
+    """Uppercase and drop spaces and punctuation, e.g. "de 123.456" -> "DE123456"."""
+    if value is None:
+        return None
+    return "".join(c for c in value.upper() if c.isalnum()) or None
+
+
+def _normalized_default(column, normalize):
+    # Column default for Core inserts; ORM changes go through Customer's validators
+    return lambda context: normalize(context.get_current_parameters().get(column))
 
 
 class Customer(db.Model):
     __tablename__ = "customers"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(255), nullable=False)
+    name = db.Column(db.String(255), nullable=False, index=True)
     legal_name = db.Column(db.String(255))
     legal_number = db.Column(db.String(100))
     vat_number = db.Column(db.String(50))
@@ -21,13 +45,27 @@ class Customer(db.Model):
     zipcode = db.Column(db.String(20))
     country = db.Column(db.String(100))
     payment_terms = db.Column(db.Integer, default=14)  # Days until due
+    # Normalized name and VAT number for the typeahead's prefix search
+    search_name = db.Column(db.String(255), index=True, default=_normalized_default("name", normalize_name))
+    search_vat = db.Column(db.String(50), index=True, default=_normalized_default("vat_number", normalize_vat))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     invoices = db.relationship("Invoice", backref="customer", lazy="dynamic")
 
     def __repr__(self):
         return f"<Customer {self.name}>"
 
+    @validates("name")
+    def _normalize_name(self, key, value):
+        self.search_name = normalize_name(value)
+        return value
+
+    @validates("vat_number")
+    def _normalize_vat(self, key, value):
+        self.search_vat = normalize_vat(value)
+        return value
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -51,7 +89,7 @@ class Invoice(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     number = db.Column(db.String(20), unique=True, nullable=True)  # Null for drafts
-    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False, index=True)
     template = db.Column(db.String(50), default="default")
     issue_date = db.Column(db.Date, nullable=False, default=date.today)
     delivery_date = db.Column(db.Date)
@@ -61,12 +99,24 @@ class Invoice(db.Model):
     notes = db.Column(db.Text)
     optional_texts = db.Column(db.JSON, default=list)
     status = db.Column(db.String(20), default="draft")
+    recurring_invoice_id = db.Column(db.Integer, db.ForeignKey("recurring_invoices.id"))
+    recurring_period = db.Column(db.String(7))  # YYYY-MM billing period for generated invoices
+    reminder_level = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # Last reminder recorded
+    reminder_sent_level = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # Last reminder emailed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     items = db.relationship(
         "InvoiceItem", backref="invoice", lazy="dynamic", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # One generated invoice per recurring template and period
+        db.UniqueConstraint("recurring_invoice_id", "recurring_period", name="uq_invoices_recurring_period"),
+        # Overdue lookups: issued invoices by due date
+        db.Index("ix_invoices_status_due_date", "status", "due_date"),
+    )
+
     def __repr__(self):
         return f"<Invoice {self.number or f'Draft #{self.id}'}>"
 
@@ -113,13 +163,14 @@ class InvoiceItem(db.Model):
     __tablename__ = "invoice_items"
 
     id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey("invoices.id"), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey("invoices.id"), nullable=False, index=True)
     description = db.Column(db.String(500), nullable=False)
     quantity = db.Column(db.Numeric(10, 2), nullable=False, default=1)
     unit = db.Column(db.String(20), default="pcs")
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
     tax_rate = db.Column(db.Numeric(5, 2), default=0)
     position = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f"<InvoiceItem {self.description[:30]}>"
@@ -159,6 +210,7 @@ class OptionalText(db.Model):
     label = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
     default_enabled = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f"<OptionalText {self.key}>"
@@ -171,3 +223,214 @@ class OptionalText(db.Model):
             "content": self.content,
             "default_enabled": self.default_enabled,
         }
+
+
+class RecurringInvoice(db.Model):
+    __tablename__ = "recurring_invoices"
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False, index=True)
+    template = db.Column(db.String(50), default="default")
+    cadence = db.Column(db.String(20), nullable=False, default="monthly")  # monthly, quarterly, yearly
+    start_date = db.Column(db.Date, nullable=False, default=date.today)
+    end_date = db.Column(db.Date)
+    currency = db.Column(db.String(3), default="EUR")
+    exchange_rate = db.Column(db.Numeric(10, 6), default=1.0)
+    notes = db.Column(db.Text)
+    optional_texts = db.Column(db.JSON, default=list)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    customer = db.relationship("Customer")
+    items = db.relationship(
+        "RecurringInvoiceItem", backref="recurring_invoice", lazy="dynamic", cascade="all, delete-orphan"
+    )
+
+    def __repr__(self):
+        return f"<RecurringInvoice {self.id} {self.cadence}>"
+
+
+class RecurringInvoiceItem(db.Model):
+    __tablename__ = "recurring_invoice_items"
+
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_invoice_id = db.Column(
+        db.Integer, db.ForeignKey("recurring_invoices.id"), nullable=False, index=True
+    )
+    description = db.Column(db.String(500), nullable=False)
+    quantity = db.Column(db.Numeric(10, 2), nullable=False, default=1)
+    unit = db.Column(db.String(20), default="pcs")
+    unit_price = db.Column(db.Numeric(10, 2), nullable=False)
+    tax_rate = db.Column(db.Numeric(5, 2), default=0)
+    position = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return f"<RecurringInvoiceItem {self.description[:30]}>"
+
+    @property
+    def line_total(self):
+        return Decimal(str(self.quantity)) * Decimal(str(self.unit_price))
+
+
+# A closed fiscal year whose invoices were moved to a read-only archive file
+class ArchivedYear(db.Model):
+    __tablename__ = "archived_years"
+
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    path = db.Column(db.String(500), nullable=False)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    last_number = db.Column(db.String(20))  # Keeps numbering going if the year is reopened
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ArchivedYear {self.year}>"
+
+
+# Index of archived invoice IDs, so links to them keep resolving
+class ArchivedInvoice(db.Model):
+    __tablename__ = "archived_invoices"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    year = db.Column(db.Integer, db.ForeignKey("archived_years.year"), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ArchivedInvoice {self.id} ({self.year})>"
+
+
+# One attempt to email an invoice to its customer
+class InvoiceDelivery(db.Model):
+    __tablename__ = "invoice_deliveries"
+
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey("invoices.id"), nullable=False, index=True)
+    recipient = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    invoice = db.relationship(
+        "Invoice", backref=db.backref("deliveries", lazy="dynamic", order_by="InvoiceDelivery.id.desc()")
+    )
+
+    def __repr__(self):
+        return f"<InvoiceDelivery {self.invoice_id} to {self.recipient}: {self.status}>"
+
+
+# A payment reminder for an overdue invoice at one escalation level
+class InvoiceReminder(db.Model):
+    __tablename__ = "invoice_reminders"
+
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey("invoices.id"), nullable=False, index=True)
+    level = db.Column(db.Integer, nullable=False)
+    days_overdue = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)  # Outstanding, in the invoice currency
+    recipient = db.Column(db.String(200))  # Null when only recorded, not emailed
+    status = db.Column(db.String(20), nullable=False, default="recorded")  # recorded, sent, failed
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    invoice = db.relationship(
+        "Invoice", backref=db.backref("reminders", lazy="dynamic", order_by="InvoiceReminder.id.desc()")
+    )
+
+    def __repr__(self):
+        return f"<InvoiceReminder {self.invoice_id} level {self.level}: {self.status}>"
+
+
+# A change to an invoice for other systems, written in the same transaction as the change
+class OutboxEvent(db.Model):
+    __tablename__ = "outbox_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)  # invoice.created, .issued, .paid, .deleted
+    invoice_id = db.Column(db.Integer, nullable=False, index=True)  # No foreign key: deleted invoices keep theirs
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<OutboxEvent {self.id} {self.event_type} {self.invoice_id}>"
+
+    def document(self):
+        """The event as sent to webhooks."""
+        return {
+            "id": self.id,
+            "type": self.event_type,
+            "created_at": self.created_at.isoformat() + "Z",
+            "invoice": json.loads(self.payload),
+        }
+
+
+# Delivery of an outbox event to one webhook endpoint
+class WebhookDelivery(db.Model):
+    __tablename__ = "webhook_deliveries"
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey("outbox_events.id"), nullable=False, index=True)
+    endpoint = db.Column(db.String(500), nullable=False)
+    invoice_id = db.Column(db.Integer, nullable=False)  # The event's, deliveries are ordered per invoice
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    delivered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    event = db.relationship("OutboxEvent")
+
+    __table_args__ = (
+        # The dispatcher's queue: pending deliveries per endpoint and invoice
+        db.Index("ix_webhook_deliveries_queue", "status", "endpoint", "invoice_id"),
+    )
+
+    def __repr__(self):
+        return f"<WebhookDelivery {self.event_id} to {self.endpoint}: {self.status}>"
+
+
+# Cached result of validating a VAT number, shared by all customers with that number
+class VatCheck(db.Model):
+    __tablename__ = "vat_checks"
+
+    id = db.Column(db.Integer, primary_key=True)
+    vat_number = db.Column(db.String(50), nullable=False, unique=True)  # With country code, e.g. DE123456789
+    status = db.Column(db.String(20), nullable=False)  # valid, invalid, unconfirmed, unsupported
+    name = db.Column(db.String(255))  # As registered, when the registry tells
+    address = db.Column(db.Text)
+    error = db.Column(db.String(500))  # Why it's invalid or unconfirmed
+    checked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<VatCheck {self.vat_number}: {self.status}>"
+
+
+# Render context of an issued invoice, frozen so that later changes to the
+# customer, optional texts or company details don't alter the document
+class InvoiceSnapshot(db.Model):
+    __tablename__ = "invoice_snapshots"
+
+    invoice_id = db.Column(db.Integer, db.ForeignKey("invoices.id"), primary_key=True, autoincrement=False)
+    context = db.Column(db.Text, nullable=False)  # Compact JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    invoice = db.relationship(
+        "Invoice", backref=db.backref("snapshot", uselist=False, cascade="all, delete-orphan")
+    )
+
+    def __repr__(self):
+        return f"<InvoiceSnapshot {self.invoice_id}>"
+
+    @staticmethod
+    def encode(context):
+        return json.dumps(context, separators=(",", ":"), default=lambda value: value.isoformat())
+
+    def render_context(self, status):
+        """The frozen context with the invoice's current status, which still changes to paid."""
+        context = json.loads(self.context)
+        context["invoice"]["status"] = status
+        return context
@@ -1,12 +1,33 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from app.models import db, Customer
+from datetime import date
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
+from sqlalchemy import func
+from app.models import db, Customer, Invoice
+from app.services.archive import archived_years
+from app.services.customer_search import search_customers
+from app.services.http_cache import customer_validators, not_modified, with_validators
+from app.services.statements import generate_statement_pdf
+from app.services.totals import customer_totals_subquery, invoices_with_totals
+from app.services.vat import cached_result
+from app.tenancy import tenant_setting
 
 bp = Blueprint("customers", __name__, url_prefix="/customers")
 
+PER_PAGE = 50
+
+# Sort keys for the customer list, split by whether sorting needs invoice aggregates
+CUSTOMER_SORT_COLUMNS = ("name", "email", "vat_number", "city", "country")
+TOTALS_SORT_COLUMNS = ("invoice_count", "open_amount", "paid_amount", "last_issue_date")
+
 
 @bp.route("/")
 def list_customers():
     search = request.args.get("search", "")
+    sort = request.args.get("sort", "name")
+    if sort not in CUSTOMER_SORT_COLUMNS + TOTALS_SORT_COLUMNS:
+        sort = "name"
+    direction = "desc" if request.args.get("direction") == "desc" else "asc"
+    page = max(request.args.get("page", 1, type=int), 1)
+
     query = Customer.query
 
     if search:
@@ -16,8 +37,53 @@ def list_customers():
             | Customer.vat_number.ilike(f"%{search}%")
         )
 
-    customers = query.order_by(Customer.name).all()
-    return render_template("customers/list.html", customers=customers, search=search)
+    total = query.order_by(None).count()
+    pages = max((total + PER_PAGE - 1) // PER_PAGE, 1)
+    offset = (page - 1) * PER_PAGE
+
+    if sort in CUSTOMER_SORT_COLUMNS:
+        # Pick the page of customers first, then aggregate invoices for that page only
+        order_column = getattr(Customer, sort)
+        order = order_column.desc() if direction == "desc" else order_column.asc()
+        page_ids = (
+            query.with_entities(Customer.id)
+            .order_by(order, Customer.id)
+            .limit(PER_PAGE)
+            .offset(offset)
+            .subquery()
+        )
+        totals = customer_totals_subquery(db.select(page_ids.c.id))
+    else:
+        totals = customer_totals_subquery()
+
+    columns = {
+        "invoice_count": func.coalesce(totals.c.invoice_count, 0),
+        "open_amount": func.coalesce(totals.c.open_amount, 0),
+        "paid_amount": func.coalesce(totals.c.paid_amount, 0),
+        "last_issue_date": totals.c.last_issue_date,
+    }
+    rows_query = query.outerjoin(totals, totals.c.customer_id == Customer.id).add_columns(
+        *(column.label(name) for name, column in columns.items())
+    )
+
+    if sort in CUSTOMER_SORT_COLUMNS:
+        rows = rows_query.filter(Customer.id.in_(db.select(page_ids.c.id))).order_by(order, Customer.id).all()
+    else:
+        order = columns[sort].desc() if direction == "desc" else columns[sort].asc()
+        rows = rows_query.order_by(order, Customer.id).limit(PER_PAGE).offset(offset).all()
+
+    return render_template(
+        "customers/list.html",
+        rows=rows,
+        search=search,
+        sort=sort,
+        direction=direction,
+        page=page,
+        pages=pages,
+        total=total,
+        native_currency=tenant_setting("NATIVE_CURRENCY"),
+        archived_years=archived_years(),
+    )
 
 
 @bp.route("/new", methods=["GET", "POST"])
@@ -40,6 +106,7 @@ def create_customer():
         db.session.add(customer)
         db.session.commit()
         flash(f"Customer '{customer.name}' created successfully.", "success")
+        _flash_invalid_vat(customer)
         return redirect(url_for("customers.list_customers"))
 
     return render_template("customers/form.html", customer=None, default_payment_terms=14)
@@ -48,7 +115,28 @@ def create_customer():
 @bp.route("/<int:id>")
 def get_customer(id):
     customer = Customer.query.get_or_404(id)
-    return render_template("customers/detail.html", customer=customer)
+    invoices = invoices_with_totals(Invoice.customer_id == id).order_by(Invoice.issue_date.desc()).all()
+    vat = cached_result(customer.vat_number, customer.country)
+    return render_template("customers/detail.html", customer=customer, invoices=invoices, vat=vat)
+
+
+@bp.route("/<int:id>/statement")
+def statement_pdf(id):
+    customer = Customer.query.get_or_404(id)
+    try:
+        start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+    except ValueError:
+        flash("Invalid statement dates.", "error")
+        return redirect(url_for("customers.get_customer", id=id))
+
+    pdf_bytes = generate_statement_pdf(customer, start, end)
+    suffix = f"{start or 'start'}-{end or 'today'}" if start or end else "open"
+    return Response(
+        pdf_bytes,
+        mimetype="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename=statement-{customer.id}-{suffix}.pdf"},
+    )
 
 
 @bp.route("/<int:id>/edit", methods=["GET", "POST"])
@@ -71,16 +159,25 @@ def edit_customer(id):
 
         db.session.commit()
         flash(f"Customer '{customer.name}' updated successfully.", "success")
+        _flash_invalid_vat(customer)
         return redirect(url_for("customers.list_customers"))
 
     return render_template("customers/form.html", customer=customer)
 
 
+def _flash_invalid_vat(customer):
+    # Only what the cache or the local rules know; registry lookups happen in the background
+    vat = cached_result(customer.vat_number, customer.country)
+    if vat is not None and vat.status == "invalid":
+        flash(f"VAT number {vat.vat_number} looks invalid: {vat.error}", "error")
+
+
 @bp.route("/<int:id>/delete", methods=["POST"])
 def delete_customer(id):
     customer = Customer.query.get_or_404(id)
 
-    if customer.invoices.count() > 0:
+    has_invoices = db.session.query(Invoice.query.filter_by(customer_id=id).exists()).scalar()
+    if has_invoices:
         flash(f"Cannot delete customer '{customer.name}' - has existing invoices.", "error")
         return redirect(url_for("customers.list_customers"))
 
@@ -91,8 +188,20 @@ def delete_customer(id):
     return redirect(url_for("customers.list_customers"))
 
 
+@bp.route("/search")
+def search_customers_json():
+    """API endpoint for the invoice form's customer typeahead."""
+    limit = min(request.args.get("limit", 20, type=int), 50)
+    return jsonify(search_customers(request.args.get("q", ""), limit=limit))
+
+
 @bp.route("/<int:id>/json")
 def get_customer_json(id):
     """API endpoint to get customer data for invoice form."""
+    validators = customer_validators(id)
+    cached = not_modified(validators)
+    if cached:
+        return cached
+
     customer = Customer.query.get_or_404(id)
-    return jsonify(customer.to_dict())
+    return with_validators(jsonify(customer.to_dict()), validators)
@@ -1,17 +1,30 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, make_response
+from sqlalchemy import and_, extract
+from sqlalchemy.orm import contains_eager
 from app.models import db, Invoice, InvoiceItem, Customer, OptionalText
+from app.services.archive import archive_session, archived_years, get_invoice_or_404
+from app.services.delivery import DeliveryError, send_invoice
+from app.services.dunning import overdue_criteria
+from app.services.invoice_status import issue_invoices, mark_invoices_paid
 from app.services.numbering import generate_invoice_number
 from app.services.pdf import generate_invoice_pdf, render_invoice_html
+from app.services.http_cache import invoice_validators, not_modified, with_validators
+from app.services.snapshots import capture_snapshot
+from app.services.webhooks import record_invoice_event
+from app.services.totals import invoices_with_totals, totals_by_status
+from app.services.vat import REVERSE_CHARGE_TEXT, reverse_charge_error
+from app.tenancy import tenant_setting
 
 bp = Blueprint("invoices", __name__, url_prefix="/invoices")
 
+# Skipped invoices listed individually after a bulk action
+BULK_ERRORS_SHOWN = 10
+
 
 @bp.route("/")
 def list_invoices():
-    from sqlalchemy import extract, func
-
     status = request.args.get("status", "")
     search = request.args.get("search", "")
 
@@ -21,6 +34,8 @@ def list_invoices():
         extract("year", Invoice.issue_date).label("year")
     ).distinct().order_by(extract("year", Invoice.issue_date).desc()).all()
     years = [int(y.year) for y in years_query if y.year]
+    archived = archived_years()
+    years.extend(year for year in archived if year not in years)
     if current_year not in years:
         years.insert(0, current_year)
     years.sort(reverse=True)
@@ -30,41 +45,43 @@ def list_invoices():
     if selected_year not in years:
         selected_year = current_year
 
-    # Base query for selected year
-    query = Invoice.query.join(Customer).filter(
-        extract("year", Invoice.issue_date) == selected_year
-    )
-
-    if status:
-        query = query.filter(Invoice.status == status)
+    # Archived years are read from their own archive file
+    is_archived = selected_year in archived
+    session = archive_session(selected_year) if is_archived else db.session
 
-    if search:
-        query = query.filter(
-            Invoice.number.ilike(f"%{search}%") | Customer.name.ilike(f"%{search}%")
-        )
+    # Base query for selected year, with totals summed in SQL and customers loaded by the same join
+    query = _filter_invoices(invoices_with_totals(session=session), selected_year, status, search)
+    query = query.options(contains_eager(Invoice.customer)).group_by(Customer.id)
 
     # Order by invoice number DESC (drafts without numbers go to end)
     invoices = query.order_by(Invoice.number.desc().nullslast(), Invoice.created_at.desc()).all()
 
     # Financial sums for selected year (in native currency)
-    year_invoices = Invoice.query.filter(
-        extract("year", Invoice.issue_date) == selected_year
-    ).all()
+    today = date.today()
+    by_status = totals_by_status(
+        extract("year", Invoice.issue_date) == selected_year,
+        session=session,
+        overdue=and_(*overdue_criteria(today)),
+    )
+    amounts = {name: total for name, (_, total) in by_status.items()}
+    counts = {name: count for name, (count, _) in by_status.items()}
 
-    native_currency = current_app.config["NATIVE_CURRENCY"]
+    native_currency = tenant_setting("NATIVE_CURRENCY")
     sums = {
-        "paid": sum(inv.native_total for inv in year_invoices if inv.status == "paid"),
-        "pending": sum(inv.native_total for inv in year_invoices if inv.status == "issued"),
-        "draft": sum(inv.native_total for inv in year_invoices if inv.status == "draft"),
-        "total": sum(inv.native_total for inv in year_invoices),
+        "paid": amounts.get("paid", 0),
+        "pending": amounts.get("issued", 0),
+        "overdue": amounts.get("overdue", 0),
+        "draft": amounts.get("draft", 0),
+        "total": sum(amount for name, amount in amounts.items() if name != "overdue"),
     }
 
     # Count stats for selected year
     stats = {
-        "total": len(year_invoices),
-        "draft": sum(1 for inv in year_invoices if inv.status == "draft"),
-        "issued": sum(1 for inv in year_invoices if inv.status == "issued"),
-        "paid": sum(1 for inv in year_invoices if inv.status == "paid"),
+        "total": sum(count for name, count in counts.items() if name != "overdue"),
+        "draft": counts.get("draft", 0),
+        "issued": counts.get("issued", 0),
+        "overdue": counts.get("overdue", 0),
+        "paid": counts.get("paid", 0),
     }
 
     return render_template(
@@ -76,13 +93,67 @@ def list_invoices():
         sums=sums,
         years=years,
         selected_year=selected_year,
+        is_archived=is_archived,
         native_currency=native_currency,
+        today=today,
     )
 
 
+def _filter_invoices(query, year, status, search):
+    """Apply the invoice list's year, status and search filters to a query."""
+    query = query.join(Customer, Customer.id == Invoice.customer_id).filter(
+        extract("year", Invoice.issue_date) == year
+    )
+
+    if status == "overdue":
+        # Issued and past due, a range scan of the (status, due_date) index
+        query = query.filter(*overdue_criteria())
+    elif status:
+        query = query.filter(Invoice.status == status)
+
+    if search:
+        query = query.filter(
+            Invoice.number.ilike(f"%{search}%") | Customer.name.ilike(f"%{search}%")
+        )
+    return query
+
+
+@bp.route("/bulk", methods=["POST"])
+def bulk_action():
+    action = request.form.get("action")
+    year = request.form.get("year", type=int, default=date.today().year)
+    status = request.form.get("status", "")
+    search = request.form.get("search", "")
+    list_url = url_for("invoices.list_invoices", year=year, status=status or None, search=search or None)
+
+    if request.form.get("scope") == "all":
+        # Everything matching the list's filter, resolved in SQL
+        invoice_ids = _filter_invoices(db.session.query(Invoice.id), year, status, search).statement
+    else:
+        invoice_ids = request.form.getlist("invoice_ids", type=int)
+        if not invoice_ids:
+            flash("No invoices selected.", "error")
+            return redirect(list_url)
+
+    if action == "issue":
+        issued, errors = issue_invoices(invoice_ids)
+        flash(f"{len(issued)} invoices issued.", "success")
+    elif action == "paid":
+        paid, errors = mark_invoices_paid(invoice_ids)
+        flash(f"{paid} invoices marked as paid.", "success")
+    else:
+        flash("Unknown action.", "error")
+        return redirect(list_url)
+
+    for invoice, error in errors[:BULK_ERRORS_SHOWN]:
+        flash(f"{invoice.display_number} {error}.", "error")
+    if len(errors) > BULK_ERRORS_SHOWN:
+        flash(f"{len(errors) - BULK_ERRORS_SHOWN} more invoices were skipped.", "error")
+    return redirect(list_url)
+
+
 @bp.route("/new", methods=["GET", "POST"])
 def create_invoice():
-    customers = Customer.query.order_by(Customer.name).all()
     optional_texts = OptionalText.query.all()
     templates = ["default", "detailed", "minimal"]
 
@@ -93,10 +164,9 @@ def create_invoice():
             return render_template(
                 "invoices/form.html",
                 invoice=None,
-                customers=customers,
                 optional_texts=optional_texts,
                 templates=templates,
-                native_currency=current_app.config["NATIVE_CURRENCY"],
+                native_currency=tenant_setting("NATIVE_CURRENCY"),
             )
 
         # Get enabled optional texts from form
@@ -108,6 +178,11 @@ def create_invoice():
         # Check action: save as draft or create & issue
         action = request.form.get("action", "save")
         is_issuing = action == "issue"
+        if is_issuing and REVERSE_CHARGE_TEXT in enabled_texts:
+            error = reverse_charge_error(int(customer_id))
+            if error:
+                flash(f"Saved as a draft instead of issuing: {error}.", "error")
+                is_issuing = False
 
         # Assign invoice number only when issuing
         invoice_number = None
@@ -118,7 +193,7 @@ def create_invoice():
 
         # Parse exchange rate
         currency = request.form.get("currency", "EUR")
-        native_currency = current_app.config["NATIVE_CURRENCY"]
+        native_currency = tenant_setting("NATIVE_CURRENCY")
         if currency == native_currency:
             exchange_rate = Decimal("1.0")
         else:
@@ -165,6 +240,11 @@ def create_invoice():
                 )
                 db.session.add(item)
 
+        if is_issuing:
+            capture_snapshot(invoice)
+            record_invoice_event(invoice, "invoice.created", "invoice.issued")
+        else:
+            record_invoice_event(invoice, "invoice.created")
         db.session.commit()
 
         if is_issuing:
@@ -187,7 +267,6 @@ def create_invoice():
     return render_template(
         "invoices/form.html",
         invoice=None,
-        customers=customers,
         optional_texts=optional_texts,
         templates=templates,
         today=today,
@@ -195,14 +274,34 @@ def create_invoice():
         default_enabled=default_enabled,
         next_number=next_number,
         default_payment_days=default_payment_days,
-        native_currency=current_app.config["NATIVE_CURRENCY"],
+        native_currency=tenant_setting("NATIVE_CURRENCY"),
     )
 
 
 @bp.route("/<int:id>")
 def get_invoice(id):
-    invoice = Invoice.query.get_or_404(id)
-    return render_template("invoices/detail.html", invoice=invoice)
+    validators = invoice_validators(id, "detail")
+    cached = not_modified(validators)
+    if cached:
+        return cached
+
+    invoice = get_invoice_or_404(id)
+    # Loaded once; the invoice's total properties would query the items again each
+    items = invoice.items.order_by(InvoiceItem.position).all()
+    subtotal = sum(item.line_total for item in items)
+    tax_total = sum(item.tax_amount for item in items)
+    totals = {"subtotal": subtotal, "tax": tax_total, "total": subtotal + tax_total}
+    overdue_days = (date.today() - invoice.due_date).days if invoice.status == "issued" else 0
+    response = make_response(
+        render_template(
+            "invoices/detail.html",
+            invoice=invoice,
+            items=items,
+            totals=totals,
+            overdue_days=max(overdue_days, 0),
+        )
+    )
+    return with_validators(response, validators)
 
 
 @bp.route("/<int:id>/edit", methods=["GET", "POST"])
@@ -213,7 +312,6 @@ def edit_invoice(id):
         flash("Only draft invoices can be edited.", "error")
         return redirect(url_for("invoices.get_invoice", id=id))
 
-    customers = Customer.query.order_by(Customer.name).all()
     optional_texts = OptionalText.query.all()
     templates = ["default", "detailed", "minimal"]
 
@@ -230,7 +328,7 @@ def edit_invoice(id):
         invoice.currency = request.form.get("currency", "EUR")
 
         # Parse exchange rate
-        native_currency = current_app.config["NATIVE_CURRENCY"]
+        native_currency = tenant_setting("NATIVE_CURRENCY")
         if invoice.currency == native_currency:
             invoice.exchange_rate = Decimal("1.0")
         else:
@@ -242,6 +340,11 @@ def edit_invoice(id):
         # Check action: save as draft or issue
         action = request.form.get("action", "save")
         is_issuing = action == "issue"
+        if is_issuing and REVERSE_CHARGE_TEXT in invoice.optional_texts:
+            error = reverse_charge_error(invoice.customer_id)
+            if error:
+                flash(f"Saved as a draft instead of issuing: {error}.", "error")
+                is_issuing = False
 
         # Assign invoice number if issuing
         if is_issuing and not invoice.number:
@@ -250,8 +353,10 @@ def edit_invoice(id):
             invoice.number = provided_number if provided_number else generate_invoice_number(invoice.issue_date)
             invoice.status = "issued"
 
-        # Remove existing items
+        # Remove existing items; the bulk delete doesn't touch the invoice row, so
+        # bump its timestamp to invalidate cached renders
         InvoiceItem.query.filter_by(invoice_id=invoice.id).delete()
+        invoice.updated_at = datetime.utcnow()
 
         # Add new items
         descriptions = request.form.getlist("item_description[]")
@@ -273,6 +378,9 @@ def edit_invoice(id):
                 )
                 db.session.add(item)
 
+        if invoice.status == "issued":
+            capture_snapshot(invoice)
+            record_invoice_event(invoice, "invoice.issued")
         db.session.commit()
 
         if is_issuing:
@@ -295,13 +403,12 @@ def edit_invoice(id):
     return render_template(
         "invoices/form.html",
         invoice=invoice,
-        customers=customers,
         optional_texts=optional_texts,
         templates=templates,
         default_enabled=invoice.optional_texts or [],
         default_payment_days=default_payment_days,
         next_number=next_number,
-        native_currency=current_app.config["NATIVE_CURRENCY"],
+        native_currency=tenant_setting("NATIVE_CURRENCY"),
     )
 
 
@@ -314,6 +421,7 @@ def delete_invoice(id):
         return redirect(url_for("invoices.list_invoices"))
 
     display = invoice.display_number
+    record_invoice_event(invoice, "invoice.deleted")
     db.session.delete(invoice)
     db.session.commit()
     flash(f"{display} deleted.", "success")
@@ -322,23 +430,34 @@ def delete_invoice(id):
 
 @bp.route("/<int:id>/pdf")
 def download_pdf(id):
-    invoice = Invoice.query.get_or_404(id)
+    validators = invoice_validators(id, "pdf")
+    cached = not_modified(validators)
+    if cached:
+        return cached
+
+    invoice = get_invoice_or_404(id)
     pdf_bytes = generate_invoice_pdf(invoice)
 
-    return Response(
+    response = Response(
         pdf_bytes,
         mimetype="application/pdf",
         headers={
             "Content-Disposition": f"attachment; filename=invoice-{invoice.display_number}.pdf"
         },
     )
+    return with_validators(response, validators)
 
 
 @bp.route("/<int:id>/preview")
 def preview_invoice(id):
-    invoice = Invoice.query.get_or_404(id)
+    validators = invoice_validators(id, "preview")
+    cached = not_modified(validators)
+    if cached:
+        return cached
+
+    invoice = get_invoice_or_404(id)
     html = render_invoice_html(invoice)
-    return html
+    return with_validators(make_response(html), validators)
 
 
 @bp.route("/<int:id>/issue", methods=["POST"])
@@ -349,16 +468,45 @@ def issue_invoice(id):
         flash("Only draft invoices can be issued.", "error")
         return redirect(url_for("invoices.get_invoice", id=id))
 
+    if REVERSE_CHARGE_TEXT in (invoice.optional_texts or []):
+        error = reverse_charge_error(invoice.customer_id)
+        if error:
+            flash(f"Invoice not issued: {error}.", "error")
+            return redirect(url_for("invoices.get_invoice", id=id))
+
     # Assign invoice number if not already assigned
     if not invoice.number:
         invoice.number = generate_invoice_number(invoice.issue_date)
 
     invoice.status = "issued"
+    capture_snapshot(invoice)
+    record_invoice_event(invoice, "invoice.issued")
     db.session.commit()
     flash(f"Invoice {invoice.number} has been issued.", "success")
     return redirect(url_for("invoices.get_invoice", id=id))
 
 
+@bp.route("/<int:id>/send", methods=["POST"])
+def email_invoice(id):
+    invoice = Invoice.query.get_or_404(id)
+
+    if invoice.status == "draft":
+        flash("Issue the invoice before sending it.", "error")
+        return redirect(url_for("invoices.get_invoice", id=id))
+
+    try:
+        delivery = send_invoice(invoice)
+    except DeliveryError as e:
+        flash(str(e), "error")
+        return redirect(url_for("invoices.get_invoice", id=id))
+
+    if delivery.status == "sent":
+        flash(f"Invoice {invoice.number} has been sent to {delivery.recipient}.", "success")
+    else:
+        flash(f"Sending invoice {invoice.number} failed: {delivery.error}", "error")
+    return redirect(url_for("invoices.get_invoice", id=id))
+
+
 @bp.route("/<int:id>/paid", methods=["POST"])
 def mark_paid(id):
     invoice = Invoice.query.get_or_404(id)
@@ -368,6 +516,7 @@ def mark_paid(id):
         return redirect(url_for("invoices.get_invoice", id=id))
 
     invoice.status = "paid"
+    record_invoice_event(invoice, "invoice.paid")
     db.session.commit()
     flash(f"Invoice {invoice.number} marked as paid.", "success")
     return redirect(url_for("invoices.get_invoice", id=id))
@@ -0,0 +1,53 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from app.services.reconciliation import (
+    CONFIDENT_SCORE, StatementError, apply_matches, match_transactions, parse_statement
+)
+from app.tenancy import tenant_setting
+
+bp = Blueprint("reconciliation", __name__, url_prefix="/reconciliation")
+
+
+@bp.route("/", methods=["GET", "POST"])
+def import_statement():
+    if request.method == "GET":
+        return render_template("reconciliation/import.html", native_currency=tenant_setting("NATIVE_CURRENCY"))
+
+    statement = request.files.get("statement")
+    if not statement or not statement.filename:
+        flash("Please choose a statement file.", "error")
+        return redirect(url_for("reconciliation.import_statement"))
+
+    try:
+        transactions = parse_statement(
+            statement.filename,
+            statement.stream,
+            default_currency=request.form.get("currency") or tenant_setting("NATIVE_CURRENCY"),
+        )
+        matches, unmatched = match_transactions(transactions)
+    except StatementError as e:
+        flash(str(e), "error")
+        return redirect(url_for("reconciliation.import_statement"))
+
+    return render_template(
+        "reconciliation/review.html",
+        filename=statement.filename,
+        matches=matches,
+        unmatched=unmatched,
+        confident_score=CONFIDENT_SCORE,
+    )
+
+
+@bp.route("/apply", methods=["POST"])
+def apply():
+    invoice_ids = request.form.getlist("invoice_ids", type=int)
+    if not invoice_ids:
+        flash("No matches selected.", "error")
+        return redirect(url_for("reconciliation.import_statement"))
+
+    paid = apply_matches(invoice_ids)
+    skipped = len(invoice_ids) - paid
+    message = f"{paid} invoices marked as paid."
+    if skipped:
+        message += f" {skipped} were skipped because they are no longer open."
+    flash(message, "success")
+    return redirect(url_for("invoices.list_invoices"))
@@ -0,0 +1,144 @@
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app.models import db, Invoice, OptionalText, RecurringInvoice, RecurringInvoiceItem
+from app.services.recurring import CADENCE_MONTHS, create_recurring_from_invoice
+from app.services.totals import item_total_with_tax
+from app.tenancy import tenant_setting
+
+bp = Blueprint("recurring", __name__, url_prefix="/recurring")
+
+
+@bp.route("/")
+def list_recurring():
+    # Per-template item totals and last generated period, each in one grouped query
+    totals = dict(
+        db.session.query(
+            RecurringInvoiceItem.recurring_invoice_id,
+            func.sum(item_total_with_tax(RecurringInvoiceItem)),
+        )
+        .group_by(RecurringInvoiceItem.recurring_invoice_id)
+        .all()
+    )
+    last_periods = dict(
+        db.session.query(Invoice.recurring_invoice_id, func.max(Invoice.recurring_period))
+        .filter(Invoice.recurring_invoice_id.isnot(None))
+        .group_by(Invoice.recurring_invoice_id)
+        .all()
+    )
+
+    recurring_invoices = (
+        RecurringInvoice.query.options(joinedload(RecurringInvoice.customer))
+        .order_by(RecurringInvoice.active.desc(), RecurringInvoice.id)
+        .all()
+    )
+    return render_template(
+        "recurring/list.html",
+        recurring_invoices=recurring_invoices,
+        totals=totals,
+        last_periods=last_periods,
+    )
+
+
+@bp.route("/from-invoice/<int:invoice_id>", methods=["POST"])
+def create_from_invoice(invoice_id):
+    invoice = Invoice.query.get_or_404(invoice_id)
+    cadence = request.form.get("cadence", "monthly")
+
+    if cadence not in CADENCE_MONTHS:
+        flash(f"Unknown cadence '{cadence}'.", "error")
+        return redirect(url_for("invoices.get_invoice", id=invoice_id))
+
+    recurring = create_recurring_from_invoice(invoice, cadence)
+    flash(
+        f"{invoice.display_number} will repeat {cadence} from {recurring.start_date:%Y-%m}.",
+        "success",
+    )
+    return redirect(url_for("recurring.list_recurring"))
+
+
+@bp.route("/<int:id>/edit", methods=["GET", "POST"])
+def edit_recurring(id):
+    recurring = RecurringInvoice.query.get_or_404(id)
+
+    if request.method == "POST":
+        cadence = request.form.get("cadence", "monthly")
+        end_date = date.fromisoformat(request.form["end_date"]) if request.form.get("end_date") else None
+        if cadence not in CADENCE_MONTHS:
+            flash(f"Unknown cadence '{cadence}'.", "error")
+            return redirect(url_for("recurring.edit_recurring", id=id))
+        if end_date and end_date < recurring.start_date:
+            flash(f"The end date can't be before the start, {recurring.start_date:%Y-%m}.", "error")
+            return redirect(url_for("recurring.edit_recurring", id=id))
+
+        recurring.cadence = cadence
+        recurring.end_date = end_date
+        recurring.template = request.form.get("template", "default")
+        recurring.currency = request.form.get("currency", "EUR")
+        if recurring.currency == tenant_setting("NATIVE_CURRENCY"):
+            recurring.exchange_rate = Decimal("1.0")
+        else:
+            recurring.exchange_rate = Decimal(request.form.get("exchange_rate") or "1.0")
+        recurring.notes = request.form.get("notes")
+        recurring.optional_texts = request.form.getlist("optional_texts")
+
+        # Replace the items; invoices generated so far keep their own copies
+        RecurringInvoiceItem.query.filter_by(recurring_invoice_id=recurring.id).delete()
+        recurring.updated_at = datetime.utcnow()
+
+        descriptions = request.form.getlist("item_description[]")
+        quantities = request.form.getlist("item_quantity[]")
+        units = request.form.getlist("item_unit[]")
+        prices = request.form.getlist("item_price[]")
+        tax_rates = request.form.getlist("item_tax[]")
+
+        for i, desc in enumerate(descriptions):
+            if desc.strip():
+                db.session.add(
+                    RecurringInvoiceItem(
+                        recurring_invoice_id=recurring.id,
+                        description=desc,
+                        quantity=float(quantities[i]) if quantities[i] else 1,
+                        unit=units[i] if units[i] else "pcs",
+                        unit_price=float(prices[i]) if prices[i] else 0,
+                        tax_rate=float(tax_rates[i]) if tax_rates[i] else 0,
+                        position=i,
+                    )
+                )
+        db.session.commit()
+        flash(f"Recurring invoice for {recurring.customer.name} updated.", "success")
+        return redirect(url_for("recurring.list_recurring"))
+
+    return render_template(
+        "recurring/form.html",
+        recurring=recurring,
+        items=recurring.items.order_by(RecurringInvoiceItem.position).all(),
+        cadences=list(CADENCE_MONTHS),
+        optional_texts=OptionalText.query.all(),
+        templates=["default", "detailed", "minimal"],
+        native_currency=tenant_setting("NATIVE_CURRENCY"),
+    )
+
+
+@bp.route("/<int:id>/toggle", methods=["POST"])
+def toggle_recurring(id):
+    recurring = RecurringInvoice.query.get_or_404(id)
+    recurring.active = not recurring.active
+    db.session.commit()
+    flash(f"Recurring invoice for {recurring.customer.name} {'resumed' if recurring.active else 'paused'}.", "success")
+    return redirect(url_for("recurring.list_recurring"))
+
+
+@bp.route("/<int:id>/delete", methods=["POST"])
+def delete_recurring(id):
+    recurring = RecurringInvoice.query.get_or_404(id)
+    name = recurring.customer.name
+
+    # Keep invoices generated so far, just detach them from the template
+    Invoice.query.filter_by(recurring_invoice_id=id).update({"recurring_invoice_id": None})
+    db.session.delete(recurring)
+    db.session.commit()
+    flash(f"Recurring invoice for {name} deleted.", "success")
+    return redirect(url_for("recurring.list_recurring"))
@@ -1,5 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
-from app.models import db, OptionalText
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from sqlalchemy.orm import joinedload
+from app.models import db, OptionalText, WebhookDelivery
+from app.services.pdf import get_company_info
+from app.services.webhooks import delivery_counts, retry_dead, webhook_endpoints
+
+# Dead-lettered deliveries listed on the webhooks page
+DEAD_LETTERS_SHOWN = 100
 
 bp = Blueprint("settings", __name__, url_prefix="/settings")
 
@@ -7,21 +13,7 @@ bp = Blueprint("settings", __name__, url_prefix="/settings")
 @bp.route("/")
 def index():
     optional_texts = OptionalText.query.all()
-    company = {
-        "name": current_app.config.get("COMPANY_NAME"),
-        "legal_name": current_app.config.get("COMPANY_LEGAL_NAME"),
-        "legal_number": current_app.config.get("COMPANY_LEGAL_NUMBER"),
-        "address": current_app.config.get("COMPANY_ADDRESS"),
-        "city": current_app.config.get("COMPANY_CITY"),
-        "zipcode": current_app.config.get("COMPANY_ZIPCODE"),
-        "country": current_app.config.get("COMPANY_COUNTRY"),
-        "vat_number": current_app.config.get("COMPANY_VAT_NUMBER"),
-        "email": current_app.config.get("COMPANY_EMAIL"),
-        "phone": current_app.config.get("COMPANY_PHONE"),
-        "bank_name": current_app.config.get("COMPANY_BANK_NAME"),
-        "iban": current_app.config.get("COMPANY_IBAN"),
-        "swift": current_app.config.get("COMPANY_SWIFT"),
-    }
+    company = get_company_info()
     return render_template("settings/index.html", optional_texts=optional_texts, company=company)
 
 
@@ -72,3 +64,29 @@ def delete_optional_text(id):
     db.session.commit()
     flash(f"Optional text '{label}' deleted.", "success")
     return redirect(url_for("settings.index"))
+
+
+@bp.route("/webhooks")
+def webhooks():
+    dead = (
+        WebhookDelivery.query.options(joinedload(WebhookDelivery.event))
+        .filter(WebhookDelivery.status == "dead")
+        .order_by(WebhookDelivery.id.desc())
+        .limit(DEAD_LETTERS_SHOWN)
+        .all()
+    )
+    return render_template(
+        "settings/webhooks.html",
+        endpoints=webhook_endpoints(),
+        counts=delivery_counts(),
+        dead=dead,
+        dead_shown=DEAD_LETTERS_SHOWN,
+    )
+
+
+@bp.route("/webhooks/retry", methods=["POST"])
+def retry_webhooks():
+    delivery_ids = request.form.getlist("delivery_ids", type=int)
+    retried = retry_dead(delivery_ids or None)
+    flash(f"{retried} webhook deliveries queued again.", "success")
+    return redirect(url_for("settings.webhooks"))
@@ -0,0 +1,219 @@
+"""Columnar snapshots of invoicing data and reports computed over them.
+
+Needs pyarrow (``pip install -r requirements-analytics.txt``). Amounts are
+stored as float64, which is plenty for reporting; round results to cents.
+"""
+import json
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+from datetime import datetime
+from sqlalchemy import Float, cast, select
+from app.models import db, ArchivedYear, Customer, Invoice, InvoiceItem
+from app.services.archive import _read_only_engine
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pc = pq = None
+
+MANIFEST = "manifest.json"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Analytics snapshots need pyarrow: pip install -r requirements-analytics.txt")
+
+
+def _tables():
+    """Snapshot tables as (name, select statement, arrow schema)."""
+    return [
+        (
+            "customers",
+            select(Customer.id, Customer.name, Customer.country, Customer.vat_number).order_by(Customer.id),
+            pa.schema([
+                ("id", pa.int64()),
+                ("name", pa.string()),
+                ("country", pa.string()),
+                ("vat_number", pa.string()),
+            ]),
+        ),
+        (
+            "invoices",
+            select(
+                Invoice.id,
+                Invoice.number,
+                Invoice.customer_id,
+                Invoice.issue_date,
+                Invoice.due_date,
+                Invoice.currency,
+                cast(Invoice.exchange_rate, Float),
+                Invoice.status,
+            ).order_by(Invoice.id),
+            pa.schema([
+                ("id", pa.int64()),
+                ("number", pa.string()),
+                ("customer_id", pa.int64()),
+                ("issue_date", pa.date32()),
+                ("due_date", pa.date32()),
+                ("currency", pa.string()),
+                ("exchange_rate", pa.float64()),
+                ("status", pa.string()),
+            ]),
+        ),
+        (
+            "items",
+            select(
+                InvoiceItem.invoice_id,
+                cast(InvoiceItem.quantity, Float),
+                cast(InvoiceItem.unit_price, Float),
+                cast(InvoiceItem.tax_rate, Float),
+            ).order_by(InvoiceItem.id),
+            pa.schema([
+                ("invoice_id", pa.int64()),
+                ("quantity", pa.float64()),
+                ("unit_price", pa.float64()),
+                ("tax_rate", pa.float64()),
+            ]),
+        ),
+    ]
+
+
+def export_snapshot(directory, chunk_size=50_000):
+    """Write customers, invoices and items to Parquet files in ``directory``.
+
+    Rows are streamed from the database, and then from each archived year's
+    file, ``chunk_size`` at a time, so memory use stays bounded however large
+    the tables are. Customers copied into archives are written once. The
+    snapshot is built in a temporary directory and renamed into place at the
+    end, so readers never see a half-written one. Returns the row count per
+    table.
+    """
+    _require_pyarrow()
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    archives = ArchivedYear.query.order_by(ArchivedYear.year).all()
+    for archived in archives:
+        if not os.path.exists(archived.path):
+            raise RuntimeError(f"The archive of {archived.year} is missing: {archived.path}")
+    staging = tempfile.mkdtemp(prefix=".snapshot-", dir=parent)
+
+    counts = {}
+    customer_ids = set()
+    try:
+        with ExitStack() as stack:
+            sources = [db.session] + [
+                stack.enter_context(_read_only_engine(archived.path).connect()) for archived in archives
+            ]
+            for name, stmt, schema in _tables():
+                counts[name] = 0
+                path = os.path.join(staging, f"{name}.parquet")
+                with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+                    for source in sources:
+                        result = source.execute(stmt.execution_options(yield_per=chunk_size))
+                        for rows in result.partitions():
+                            if name == "customers":
+                                # Archives keep copies of their customers, most of them still live
+                                rows = [row for row in rows if row.id not in customer_ids]
+                                customer_ids.update(row.id for row in rows)
+                                if not rows:
+                                    continue
+                            columns = list(zip(*rows))
+                            batch = pa.RecordBatch.from_arrays(
+                                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                schema=schema,
+                            )
+                            writer.write_batch(batch)
+                            counts[name] += len(rows)
+
+        with open(os.path.join(staging, MANIFEST), "w") as f:
+            json.dump(
+                {
+                    "created_at": datetime.utcnow().isoformat(),
+                    "rows": counts,
+                    "archived_years": [archived.year for archived in archives],
+                },
+                f,
+            )
+
+        # Two renames leave no snapshot for a moment only; deleting the old one comes after
+        retired = staging + "-old"
+        if os.path.exists(directory):
+            os.replace(directory, retired)
+        try:
+            os.replace(staging, directory)
+        except BaseException:
+            if os.path.exists(retired):
+                os.replace(retired, directory)
+            raise
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    shutil.rmtree(retired, ignore_errors=True)
+    return counts
+
+
+def load_snapshot(directory, years=None, statuses=("issued", "paid")):
+    """Load a snapshot as one item-level table joined with its invoice and customer.
+
+    ``years`` is an optional (first, last) range of issue years. Drafts are
+    left out by default. Adds computed ``net``, ``tax``, ``gross`` and
+    ``native_gross`` columns.
+    """
+    _require_pyarrow()
+    invoices = pq.read_table(os.path.join(directory, "invoices.parquet"))
+    mask = pc.is_in(invoices["status"], value_set=pa.array(list(statuses)))
+    if years:
+        issue_year = pc.year(invoices["issue_date"])
+        mask = pc.and_(mask, pc.and_(pc.greater_equal(issue_year, years[0]), pc.less_equal(issue_year, years[1])))
+    invoices = invoices.filter(mask)
+
+    items = pq.read_table(os.path.join(directory, "items.parquet"))
+    customers = pq.read_table(os.path.join(directory, "customers.parquet"), columns=["id", "name"])
+
+    table = items.join(invoices, keys="invoice_id", right_keys="id", join_type="inner")
+    table = table.join(
+        customers.rename_columns(["customer_id", "customer_name"]), keys="customer_id", join_type="left outer"
+    )
+
+    net = pc.multiply(table["quantity"], table["unit_price"])
+    tax = pc.divide(pc.multiply(net, pc.fill_null(table["tax_rate"], 0.0)), 100.0)
+    gross = pc.add(net, tax)
+    native_gross = pc.multiply(gross, pc.fill_null(table["exchange_rate"], 1.0))
+    month = pc.strftime(table["issue_date"], format="%Y-%m")
+    return (
+        table.append_column("net", net)
+        .append_column("tax", tax)
+        .append_column("gross", gross)
+        .append_column("native_gross", native_gross)
+        .append_column("month", month)
+    )
+
+
+def vat_by_rate(table):
+    """Net amount and VAT per currency and tax rate."""
+    return _aggregate(table, ["currency", "tax_rate"], [("net", "sum"), ("tax", "sum")])
+
+
+def revenue_by_customer_month(table):
+    """Gross revenue per customer and month, in native currency."""
+    return _aggregate(
+        table, ["customer_id", "customer_name", "month"], [("native_gross", "sum"), ("invoice_id", "count_distinct")]
+    )
+
+
+def currency_breakdown(table):
+    """Gross amount per currency, in that currency and in native currency."""
+    return _aggregate(table, ["currency"], [("gross", "sum"), ("native_gross", "sum"), ("invoice_id", "count_distinct")])
+
+
+def _aggregate(table, keys, aggregations):
+    result = table.group_by(keys).aggregate(aggregations)
+    # Round summed amounts to cents
+    for i, field in enumerate(result.schema):
+        if field.name not in keys and pa.types.is_floating(field.type):
+            result = result.set_column(i, field.name, pc.round(result[field.name], 2))
+    return result.sort_by([(key, "ascending") for key in keys])
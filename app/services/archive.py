@@ -0,0 +1,249 @@
+"""Move closed fiscal years out of the live database into per-year archive files.
+
+An archive is a compact SQLite file with the same customers, invoices and
+invoice_items tables as the live database, opened read-only. Because the
+schema matches, the regular models and templates work on archived invoices
+through a separate session from :func:`archive_session`. Requests never
+write to an archive: migrations bring archive files up to date with
+:func:`upgrade_archives`.
+"""
+import os
+from datetime import date
+from flask import abort, current_app, g
+from sqlalchemy import create_engine, extract, func, insert, inspect, literal, select, text
+from sqlalchemy.orm import Session
+from app.models import (
+    db, ArchivedInvoice, ArchivedYear, Customer, Invoice, InvoiceDelivery, InvoiceItem, InvoiceReminder,
+    InvoiceSnapshot, normalize_name, normalize_vat
+)
+from app.tenancy import current_tenant
+
+ARCHIVED_TABLES = [
+    Customer.__table__, Invoice.__table__, InvoiceItem.__table__, InvoiceDelivery.__table__,
+    InvoiceReminder.__table__, InvoiceSnapshot.__table__,
+]
+
+# Read-only engines per archive file, shared by all requests
+_engines = {}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_dir():
+    base = current_app.config.get("ARCHIVE_DIR") or os.path.join(current_app.instance_path, "archive")
+    tenant = current_tenant()
+    return os.path.join(base, tenant.slug) if tenant is not None else base
+
+
+def archived_years():
+    return [year for (year,) in db.session.query(ArchivedYear.year).order_by(ArchivedYear.year.desc())]
+
+
+def archive_session(year):
+    """Return a session reading the year's archive, closed with the app context."""
+    sessions = g.setdefault("archive_sessions", {})
+    if year not in sessions:
+        archived = db.session.get(ArchivedYear, year)
+        if archived is None:
+            abort(404)
+        sessions[year] = Session(bind=_read_only_engine(archived.path))
+    return sessions[year]
+
+
+def close_archive_sessions(exception=None):
+    for session in g.pop("archive_sessions", {}).values():
+        session.close()
+
+
+def get_invoice_or_404(invoice_id):
+    """Load an invoice from the live database, falling back to the archive it was moved to."""
+    invoice = db.session.get(Invoice, invoice_id)
+    if invoice is not None:
+        return invoice
+
+    archived = db.session.get(ArchivedInvoice, invoice_id)
+    if archived is None:
+        abort(404)
+    invoice = archive_session(archived.year).get(Invoice, invoice_id)
+    if invoice is None:
+        abort(404)
+    return invoice
+
+
+def archive_year(year):
+    """Move all invoices of a closed, fully paid year into an archive file.
+
+    The archive is written and compacted first; the live rows are deleted in
+    one transaction afterwards, so a failure leaves the live data untouched.
+    """
+    if year >= date.today().year:
+        raise ArchiveError(f"{year} is not closed yet.")
+    if db.session.get(ArchivedYear, year) is not None:
+        raise ArchiveError(f"{year} is already archived.")
+
+    in_year = extract("year", Invoice.issue_date) == year
+    invoice_count = Invoice.query.filter(in_year).count()
+    if not invoice_count:
+        raise ArchiveError(f"There are no invoices in {year}.")
+    unpaid = Invoice.query.filter(in_year, Invoice.status != "paid").count()
+    if unpaid:
+        raise ArchiveError(f"{year} still has {unpaid} draft or unpaid invoices.")
+
+    year_invoice_ids = select(Invoice.id).where(in_year)
+    os.makedirs(archive_dir(), exist_ok=True)
+    path = os.path.join(archive_dir(), f"invoices-{year}.db")
+    if os.path.exists(path):
+        # Left over from an interrupted run
+        os.remove(path)
+
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        db.metadata.create_all(engine, tables=ARCHIVED_TABLES)
+        with engine.begin() as target:
+            _copy_rows(db.session, target, Customer.__table__, Customer.id.in_(select(Invoice.customer_id).where(in_year)))
+            _copy_rows(db.session, target, Invoice.__table__, in_year)
+            _copy_rows(db.session, target, InvoiceItem.__table__, InvoiceItem.invoice_id.in_(year_invoice_ids))
+            _copy_rows(
+                db.session, target, InvoiceDelivery.__table__, InvoiceDelivery.invoice_id.in_(year_invoice_ids)
+            )
+            _copy_rows(
+                db.session, target, InvoiceReminder.__table__, InvoiceReminder.invoice_id.in_(year_invoice_ids)
+            )
+            _copy_rows(
+                db.session, target, InvoiceSnapshot.__table__, InvoiceSnapshot.invoice_id.in_(year_invoice_ids)
+            )
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+    except BaseException:
+        engine.dispose()
+        os.remove(path)
+        raise
+    engine.dispose()
+
+    try:
+        last_number = db.session.query(func.max(Invoice.number)).filter(in_year).scalar()
+        db.session.add(ArchivedYear(year=year, path=path, invoice_count=invoice_count, last_number=last_number))
+        db.session.flush()
+        db.session.execute(
+            insert(ArchivedInvoice).from_select(["id", "year"], select(Invoice.id, literal(year)).where(in_year))
+        )
+        InvoiceItem.query.filter(InvoiceItem.invoice_id.in_(year_invoice_ids)).delete(synchronize_session=False)
+        InvoiceDelivery.query.filter(InvoiceDelivery.invoice_id.in_(year_invoice_ids)).delete(
+            synchronize_session=False
+        )
+        InvoiceReminder.query.filter(InvoiceReminder.invoice_id.in_(year_invoice_ids)).delete(
+            synchronize_session=False
+        )
+        InvoiceSnapshot.query.filter(InvoiceSnapshot.invoice_id.in_(year_invoice_ids)).delete(
+            synchronize_session=False
+        )
+        Invoice.query.filter(in_year).delete(synchronize_session=False)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        os.remove(path)
+        raise
+    return invoice_count
+
+
+def restore_year(year):
+    """Move an archived year's invoices back into the live database and delete the archive."""
+    archived = db.session.get(ArchivedYear, year)
+    if archived is None:
+        raise ArchiveError(f"{year} is not archived.")
+
+    _upgrade_archive_schema(archived.path)
+    engine = create_engine(f"sqlite:///file:{archived.path}?mode=ro&uri=true")
+    try:
+        with engine.connect() as source:
+            # Customers may have been deleted from the live database since archiving
+            archived_customers = source.execute(select(Customer.__table__)).all()
+            live_ids = {
+                customer_id
+                for (customer_id,) in db.session.query(Customer.id).filter(
+                    Customer.id.in_([row.id for row in archived_customers])
+                )
+            }
+            missing = [row._asdict() for row in archived_customers if row.id not in live_ids]
+            for customer in missing:
+                # Archives from before the search columns existed have them empty
+                customer["search_name"] = normalize_name(customer["name"])
+                customer["search_vat"] = normalize_vat(customer["vat_number"])
+            if missing:
+                db.session.execute(insert(Customer.__table__), missing)
+
+            _copy_rows(source, db.session, Invoice.__table__)
+            _copy_rows(source, db.session, InvoiceItem.__table__)
+            _copy_rows(source, db.session, InvoiceDelivery.__table__)
+            _copy_rows(source, db.session, InvoiceReminder.__table__)
+            _copy_rows(source, db.session, InvoiceSnapshot.__table__)
+
+        ArchivedInvoice.query.filter_by(year=year).delete()
+        db.session.delete(archived)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        engine.dispose()
+
+    cached = _engines.pop(archived.path, None)
+    if cached is not None:
+        cached.dispose()
+    os.remove(archived.path)
+    return archived.invoice_count
+
+
+def upgrade_archives():
+    """Add what migrations added to the live database to every archive file; returns the years.
+
+    Archives have no migration history of their own, so this runs whenever
+    the database is migrated to the latest revision.
+    """
+    years = []
+    for archived in ArchivedYear.query.order_by(ArchivedYear.year):
+        if os.path.exists(archived.path):
+            _upgrade_archive_schema(archived.path)
+            years.append(archived.year)
+    return years
+
+
+def _copy_rows(source, target, table, where=None, chunk_size=1000):
+    stmt = select(table)
+    if where is not None:
+        stmt = stmt.where(where)
+    result = source.execute(stmt.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        target.execute(insert(table), [row._asdict() for row in rows])
+
+
+def _read_only_engine(path):
+    engine = _engines.get(path)
+    if engine is None:
+        engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+        _engines[path] = engine
+    return engine
+
+
+def _upgrade_archive_schema(path):
+    """Add tables and columns that migrations added to the live database after the year was archived."""
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        with engine.begin() as connection:
+            inspector = inspect(connection)
+            for table in ARCHIVED_TABLES:
+                if not inspector.has_table(table.name):
+                    table.create(connection)
+                    continue
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        # Server defaults fill the existing rows, so restoring them satisfies NOT NULL
+                        if column.server_default is not None:
+                            column_type += f" DEFAULT '{column.server_default.arg}'"
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+    finally:
+        engine.dispose()
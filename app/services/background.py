@@ -0,0 +1,128 @@
+"""Shared plumbing for work done outside of requests.
+
+Backups, webhook dispatch and VAT lookups run in a background thread of
+each serving process, started on its first request so that CLI commands,
+which create the app too, never start one. With several worker processes a
+lock file lets only one of them do a job at a time. Webhooks and VAT
+lookups talk to other services over kept-alive HTTP connections.
+"""
+import http.client
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock; jobs aren't shared there
+    fcntl = None
+
+
+def start_on_first_request(app, target, *args, running=None):
+    """Run ``target(app, *args)`` in a daemon thread once the app serves its first request.
+
+    ``running``, an Event, is set before the thread starts, for code that
+    hands the thread work.
+    """
+    lock = threading.Lock()
+    started = threading.Event()
+
+    @app.before_request
+    def _start():
+        if started.is_set():
+            return
+        with lock:
+            if started.is_set():
+                return
+            started.set()
+            if running is not None:
+                running.set()
+            threading.Thread(target=target, args=(app, *args), daemon=True).start()
+
+
+@contextmanager
+def exclusive_lock(path):
+    """Lock ``path`` for this process; yields whether it did, without waiting for another holder."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+class HttpClient:
+    """HTTP connections to other services, kept alive and reused across requests.
+
+    Each thread keeps one connection per scheme, host and port. A reused
+    connection the server has closed in the meantime is reopened and the
+    request sent once more.
+    """
+
+    def __init__(self, timeout=10, user_agent="InvoiciPy"):
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self._local = threading.local()
+        self._pools = []  # Every thread's connections, for close()
+        self._pools_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """Send a request and return the response's (status, body)."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {"User-Agent": self.user_agent, **(headers or {})}
+        connections = self._connections()
+
+        reused = key in connections
+        while True:
+            connection = connections.get(key) or self._connect(parts)
+            connections[key] = connection
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                self._disconnect(connections, key)
+                if not reused:
+                    raise
+                reused = False
+                continue
+            if response.will_close:
+                self._disconnect(connections, key)
+            return response.status, data
+
+    def close(self):
+        with self._pools_lock:
+            for connections in self._pools:
+                for key in list(connections):
+                    self._disconnect(connections, key)
+
+    def _connections(self):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+            with self._pools_lock:
+                self._pools.append(connections)
+        return connections
+
+    def _connect(self, parts):
+        if parts.scheme not in ("http", "https"):
+            raise OSError(f"Unsupported URL scheme {parts.scheme!r}")
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        return connection_class(parts.hostname, parts.port, timeout=self.timeout)
+
+    @staticmethod
+    def _disconnect(connections, key):
+        connection = connections.pop(key, None)
+        if connection is not None:
+            connection.close()
@@ -0,0 +1,239 @@
+"""Online backups of the SQLite database while the app keeps serving.
+
+Backups use SQLite's online backup API, which copies a consistent snapshot
+of the database page by page. Each step copies ``BACKUP_STEP_PAGES`` pages
+and holds the database's read lock only while it does; between steps the
+lock is released for ``BACKUP_STEP_PAUSE`` seconds so writers (issuing an
+invoice, say) never wait longer than one small step. If a writer changes the
+database mid-copy SQLite restarts the copy; after ``BACKUP_MAX_RESTARTS``
+restarts the rest is copied in one step so busy databases still get a backup.
+
+The copy is checked with ``PRAGMA integrity_check`` before it is compressed
+and moved into place, so a backup file that exists is always complete.
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.engine import make_url
+from app.services.background import exclusive_lock, start_on_first_request
+from app.tenancy import current_tenant, tenant_context
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def database_path():
+    """Path of the current (tenant's) SQLite database file."""
+    tenant = current_tenant()
+    url = make_url(tenant.database_url if tenant is not None else current_app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        raise BackupError(f"Only SQLite database files can be backed up, not {url.render_as_string()}.")
+    return url.database
+
+
+def backup_dir():
+    return current_app.config.get("BACKUP_DIR") or os.path.join(current_app.instance_path, "backups")
+
+
+def backup_database(directory=None, compress=True, keep=None, verify=True):
+    """Back up the current database into ``directory`` and rotate old backups.
+
+    Returns the path of the new backup file.
+    """
+    config = current_app.config
+    source_path = database_path()
+    if not os.path.exists(source_path):
+        raise BackupError(f"{source_path} does not exist.")
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    name = _backup_prefix(source_path) + datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, name + (".db.gz" if compress else ".db"))
+
+    fd, copy_path = tempfile.mkstemp(prefix=f".{name}-", suffix=".db", dir=directory)
+    os.close(fd)
+    try:
+        copy_database(
+            source_path,
+            copy_path,
+            pages=config.get("BACKUP_STEP_PAGES", 256),
+            pause=config.get("BACKUP_STEP_PAUSE", 0.01),
+            max_restarts=config.get("BACKUP_MAX_RESTARTS", 3),
+        )
+        if verify:
+            check_integrity(copy_path)
+        if compress:
+            with open(copy_path, "rb") as src, gzip.open(path + ".partial", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            _fsync(path + ".partial")
+            os.replace(path + ".partial", path)
+        else:
+            _fsync(copy_path)
+            os.replace(copy_path, path)
+    finally:
+        for leftover in (copy_path, path + ".partial"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    rotate_backups(directory, source_path, keep if keep is not None else config.get("BACKUP_KEEP", 14))
+    return path
+
+
+def copy_database(source_path, target_path, pages=256, pause=0.01, max_restarts=3):
+    """Copy a live SQLite database with the online backup API in steps of ``pages`` pages."""
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        restarts = 0
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                # A writer changed the database and SQLite started the copy over
+                restarts += 1
+                if restarts > max_restarts:
+                    raise _TooManyRestarts()
+            last_remaining = remaining
+            # Let writers in between steps
+            time.sleep(pause)
+
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            # Copy everything in one step: a single short read lock, but no more restarts
+            source.backup(target, pages=-1)
+    except sqlite3.Error as e:
+        raise BackupError(f"Backup of {source_path} failed: {e}")
+    finally:
+        target.close()
+        source.close()
+
+
+def check_integrity(path):
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = [row[0] for row in connection.execute("PRAGMA integrity_check")]
+    except sqlite3.Error as e:
+        raise BackupError(f"{path} is not a readable SQLite database: {e}")
+    finally:
+        connection.close()
+    if result != ["ok"]:
+        raise BackupError(f"{path} failed the integrity check: {'; '.join(result[:5])}")
+
+
+def list_backups(directory=None, source_path=None):
+    """Backups of the current database, newest first."""
+    directory = directory or backup_dir()
+    # Exact names only: tenant "acme" must not pick up the backups of "acme-eu"
+    pattern = re.compile(re.escape(_backup_prefix(source_path or database_path())) + r"\d{8}-\d{6}\.db(\.gz)?")
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if pattern.fullmatch(name)]
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def rotate_backups(directory, source_path, keep):
+    """Delete all but the ``keep`` newest backups; returns the deleted paths."""
+    if not keep:
+        return []
+    old = list_backups(directory, source_path)[keep:]
+    for path in old:
+        os.remove(path)
+    return old
+
+
+def restore_database(backup_path):
+    """Replace the current database's contents with a backup.
+
+    The backup is checked first and then written with the backup API, so the
+    database is never left half restored. Stop the app before restoring.
+    """
+    target_path = database_path()
+    directory = os.path.dirname(os.path.abspath(target_path))
+    fd, copy_path = tempfile.mkstemp(prefix=".restore-", suffix=".db", dir=directory)
+    os.close(fd)
+    try:
+        if backup_path.endswith(".gz"):
+            with gzip.open(backup_path, "rb") as src, open(copy_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        else:
+            shutil.copyfile(backup_path, copy_path)
+        check_integrity(copy_path)
+
+        source = sqlite3.connect(copy_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        except sqlite3.Error as e:
+            raise BackupError(f"Restoring {backup_path} failed: {e}")
+        finally:
+            target.close()
+            source.close()
+    except (OSError, EOFError, gzip.BadGzipFile) as e:
+        raise BackupError(f"Can't read {backup_path}: {e}")
+    finally:
+        os.remove(copy_path)
+
+
+def _backup_prefix(source_path):
+    return os.path.splitext(os.path.basename(source_path))[0] + "-"
+
+
+def _fsync(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def start_backup_scheduler(app):
+    """Back up every ``BACKUP_INTERVAL`` hours from a background thread of a serving process.
+
+    Only one worker process runs each backup, and the age of the newest
+    backup decides when the next is due, across restarts too.
+    """
+    interval = app.config.get("BACKUP_INTERVAL") or 0
+    if interval <= 0:
+        return
+    start_on_first_request(app, _run_scheduler, interval * 3600)
+
+
+def _run_scheduler(app, interval):
+    while True:
+        with app.app_context():
+            try:
+                _run_due_backups(interval)
+            except Exception:
+                app.logger.exception("Scheduled backup failed")
+        time.sleep(min(interval, 600))
+
+
+def _run_due_backups(interval):
+    directory = backup_dir()
+    with exclusive_lock(os.path.join(directory, ".lock")) as locked:
+        if not locked:
+            return  # Another worker is backing up
+        tenancy = current_app.extensions.get("tenancy")
+        for slug in tenancy.tenants if tenancy is not None else [None]:
+            if slug is None:
+                _backup_if_due(directory, interval)
+            else:
+                with tenant_context(slug):
+                    _backup_if_due(directory, interval)
+
+
+def _backup_if_due(directory, interval):
+    backups = list_backups(directory)
+    if backups and time.time() - os.path.getmtime(backups[0]) < interval:
+        return
+    path = backup_database(directory)
+    current_app.logger.info("Backed up the database to %s", path)
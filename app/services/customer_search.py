@@ -0,0 +1,132 @@
+"""Prefix search over customer names and VAT numbers for the invoice form's typeahead.
+
+Lookups are index range scans on the normalized ``search_name`` and
+``search_vat`` columns. Results are kept in a small per-process LRU cache;
+a cached result that holds fewer than ``limit`` customers is complete, so
+longer prefixes are answered from it without touching the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from app.models import db, Customer, normalize_name, normalize_vat
+from app.tenancy import current_tenant
+
+# Greater than any character, so [prefix, prefix + MAX_CHAR) is every string starting with prefix
+MAX_CHAR = "\U0010ffff"
+
+
+class PrefixCache:
+    """LRU cache of search results with a time limit.
+
+    Customer changes in this process clear it right away; the time limit
+    bounds how long changes made by other worker processes go unseen.
+    """
+
+    def __init__(self, max_entries=512, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = PrefixCache()
+
+
+@event.listens_for(Customer, "after_insert")
+@event.listens_for(Customer, "after_update")
+@event.listens_for(Customer, "after_delete")
+def _clear_cache(mapper, connection, target):
+    _cache.clear()
+
+
+def search_customers(query, limit=20):
+    """Customers whose name or VAT number starts with ``query``, ordered by name.
+
+    Returns dicts with the fields the typeahead shows.
+    """
+    name_prefix = normalize_name(query or "")
+    if not name_prefix:
+        return []
+    # Derived from the name prefix, so results cached per name prefix stay consistent
+    vat_prefix = normalize_vat(name_prefix)
+
+    tenant = current_tenant()
+    scope = (tenant.slug if tenant is not None else None, limit)
+
+    matches = _cached_matches(scope, name_prefix, vat_prefix, limit)
+    if matches is None:
+        matches = _query_matches(name_prefix, vat_prefix, limit)
+        _cache.set(scope + (name_prefix,), matches)
+    return [result for _, _, result in matches]
+
+
+def _cached_matches(scope, name_prefix, vat_prefix, limit):
+    matches = _cache.get(scope + (name_prefix,))
+    if matches is not None:
+        return matches
+
+    # A complete result for a shorter prefix contains every match for this one
+    for length in range(len(name_prefix) - 1, 0, -1):
+        shorter = _cache.get(scope + (name_prefix[:length],))
+        if shorter is not None and len(shorter) < limit:
+            return [
+                match for match in shorter
+                if match[0].startswith(name_prefix) or (vat_prefix and (match[1] or "").startswith(vat_prefix))
+            ]
+    return None
+
+
+def _query_matches(name_prefix, vat_prefix, limit):
+    columns = (
+        Customer.search_name, Customer.search_vat,
+        Customer.id, Customer.name, Customer.vat_number, Customer.payment_terms,
+    )
+    rows = (
+        db.session.query(*columns)
+        .filter(Customer.search_name >= name_prefix, Customer.search_name < name_prefix + MAX_CHAR)
+        .order_by(Customer.search_name)
+        .limit(limit)
+        .all()
+    )
+    if vat_prefix:
+        # Separate query so each one is a range scan on its own index
+        rows += (
+            db.session.query(*columns)
+            .filter(Customer.search_vat >= vat_prefix, Customer.search_vat < vat_prefix + MAX_CHAR)
+            .order_by(Customer.search_vat)
+            .limit(limit)
+            .all()
+        )
+
+    by_id = {}
+    for search_name, search_vat, id, name, vat_number, payment_terms in rows:
+        by_id[id] = (
+            search_name or "",
+            search_vat,
+            {"id": id, "name": name, "vat_number": vat_number, "payment_terms": payment_terms},
+        )
+    return sorted(by_id.values(), key=lambda match: (match[0], match[2]["id"]))[:limit]
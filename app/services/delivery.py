@@ -0,0 +1,228 @@
+"""Email issued invoices to their customers with the PDF attached.
+
+Batches render PDFs in worker processes while finished ones go out over a
+single reused SMTP connection. Every attempt is recorded as an
+``InvoiceDelivery``, committed right after sending, so a crash between
+sending and committing sends at most one invoice twice.
+"""
+import os
+import smtplib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import make_msgid
+from flask import current_app, render_template
+from sqlalchemy import select
+from app.models import db, Customer, Invoice, InvoiceDelivery
+from app.services.pdf import get_company_info, pdf_profile_for, render_invoice_html, render_pdf
+from app.tenancy import tenant_setting
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, attempts=0):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+class Mailer:
+    """An SMTP connection reused for many messages.
+
+    The connection is opened on the first send and reopened after
+    ``max_messages`` messages or when the server drops it. Transient failures
+    (connection errors, 4xx replies) are retried up to ``retries`` times with
+    exponential backoff; permanent ones (5xx replies) fail immediately.
+    """
+
+    def __init__(self, host, port=25, username=None, password=None, use_tls=False, use_ssl=False,
+                 timeout=30, max_messages=100, retries=3, backoff=1.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.retries = retries
+        self.backoff = backoff
+        self._smtp = None
+        self._sent = 0
+
+    @classmethod
+    def from_config(cls):
+        host = tenant_setting("MAIL_SERVER")
+        if not host:
+            raise DeliveryError("Email is not configured: set MAIL_SERVER.")
+        return cls(
+            host,
+            port=int(tenant_setting("MAIL_PORT", 25)),
+            username=tenant_setting("MAIL_USERNAME"),
+            password=tenant_setting("MAIL_PASSWORD"),
+            use_tls=tenant_setting("MAIL_USE_TLS", False),
+            use_ssl=tenant_setting("MAIL_USE_SSL", False),
+            timeout=current_app.config.get("MAIL_TIMEOUT", 30),
+            max_messages=current_app.config.get("MAIL_MESSAGES_PER_CONNECTION", 100),
+            retries=current_app.config.get("MAIL_MAX_RETRIES", 3),
+            backoff=current_app.config.get("MAIL_RETRY_BACKOFF", 1.0),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, message):
+        """Send a message and return the number of attempts it took."""
+        for attempt in range(1, self.retries + 2):
+            try:
+                if self._smtp is None or self._sent >= self.max_messages:
+                    self._connect()
+                self._smtp.send_message(message)
+                self._sent += 1
+                return attempt
+            except (smtplib.SMTPException, OSError) as e:
+                # The connection state is unknown after an error, start over
+                self._disconnect()
+                if not _is_transient(e):
+                    raise DeliveryError(_describe(e), attempt)
+                if attempt > self.retries:
+                    raise DeliveryError(f"Gave up after {attempt} attempts: {_describe(e)}", attempt)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._disconnect()
+
+    def _connect(self):
+        self.close()
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._sent = 0
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            self._smtp.close()
+        self._smtp = None
+
+
+def _is_transient(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return True  # Socket errors
+
+
+def _describe(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        message = error.smtp_error.decode(errors="replace") if isinstance(error.smtp_error, bytes) else error.smtp_error
+        return f"{error.smtp_code} {message}"
+    return str(error) or error.__class__.__name__
+
+
+def pending_invoices():
+    """Issued invoices with a customer email that haven't been sent successfully yet."""
+    delivered = select(InvoiceDelivery.invoice_id).where(InvoiceDelivery.status == "sent")
+    return (
+        Invoice.query.join(Customer)
+        .filter(
+            Invoice.status == "issued",
+            Customer.email.isnot(None),
+            Customer.email != "",
+            Invoice.id.notin_(delivered),
+        )
+        .order_by(Invoice.issue_date, Invoice.number)
+    )
+
+
+def build_message(invoice, pdf_bytes, sender):
+    company = get_company_info()
+    message = EmailMessage()
+    message["Subject"] = f"Invoice {invoice.display_number} from {company['name']}"
+    message["From"] = sender
+    message["To"] = invoice.customer.email
+    message["Message-ID"] = make_msgid(domain=sender.rpartition("@")[2] or None)
+    message.set_content(render_template("emails/invoice.txt", invoice=invoice, company=company))
+    message.add_attachment(
+        pdf_bytes, maintype="application", subtype="pdf", filename=f"invoice-{invoice.display_number}.pdf"
+    )
+    return message
+
+
+def send_invoices(invoices, workers=None, mailer=None):
+    """Email each invoice to its customer and record the outcome.
+
+    ``workers`` processes render the PDFs (default: ``MAIL_RENDER_WORKERS`` or
+    one per CPU); with a single worker they are rendered inline. Returns the
+    ``InvoiceDelivery`` rows in invoice order.
+    """
+    invoices = list(invoices)
+    if not invoices:
+        return []
+    sender = tenant_setting("MAIL_SENDER") or tenant_setting("COMPANY_EMAIL")
+    mailer = mailer or Mailer.from_config()
+    workers = workers or current_app.config.get("MAIL_RENDER_WORKERS") or os.cpu_count() or 1
+    workers = min(workers, len(invoices))
+
+    # HTML needs the database and templates, so it is rendered here; the PDF
+    # conversion that dominates the cost runs in the workers
+    jobs = [(render_invoice_html(invoice), pdf_profile_for(invoice.template), current_app.root_path) for invoice in invoices]
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor is not None:
+            pdfs = executor.map(render_pdf, *zip(*jobs))
+        else:
+            pdfs = (render_pdf(*job) for job in jobs)
+
+        deliveries = []
+        with mailer:
+            for invoice, pdf_bytes in zip(invoices, pdfs):
+                deliveries.append(_deliver(mailer, invoice, pdf_bytes, sender))
+        return deliveries
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def send_invoice(invoice, mailer=None):
+    """Email a single invoice; returns its ``InvoiceDelivery``."""
+    return send_invoices([invoice], workers=1, mailer=mailer)[0]
+
+
+def _deliver(mailer, invoice, pdf_bytes, sender):
+    delivery = InvoiceDelivery(invoice_id=invoice.id, recipient=invoice.customer.email or "", status="pending")
+    if not invoice.customer.email:
+        delivery.status = "failed"
+        delivery.error = "Customer has no email address."
+    else:
+        try:
+            delivery.attempts = mailer.send(build_message(invoice, pdf_bytes, sender))
+            delivery.status = "sent"
+            delivery.sent_at = datetime.utcnow()
+        except DeliveryError as e:
+            delivery.status = "failed"
+            delivery.attempts = e.attempts
+            delivery.error = str(e)
+    db.session.add(delivery)
+    db.session.commit()
+    return delivery
@@ -0,0 +1,213 @@
+"""Find overdue invoices and escalate payment reminders per customer.
+
+An invoice is overdue once it is issued and past its due date. Reminder
+levels are reached ``DUNNING_LEVELS`` days after the due date (7, 21 and 45
+by default). A run records an ``InvoiceReminder`` for every invoice that
+reached a new level and, with ``send=True``, emails each customer a single
+reminder covering all of their invoices in it. Recorded and emailed levels
+are tracked separately, so a level that was only recorded is still emailed
+by a later ``send`` run.
+
+Due invoices are found through the ``(status, due_date)`` index and worked
+through in chunks of whole customers, each committed on its own, so a run
+over thousands of invoices never holds a long write transaction.
+"""
+from collections import Counter, namedtuple
+from datetime import date, timedelta
+from email.message import EmailMessage
+from email.utils import make_msgid
+from itertools import groupby
+from flask import render_template
+from sqlalchemy import case, distinct, func
+from sqlalchemy.orm import contains_eager
+from app.models import db, Customer, Invoice, InvoiceReminder
+from app.services.delivery import DeliveryError, Mailer
+from app.services.pdf import get_company_info
+from app.services.totals import invoices_with_totals
+from app.tenancy import tenant_setting
+
+DEFAULT_LEVELS = (7, 21, 45)
+
+DunningRun = namedtuple("DunningRun", ["customers", "reminders", "failed", "levels"])
+
+
+class DunningError(Exception):
+    pass
+
+
+def dunning_levels():
+    """Days after the due date at which each reminder level is reached, e.g. (7, 21, 45)."""
+    value = tenant_setting("DUNNING_LEVELS") or DEFAULT_LEVELS
+    if isinstance(value, str):
+        value = [days for days in value.split(",") if days.strip()]
+    try:
+        levels = tuple(int(days) for days in value)
+    except (TypeError, ValueError):
+        levels = ()
+    if not levels or levels[0] < 1 or list(levels) != sorted(set(levels)):
+        raise DunningError(f"DUNNING_LEVELS must be increasing days after the due date, e.g. 7,21,45, not {value!r}.")
+    return levels
+
+
+def overdue_criteria(today=None):
+    """Filter criteria for issued invoices past their due date."""
+    return (Invoice.status == "issued", Invoice.due_date < (today or date.today()))
+
+
+def reached_level(today, levels):
+    """SQL expression for the reminder level an invoice has reached by ``today`` (0 for none)."""
+    # Highest level first: the first threshold the due date is past wins
+    thresholds = sorted(enumerate(levels, start=1), reverse=True)
+    return case(*((Invoice.due_date <= today - timedelta(days=days), level) for level, days in thresholds), else_=0)
+
+
+def level_for(days_overdue, levels):
+    return sum(1 for days in levels if days_overdue >= days)
+
+
+def due_criteria(today, levels, send=False):
+    """Filter criteria for invoices that reached a level they haven't been reminded (or emailed) at yet."""
+    last_level = Invoice.reminder_sent_level if send else Invoice.reminder_level
+    return (
+        Invoice.status == "issued",
+        # Bounds the index range scan; the level comparison filters what's left
+        Invoice.due_date <= today - timedelta(days=levels[0]),
+        last_level < reached_level(today, levels),
+    )
+
+
+def due_summary(today=None, send=False):
+    """Invoices and customers due for a reminder per level, as {level: (invoices, customers)}."""
+    today = today or date.today()
+    levels = dunning_levels()
+    level = reached_level(today, levels)
+    rows = (
+        db.session.query(level, func.count(Invoice.id), func.count(distinct(Invoice.customer_id)))
+        .filter(*due_criteria(today, levels, send))
+        .group_by(level)
+    )
+    return {level: (invoices, customers) for level, invoices, customers in rows}
+
+
+def run_dunning(today=None, chunk_size=500, send=False, mailer=None):
+    """Record (and with ``send``, email) the reminders due ``today``.
+
+    Customers are processed in chunks of about ``chunk_size`` invoices, each
+    chunk committed on its own; emailed reminders are committed right after
+    each message, so a crash resends at most one customer's reminder. A failed email leaves the
+    invoices' reminder levels unchanged, so the next run tries again; a
+    recorded-only run leaves the emailed level alone.
+    """
+    today = today or date.today()
+    levels = dunning_levels()
+    criteria = due_criteria(today, levels, send)
+    customers, failed, by_level = 0, 0, Counter()
+    if send:
+        mailer = mailer or Mailer.from_config()
+        sender = tenant_setting("MAIL_SENDER") or tenant_setting("COMPANY_EMAIL")
+        company = get_company_info()
+
+    try:
+        for customer_ids in _customer_chunks(criteria, chunk_size):
+            rows = (
+                invoices_with_totals(*criteria, Invoice.customer_id.in_(customer_ids))
+                .join(Customer, Customer.id == Invoice.customer_id)
+                .options(contains_eager(Invoice.customer))
+                .group_by(Customer.id)
+                .order_by(Invoice.customer_id, Invoice.due_date, Invoice.id)
+                .all()
+            )
+            for customer, group in groupby(rows, key=lambda row: row[0].customer):
+                reminders = [_reminder(invoice, total, today, levels) for invoice, total in group]
+                if send:
+                    _send(mailer, customer, reminders, len(levels), sender, company)
+                for reminder in reminders:
+                    if reminder.status == "failed":
+                        failed += 1
+                        continue
+                    reminder.invoice.reminder_level = reminder.level
+                    if reminder.status == "sent":
+                        reminder.invoice.reminder_sent_level = reminder.level
+                    by_level[reminder.level] += 1
+                customers += 1
+                if send:
+                    db.session.commit()
+            db.session.commit()
+    finally:
+        if send:
+            mailer.close()
+    return DunningRun(customers, sum(by_level.values()), failed, by_level)
+
+
+def _customer_chunks(criteria, chunk_size):
+    """Customer IDs with due invoices, grouped so each chunk holds about ``chunk_size`` invoices."""
+    counts = (
+        db.session.query(Invoice.customer_id, func.count(Invoice.id))
+        .filter(*criteria)
+        .group_by(Invoice.customer_id)
+        .order_by(Invoice.customer_id)
+        .all()
+    )
+    chunk, size = [], 0
+    for customer_id, count in counts:
+        if chunk and size + count > chunk_size:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(customer_id)
+        size += count
+    if chunk:
+        yield chunk
+
+
+def _reminder(invoice, total, today, levels):
+    days_overdue = (today - invoice.due_date).days
+    reminder = InvoiceReminder(
+        invoice=invoice,
+        level=level_for(days_overdue, levels),
+        days_overdue=days_overdue,
+        amount=round(total, 2),
+        status="recorded",
+    )
+    db.session.add(reminder)
+    return reminder
+
+
+def _send(mailer, customer, reminders, final_level, sender, company):
+    level = max(reminder.level for reminder in reminders)
+    for reminder in reminders:
+        reminder.recipient = customer.email
+    if not customer.email:
+        error, status = "Customer has no email address.", "failed"
+    else:
+        try:
+            mailer.send(build_reminder_message(customer, reminders, level, level == final_level, sender, company))
+            error, status = None, "sent"
+        except DeliveryError as e:
+            error, status = str(e), "failed"
+    for reminder in reminders:
+        reminder.status = status
+        reminder.error = error
+
+
+def build_reminder_message(customer, reminders, level, final, sender, company=None):
+    company = company or get_company_info()
+    message = EmailMessage()
+    if final:
+        subject = "Final payment reminder"
+    else:
+        subject = f"Payment reminder {level}" if level > 1 else "Payment reminder"
+    message["Subject"] = f"{subject} from {company['name']}"
+    message["From"] = sender
+    message["To"] = customer.email
+    message["Message-ID"] = make_msgid(domain=sender.rpartition("@")[2] or None)
+    message.set_content(
+        render_template(
+            "emails/reminder.txt",
+            customer=customer,
+            reminders=reminders,
+            level=level,
+            final=final,
+            company=company,
+        )
+    )
+    return message
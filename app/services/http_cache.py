@@ -0,0 +1,128 @@
+import hashlib
+from collections import namedtuple
+from datetime import date
+from flask import Response, abort, request, session
+from sqlalchemy import func, select
+from werkzeug.http import is_resource_modified
+from app.models import (
+    db, ArchivedInvoice, ArchivedYear, Customer, Invoice, InvoiceDelivery, InvoiceItem, InvoiceReminder, OptionalText
+)
+from app.services.pdf import get_company_info, pdf_profile_for
+from app.tenancy import tenant_setting
+
+# Paid invoices never change again; issued ones still flip to paid
+PAID_PDF_MAX_AGE = 365 * 24 * 3600
+ISSUED_PDF_MAX_AGE = 24 * 3600
+
+Validators = namedtuple("Validators", ["etag", "last_modified", "cache_control"])
+
+
+def invoice_validators(invoice_id, kind):
+    """Compute ETag and Last-Modified for an invoice page with a single query.
+
+    The validators cover the invoice, its items, its customer, its email
+    deliveries and reminders, the optional texts, the company details and
+    whether the invoice is overdue today, i.e. everything that goes into a
+    render.
+    ``kind`` ("detail", "preview" or "pdf") keeps the ETags of the different
+    representations apart. Aborts with 404 if the invoice doesn't exist.
+    """
+    row = (
+        db.session.query(
+            Invoice.status,
+            Invoice.updated_at,
+            Customer.updated_at,
+            func.max(InvoiceItem.updated_at),
+            func.count(InvoiceItem.id),
+            select(func.max(OptionalText.updated_at)).scalar_subquery(),
+            select(func.count(OptionalText.id)).scalar_subquery(),
+            select(func.max(InvoiceDelivery.updated_at))
+            .where(InvoiceDelivery.invoice_id == Invoice.id)
+            .scalar_subquery(),
+            select(func.max(InvoiceReminder.created_at))
+            .where(InvoiceReminder.invoice_id == Invoice.id)
+            .scalar_subquery(),
+            Invoice.template,
+            Invoice.due_date,
+        )
+        .join(Customer, Customer.id == Invoice.customer_id)
+        .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        .filter(Invoice.id == invoice_id)
+        .group_by(Invoice.id, Customer.id)
+        .first()
+    )
+    if row is None:
+        return _archived_invoice_validators(invoice_id, kind)
+
+    (status, invoice_at, customer_at, items_at, item_count, texts_at, text_count, delivered_at, reminded_at,
+     template, due_date) = row
+    last_modified = max(
+        t for t in (invoice_at, customer_at, items_at, texts_at, delivered_at, reminded_at) if t is not None
+    )
+    # The output profile changes the PDF bytes, so a new profile invalidates cached copies
+    profile = pdf_profile_for(template) if kind == "pdf" else None
+    # An issued invoice turns overdue without any row changing
+    overdue = status == "issued" and due_date < date.today()
+    etag = _make_etag(kind, invoice_id, status, *row[1:], overdue, profile, _company_fingerprint())
+
+    if kind == "pdf" and status == "paid":
+        cache_control = f"private, max-age={PAID_PDF_MAX_AGE}, immutable"
+    elif kind == "pdf" and status == "issued":
+        cache_control = f"private, max-age={ISSUED_PDF_MAX_AGE}"
+    else:
+        cache_control = "no-cache"
+    return Validators(etag, last_modified, cache_control)
+
+
+def _archived_invoice_validators(invoice_id, kind):
+    """Archived invoices are paid and frozen, so only the archiving time matters."""
+    archived_at = (
+        db.session.query(ArchivedYear.archived_at)
+        .join(ArchivedInvoice, ArchivedInvoice.year == ArchivedYear.year)
+        .filter(ArchivedInvoice.id == invoice_id)
+        .scalar()
+    )
+    if archived_at is None:
+        abort(404)
+
+    # The template isn't known without opening the archive, so cover every profile setting
+    profiles = (tenant_setting("PDF_PROFILE"), sorted(tenant_setting("PDF_TEMPLATE_PROFILES", {}).items()))
+    etag = _make_etag(kind, invoice_id, "archived", archived_at, profiles, _company_fingerprint())
+    cache_control = f"private, max-age={PAID_PDF_MAX_AGE}, immutable" if kind == "pdf" else "no-cache"
+    return Validators(etag, archived_at, cache_control)
+
+
+def customer_validators(customer_id):
+    """Compute ETag and Last-Modified for a customer from its primary key row."""
+    updated_at = db.session.query(Customer.updated_at).filter(Customer.id == customer_id).first()
+    if updated_at is None:
+        abort(404)
+    return Validators(_make_etag("customer", customer_id, updated_at[0]), updated_at[0], "no-cache")
+
+
+def not_modified(validators):
+    """Return a 304 response if the client's cached copy is still current, else None."""
+    # Pending flash messages are rendered into the page, so it must be sent in full
+    if "_flashes" in session:
+        return None
+    if is_resource_modified(request.environ, etag=validators.etag, last_modified=validators.last_modified):
+        return None
+    return with_validators(Response(status=304), validators)
+
+
+def with_validators(response, validators):
+    """Attach ETag, Last-Modified and Cache-Control headers to a response."""
+    response.set_etag(validators.etag, weak=True)
+    if validators.last_modified is not None:
+        response.last_modified = validators.last_modified
+    response.headers["Cache-Control"] = validators.cache_control
+    return response
+
+
+def _make_etag(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _company_fingerprint():
+    company = get_company_info()
+    return _make_etag(*(f"{key}={company[key]}" for key in sorted(company)))
@@ -0,0 +1,90 @@
+"""Status transitions for many invoices at once, each batch in one transaction."""
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import func, update
+from app.models import db, Invoice, InvoiceItem
+from app.services.numbering import reserve_invoice_numbers
+from app.services.snapshots import capture_snapshots
+from app.services.vat import reverse_charge_errors
+from app.services.webhooks import record_invoice_events
+
+
+def issue_invoices(invoice_ids):
+    """Issue the given drafts, numbering them in issue-date order.
+
+    Invoices that can't be issued are skipped and reported, including
+    reverse-charge ones whose customer's VAT number is known to be invalid.
+    Numbers are reserved once per year for the whole batch, all invoices are
+    updated with a single executemany, and snapshots and webhook events are
+    written in the same transaction. Returns
+    (issued invoice ids, [(invoice, error)]).
+    """
+    invoices = (
+        Invoice.query.filter(Invoice.id.in_(invoice_ids))
+        .order_by(Invoice.issue_date, Invoice.id)
+        .all()
+    )
+    item_counts = dict(
+        db.session.query(InvoiceItem.invoice_id, func.count(InvoiceItem.id))
+        .filter(InvoiceItem.invoice_id.in_(invoice_ids))
+        .group_by(InvoiceItem.invoice_id)
+        .all()
+    )
+
+    vat_errors = reverse_charge_errors(invoice for invoice in invoices if invoice.status == "draft")
+
+    errors, issuable = [], []
+    for invoice in invoices:
+        if invoice.status != "draft":
+            errors.append((invoice, f"is already {invoice.status}"))
+        elif not item_counts.get(invoice.id):
+            errors.append((invoice, "has no items"))
+        elif invoice in vat_errors:
+            errors.append((invoice, vat_errors[invoice]))
+        else:
+            issuable.append(invoice)
+
+    now = datetime.utcnow()
+    rows = []
+    unnumbered = [invoice for invoice in issuable if not invoice.number]
+    for _, year_invoices in groupby(unnumbered, key=lambda invoice: invoice.issue_date.year):
+        year_invoices = list(year_invoices)
+        numbers = reserve_invoice_numbers(year_invoices[0].issue_date, len(year_invoices))
+        rows.extend(
+            {"id": invoice.id, "number": number, "status": "issued", "updated_at": now}
+            for invoice, number in zip(year_invoices, numbers)
+        )
+    rows.extend(
+        {"id": invoice.id, "number": invoice.number, "status": "issued", "updated_at": now}
+        for invoice in issuable if invoice.number
+    )
+
+    if rows:
+        db.session.execute(update(Invoice), rows)
+        capture_snapshots(row["id"] for row in rows)
+        record_invoice_events([row["id"] for row in rows], "invoice.issued")
+        db.session.commit()
+    return [row["id"] for row in rows], errors
+
+
+def mark_invoices_paid(invoice_ids):
+    """Mark the given issued invoices paid with a single UPDATE, plus their webhook events.
+
+    Returns (number marked paid, [(invoice, error)]) for the ones that aren't issued.
+    """
+    errors = [
+        (invoice, "is a draft and must be issued first" if invoice.status == "draft" else "is already paid")
+        for invoice in Invoice.query.filter(Invoice.id.in_(invoice_ids), Invoice.status != "issued")
+        .order_by(Invoice.issue_date, Invoice.id)
+    ]
+    paid_ids = db.session.scalars(
+        update(Invoice)
+        .where(Invoice.id.in_(invoice_ids), Invoice.status == "issued")
+        .values(status="paid", updated_at=datetime.utcnow())
+        .returning(Invoice.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if paid_ids:
+        record_invoice_events(paid_ids, "invoice.paid")
+    db.session.commit()
+    return len(paid_ids), errors
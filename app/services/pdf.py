@@ -1,35 +1,75 @@
 from flask import render_template, current_app
 from weasyprint import HTML, CSS
 from app.models import Invoice, OptionalText
+from app.tenancy import tenant_setting
+
+# WeasyPrint output options per profile. Fonts are subsetted unless full_fonts
+# is set; streams are compressed unless uncompressed_pdf is set.
+PDF_PROFILES = {
+    # Smallest files, for storage and email
+    "compact": {
+        "optimize_images": True,
+        "jpeg_quality": 60,
+        "dpi": 150,
+        "full_fonts": False,
+        "hinting": False,
+        "custom_metadata": False,
+    },
+    # PDF/A-3b for long-term archiving; keeps metadata and sharper images
+    "archival": {
+        "pdf_variant": "pdf/a-3b",
+        "optimize_images": True,
+        "jpeg_quality": 85,
+        "dpi": 300,
+        "full_fonts": False,
+        "hinting": False,
+        "custom_metadata": True,
+    },
+    # Full fonts with hinting and untouched images, for sending to a printer
+    "print": {
+        "optimize_images": False,
+        "full_fonts": True,
+        "hinting": True,
+        "custom_metadata": True,
+    },
+}
 
 
 def get_company_info():
-    """Get company info from config."""
+    """Get company info from config (or the current tenant's)."""
     return {
-        "name": current_app.config.get("COMPANY_NAME"),
-        "legal_name": current_app.config.get("COMPANY_LEGAL_NAME"),
-        "legal_number": current_app.config.get("COMPANY_LEGAL_NUMBER"),
-        "address": current_app.config.get("COMPANY_ADDRESS"),
-        "city": current_app.config.get("COMPANY_CITY"),
-        "zipcode": current_app.config.get("COMPANY_ZIPCODE"),
-        "country": current_app.config.get("COMPANY_COUNTRY"),
-        "vat_number": current_app.config.get("COMPANY_VAT_NUMBER"),
-        "email": current_app.config.get("COMPANY_EMAIL"),
-        "phone": current_app.config.get("COMPANY_PHONE"),
-        "bank_name": current_app.config.get("COMPANY_BANK_NAME"),
-        "iban": current_app.config.get("COMPANY_IBAN"),
-        "swift": current_app.config.get("COMPANY_SWIFT"),
+        "name": tenant_setting("COMPANY_NAME"),
+        "legal_name": tenant_setting("COMPANY_LEGAL_NAME"),
+        "legal_number": tenant_setting("COMPANY_LEGAL_NUMBER"),
+        "address": tenant_setting("COMPANY_ADDRESS"),
+        "city": tenant_setting("COMPANY_CITY"),
+        "zipcode": tenant_setting("COMPANY_ZIPCODE"),
+        "country": tenant_setting("COMPANY_COUNTRY"),
+        "vat_number": tenant_setting("COMPANY_VAT_NUMBER"),
+        "email": tenant_setting("COMPANY_EMAIL"),
+        "phone": tenant_setting("COMPANY_PHONE"),
+        "bank_name": tenant_setting("COMPANY_BANK_NAME"),
+        "iban": tenant_setting("COMPANY_IBAN"),
+        "swift": tenant_setting("COMPANY_SWIFT"),
     }
 
 
-def get_invoice_context(invoice):
-    """Build the context dict for rendering invoice templates."""
-    company = get_company_info()
+def get_invoice_context(invoice, items=None, optional_texts=None, company=None):
+    """Build the context dict for rendering invoice templates.
+
+    ``items`` (in position order), ``optional_texts`` (all of them) and
+    ``company`` can be passed in when building contexts for many invoices.
+    """
+    if company is None:
+        company = get_company_info()
 
     # Get enabled optional texts
     optional_text_contents = []
     if invoice.optional_texts:
-        texts = OptionalText.query.filter(OptionalText.key.in_(invoice.optional_texts)).all()
+        if optional_texts is None:
+            texts = OptionalText.query.filter(OptionalText.key.in_(invoice.optional_texts)).all()
+        else:
+            texts = [text for text in optional_texts if text.key in invoice.optional_texts]
         for text in texts:
             content = text.content
             # Replace placeholders with company info
@@ -38,7 +78,10 @@ def get_invoice_context(invoice):
             content = content.replace("{swift}", company.get("swift", ""))
             optional_text_contents.append(content)
 
-    items = list(invoice.items.order_by("position").all())
+    if items is None:
+        items = list(invoice.items.order_by("position").all())
+    subtotal = sum(item.line_total for item in items)
+    tax = sum(item.tax_amount for item in items)
 
     return {
         "invoice": {
@@ -53,24 +96,54 @@ def get_invoice_context(invoice):
         "customer": invoice.customer.to_dict(),
         "items": [item.to_dict() for item in items],
         "totals": {
-            "subtotal": float(invoice.subtotal),
-            "tax": float(invoice.tax_total),
-            "total": float(invoice.total),
+            "subtotal": float(subtotal),
+            "tax": float(tax),
+            "total": float(subtotal + tax),
         },
         "optional_texts": optional_text_contents,
         "company": company,
     }
 
 
+def invoice_render_context(invoice):
+    """The context an invoice renders with.
+
+    Issued invoices render from the snapshot taken when they were issued, if
+    there is one, so later changes to customers, texts or company details
+    don't alter them.
+    """
+    snapshot = invoice.snapshot if invoice.status != "draft" else None
+    return snapshot.render_context(invoice.status) if snapshot is not None else get_invoice_context(invoice)
+
+
 def render_invoice_html(invoice):
     """Render invoice to HTML string."""
-    context = get_invoice_context(invoice)
     template_name = f"pdf/{invoice.template}.html"
-    return render_template(template_name, **context)
+    return render_template(template_name, **invoice_render_context(invoice))
+
 
+def pdf_profile_for(template):
+    """Name of the output profile for an invoice template.
 
-def generate_invoice_pdf(invoice):
-    """Generate PDF bytes from an invoice."""
+    ``PDF_TEMPLATE_PROFILES`` overrides the default ``PDF_PROFILE`` per template.
+    """
+    profile = tenant_setting("PDF_TEMPLATE_PROFILES", {}).get(template) or tenant_setting("PDF_PROFILE", "compact")
+    if profile not in PDF_PROFILES:
+        raise ValueError(f"Unknown PDF profile {profile!r}, expected one of: {', '.join(PDF_PROFILES)}")
+    return profile
+
+
+def generate_invoice_pdf(invoice, profile=None):
+    """Generate PDF bytes from an invoice, using the template's profile unless one is given."""
+    profile = profile or pdf_profile_for(invoice.template)
     html_content = render_invoice_html(invoice)
-    html = HTML(string=html_content, base_url=current_app.root_path)
-    return html.write_pdf()
+    return render_pdf(html_content, profile, current_app.root_path)
+
+
+def render_pdf(html_content, profile, base_url):
+    """Convert rendered invoice HTML to PDF bytes.
+
+    Needs no app context, so it can run in worker processes.
+    """
+    html = HTML(string=html_content, base_url=base_url)
+    return html.write_pdf(**PDF_PROFILES[profile])
@@ -0,0 +1,69 @@
+"""Record the SQL statements a block of code runs, to keep query counts in check.
+
+``scripts/query_budget.py`` uses this to fail when a route's query count
+exceeds its budget or grows with the size of the database (an N+1).
+"""
+import threading
+import time
+from collections import Counter, namedtuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+Statement = namedtuple("Statement", ["sql", "parameters", "executemany", "duration"])
+
+
+class QueryRecorder:
+    """Collect the statements executed on any engine while the recorder is active.
+
+    Only statements run by the thread that entered the recorder are kept, so
+    concurrent requests in other threads don't add to the count::
+
+        with QueryRecorder() as queries:
+            client.get("/invoices/")
+        print(queries.count)
+    """
+
+    def __init__(self):
+        self.statements = []
+        self._thread = None
+
+    def __enter__(self):
+        self.statements = []
+        self._thread = threading.get_ident()
+        event.listen(Engine, "before_cursor_execute", self._before)
+        event.listen(Engine, "after_cursor_execute", self._after)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "before_cursor_execute", self._before)
+        event.remove(Engine, "after_cursor_execute", self._after)
+
+    def _before(self, connection, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            connection.info.setdefault("query_log_start", []).append(time.perf_counter())
+
+    def _after(self, connection, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() != self._thread:
+            return
+        started = connection.info["query_log_start"].pop()
+        self.statements.append(Statement(statement, parameters, executemany, time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self):
+        """(sql, times run) for statements run more than once, most repeated first."""
+        counts = Counter(statement.sql for statement in self.statements)
+        return [(sql, times) for sql, times in counts.most_common() if times > 1]
+
+    def format(self, limit=None):
+        """The recorded statements as numbered lines, for reports."""
+        lines = []
+        for number, statement in enumerate(self.statements[:limit], start=1):
+            sql = " ".join(statement.sql.split())
+            many = " (executemany)" if statement.executemany else ""
+            lines.append(f"{number:>4}. [{statement.duration * 1000:.1f} ms]{many} {sql}")
+        if limit is not None and len(self.statements) > limit:
+            lines.append(f"      ... {len(self.statements) - limit} more")
+        return "\n".join(lines)
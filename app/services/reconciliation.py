@@ -0,0 +1,296 @@
+"""Match bank statement transactions to open invoices and mark them paid.
+
+Statements (CSV or CAMT.053 XML) are read as a stream of incoming payments.
+Open invoices are loaded once into hash indexes on invoice number and on
+amount + currency, so each transaction costs a few dictionary lookups and
+reconciling n transactions against m invoices is O(n + m).
+"""
+import codecs
+import csv
+import itertools
+import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from difflib import SequenceMatcher
+from app.models import Customer, Invoice, normalize_name
+from app.services.invoice_status import mark_invoices_paid
+from app.services.totals import invoices_with_totals
+
+Transaction = namedtuple("Transaction", ["date", "amount", "currency", "reference", "counterparty", "bank_ref"])
+
+Match = namedtuple("Match", ["transaction", "invoice", "total", "method", "score", "note"])
+
+# Invoice numbers look like YY-NNNN; payers also write them as "YY NNNN" or "YYNNNN"
+NUMBER_PATTERN = re.compile(r"(?<!\d)(\d{2})[\s\-/.]?(\d{4,})(?!\d)")
+
+# Minimum similarity of payer and customer name for a fuzzy match
+FUZZY_THRESHOLD = 0.6
+
+# Matches scoring at least this are preselected for review and applied by `flask reconcile --apply`
+CONFIDENT_SCORE = 0.9
+
+# Column names accepted in CSV statements, compared in lowercase
+CSV_COLUMNS = {
+    "date": ["date", "booking date", "value date", "transaction date"],
+    "amount": ["amount", "credit", "value"],
+    "currency": ["currency", "ccy"],
+    "reference": ["reference", "description", "remittance information", "details", "purpose", "memo"],
+    "counterparty": ["counterparty", "name", "payer", "debtor", "from"],
+    "bank_ref": ["id", "transaction id", "bank reference"],
+}
+
+
+class StatementError(Exception):
+    pass
+
+
+def parse_statement(filename, stream, default_currency=None):
+    """Yield incoming payments from a CSV or CAMT.053 file, by file extension."""
+    if filename.lower().endswith(".xml"):
+        return parse_camt053(stream)
+    return parse_csv(_decoded_lines(stream), default_currency)
+
+
+def _decoded_lines(stream):
+    """Text lines of a CSV file, read as UTF-8 until a line isn't, then as Windows-1252.
+
+    Many EU banks export Windows-1252 ("Überweisung", "€"). Lines before the
+    first non-UTF-8 one are ASCII in such files, so they read the same either way.
+    """
+    encoding = "utf-8"
+    for line_number, line in enumerate(stream, start=1):
+        if line_number == 1 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8):]
+        try:
+            text = line.decode(encoding)
+        except UnicodeDecodeError:
+            try:
+                text = line.decode("cp1252")
+            except UnicodeDecodeError:
+                raise StatementError(f"Line {line_number}: the CSV statement is neither UTF-8 nor Windows-1252.")
+            encoding = "cp1252"
+        yield text
+
+
+def parse_csv(lines, default_currency=None):
+    """Yield incoming payments (positive amounts) from lines of a CSV statement with a header row."""
+    lines = iter(lines)
+    first_line = next(lines, "")
+    try:
+        dialect = csv.Sniffer().sniff(first_line, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(itertools.chain([first_line], lines), dialect)
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        columns[field] = next((header.index(name) for name in names if name in header), None)
+    if columns["amount"] is None or columns["date"] is None:
+        raise StatementError("The CSV statement needs at least a date and an amount column.")
+
+    def value(row, field):
+        index = columns[field]
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    for line_number, row in enumerate(reader, start=2):
+        if not any(row):
+            continue
+        amount = _parse_amount(value(row, "amount"))
+        if amount is None:
+            raise StatementError(f"Line {line_number}: invalid amount {value(row, 'amount')!r}.")
+        if amount <= 0:
+            continue
+        yield Transaction(
+            _parse_date(value(row, "date")),
+            amount,
+            (value(row, "currency") or default_currency or "").upper(),
+            value(row, "reference"),
+            value(row, "counterparty"),
+            value(row, "bank_ref") or f"line {line_number}",
+        )
+
+
+def parse_camt053(stream):
+    """Yield incoming payments from a CAMT.053 bank-to-customer statement.
+
+    Entries are parsed as they are read and then discarded, so memory use
+    doesn't grow with the file.
+    """
+    try:
+        for _, element in ET.iterparse(stream, events=("end",)):
+            if _local_name(element.tag) != "Ntry":
+                continue
+            if _find_text(element, "CdtDbtInd") == "CRDT":
+                amount_element = _find(element, "Amt")
+                amount = _parse_amount(_text(amount_element))
+                if amount is None:
+                    raise StatementError(f"Invalid amount {_text(amount_element)!r} in a CAMT.053 entry.")
+                references = [_text(e) for e in element.iter() if _local_name(e.tag) in ("Ustrd", "Ref", "AddtlNtryInf")]
+                yield Transaction(
+                    _parse_date(_find_text(element, "BookgDt") or _find_text(element, "ValDt")),
+                    amount,
+                    amount_element.get("Ccy", "").upper(),
+                    " ".join(reference for reference in references if reference),
+                    _find_text(_find(element, "Dbtr"), "Nm"),
+                    _find_text(element, "AcctSvcrRef") or _find_text(element, "EndToEndId"),
+                )
+            element.clear()
+    except ET.ParseError as e:
+        raise StatementError(f"Invalid CAMT.053 file: {e}")
+
+
+def _local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+def _find(element, name):
+    if element is None:
+        return None
+    return next((e for e in element.iter() if _local_name(e.tag) == name), None)
+
+
+def _find_text(element, name):
+    return _text(_find(element, name))
+
+
+def _text(element):
+    if element is None:
+        return ""
+    # Dates like <BookgDt><Dt>...</Dt></BookgDt> keep their text one level down
+    return " ".join(text.strip() for text in element.itertext() if text.strip())
+
+
+def _parse_amount(text):
+    text = text.replace(" ", "").replace("\u00a0", "").replace("'", "")
+    if "," in text and "." in text:
+        # The last separator is the decimal one: 1.234,56 or 1,234.56
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        text = text.replace(",", ".")
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+
+def _parse_date(text):
+    text = text.strip()[:10]
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y%m%d"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _cents(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def _similarity(a, b):
+    a, b = normalize_name(a or ""), normalize_name(b or "")
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class InvoiceIndex:
+    """Open invoices indexed by number and by amount + currency."""
+
+    def __init__(self):
+        self.by_number = {}
+        self.by_amount = defaultdict(list)
+        rows = (
+            invoices_with_totals(Invoice.status == "issued")
+            .join(Customer, Customer.id == Invoice.customer_id)
+            .add_columns(Customer.name)
+            .all()
+        )
+        for invoice, total, customer_name in rows:
+            entry = (invoice, total, customer_name)
+            if invoice.number:
+                self.by_number[_number_key(invoice.number)] = entry
+            self.by_amount[(_cents(total), (invoice.currency or "").upper())].append(entry)
+
+    def numbers_in(self, text):
+        """Open invoices whose number appears in a remittance text."""
+        found = []
+        for year, sequence in NUMBER_PATTERN.findall(text or ""):
+            entry = self.by_number.get((year, int(sequence)))
+            if entry is not None and entry not in found:
+                found.append(entry)
+        return found
+
+
+def _number_key(number):
+    year, _, sequence = number.partition("-")
+    return (year, int(sequence)) if sequence.isdigit() else (number, 0)
+
+
+def match_transactions(transactions):
+    """Propose a matching open invoice for each transaction.
+
+    Tries, in order: an invoice number in the remittance text, a single open
+    invoice with the same amount and currency, and among several of those
+    the one whose customer name is most similar to the payer's. Each invoice
+    is proposed at most once. Returns (matches, unmatched transactions).
+    """
+    index = InvoiceIndex()
+    matches, unmatched, taken = [], [], set()
+
+    for transaction in transactions:
+        match = _match(index, transaction, taken)
+        if match is None:
+            unmatched.append(transaction)
+        else:
+            taken.add(match.invoice.id)
+            matches.append(match)
+    return matches, unmatched
+
+
+def _match(index, transaction, taken):
+    cents = _cents(transaction.amount)
+
+    for invoice, total, customer_name in index.numbers_in(transaction.reference):
+        if invoice.id in taken:
+            continue
+        note = None
+        if (invoice.currency or "").upper() != transaction.currency:
+            note = f"Currency differs: invoice is in {invoice.currency}"
+        elif _cents(total) != cents:
+            note = f"Amount differs: invoice total is {total:.2f}"
+        return Match(transaction, invoice, total, "reference", 1.0 if note is None else 0.5, note)
+
+    candidates = [
+        entry for entry in index.by_amount.get((cents, transaction.currency), []) if entry[0].id not in taken
+    ]
+    if len(candidates) == 1:
+        invoice, total, customer_name = candidates[0]
+        score = 0.9 if _similarity(transaction.counterparty, customer_name) >= FUZZY_THRESHOLD else 0.7
+        return Match(transaction, invoice, total, "amount", score, None)
+
+    # Several open invoices with this amount: pick the payer's, oldest first
+    scored = sorted(
+        ((_similarity(transaction.counterparty, customer_name), invoice.issue_date, invoice.id, (invoice, total))
+         for invoice, total, customer_name in candidates),
+        key=lambda candidate: (-candidate[0], candidate[1], candidate[2]),
+    )
+    if scored and scored[0][0] >= FUZZY_THRESHOLD:
+        score, _, _, (invoice, total) = scored[0]
+        return Match(transaction, invoice, total, "fuzzy", round(score * 0.8, 2), "Picked by payer name")
+    return None
+
+
+def apply_matches(invoice_ids):
+    """Mark the given issued invoices paid in a single transaction.
+
+    Invoices that are no longer issued are skipped. Returns the number marked paid.
+    """
+    if not invoice_ids:
+        return 0
+    return mark_invoices_paid(invoice_ids)[0]
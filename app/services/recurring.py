@@ -0,0 +1,177 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from app.models import db, Invoice, InvoiceItem, RecurringInvoice, RecurringInvoiceItem
+from app.services.numbering import reserve_invoice_numbers
+from app.services.snapshots import capture_snapshots
+from app.services.webhooks import record_invoice_events
+
+CADENCE_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+
+
+def parse_period(value):
+    """Parse a YYYY-MM billing period into the date of its first day."""
+    year, month = value.split("-")
+    return date(int(year), int(month), 1)
+
+
+def period_key(period_start):
+    return period_start.strftime("%Y-%m")
+
+
+def period_end(period_start):
+    next_month = (period_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+
+def add_months(period_start, months):
+    month_index = period_start.month - 1 + months
+    return date(period_start.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def is_due(recurring, period_start):
+    """Whether a recurring invoice bills in the period, counting cadence from its start month."""
+    if recurring.start_date > period_end(period_start):
+        return False
+    if recurring.end_date and recurring.end_date < period_start:
+        return False
+    months = (period_start.year - recurring.start_date.year) * 12 + (
+        period_start.month - recurring.start_date.month
+    )
+    return months % CADENCE_MONTHS[recurring.cadence] == 0
+
+
+def due_recurring_invoices(period_start):
+    """Active recurring invoices that bill in the period and have no invoice for it yet."""
+    already_generated = (
+        db.select(Invoice.id)
+        .where(Invoice.recurring_invoice_id == RecurringInvoice.id)
+        .where(Invoice.recurring_period == period_key(period_start))
+        .exists()
+    )
+    candidates = (
+        RecurringInvoice.query.options(joinedload(RecurringInvoice.customer))
+        .filter(RecurringInvoice.active.is_(True), ~already_generated)
+        .order_by(RecurringInvoice.id)
+        .all()
+    )
+    return [recurring for recurring in candidates if is_due(recurring, period_start)]
+
+
+def generate_recurring_invoices(period_start, issue_date=None, issue=True):
+    """Create the period's invoices for all due recurring invoices in one transaction.
+
+    Invoice numbers are reserved as one contiguous block and items are bulk
+    inserted. Running again for the same period creates nothing, since each
+    recurring invoice gets at most one invoice per period.
+    """
+    if issue_date is None:
+        today = date.today()
+        issue_date = today if period_start <= today <= period_end(period_start) else period_start
+
+    due = due_recurring_invoices(period_start)
+    if not due:
+        return []
+
+    items_by_recurring = defaultdict(list)
+    items = (
+        RecurringInvoiceItem.query.filter(
+            RecurringInvoiceItem.recurring_invoice_id.in_([recurring.id for recurring in due])
+        )
+        .order_by(RecurringInvoiceItem.position)
+        .all()
+    )
+    for item in items:
+        items_by_recurring[item.recurring_invoice_id].append(item)
+
+    numbers = reserve_invoice_numbers(issue_date, len(due)) if issue else [None] * len(due)
+
+    invoices = []
+    for recurring, number in zip(due, numbers):
+        payment_terms = recurring.customer.payment_terms
+        if payment_terms is None:
+            payment_terms = 14
+        invoices.append(
+            Invoice(
+                number=number,
+                customer_id=recurring.customer_id,
+                template=recurring.template,
+                issue_date=issue_date,
+                due_date=issue_date + timedelta(days=payment_terms),
+                currency=recurring.currency,
+                exchange_rate=recurring.exchange_rate,
+                notes=recurring.notes,
+                optional_texts=list(recurring.optional_texts or []),
+                status="issued" if issue else "draft",
+                recurring_invoice_id=recurring.id,
+                recurring_period=period_key(period_start),
+            )
+        )
+
+    try:
+        db.session.add_all(invoices)
+        db.session.flush()
+
+        item_rows = [
+            {
+                "invoice_id": invoice.id,
+                "description": item.description,
+                "quantity": item.quantity,
+                "unit": item.unit,
+                "unit_price": item.unit_price,
+                "tax_rate": item.tax_rate,
+                "position": item.position,
+            }
+            for invoice in invoices
+            for item in items_by_recurring[invoice.recurring_invoice_id]
+        ]
+        if item_rows:
+            db.session.execute(insert(InvoiceItem), item_rows)
+        invoice_ids = [invoice.id for invoice in invoices]
+        if issue:
+            capture_snapshots(invoice_ids)
+            record_invoice_events(invoice_ids, "invoice.created", "invoice.issued")
+        else:
+            record_invoice_events(invoice_ids, "invoice.created")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return invoices
+
+
+def create_recurring_from_invoice(invoice, cadence):
+    """Create a recurring invoice that repeats an existing invoice's customer, items and texts.
+
+    Billing starts with the period after the invoice's own, which it already covers.
+    """
+    invoice_period = invoice.issue_date.replace(day=1)
+    recurring = RecurringInvoice(
+        customer_id=invoice.customer_id,
+        template=invoice.template,
+        cadence=cadence,
+        start_date=add_months(invoice_period, CADENCE_MONTHS[cadence]),
+        currency=invoice.currency,
+        exchange_rate=invoice.exchange_rate,
+        notes=invoice.notes,
+        optional_texts=list(invoice.optional_texts or []),
+    )
+    db.session.add(recurring)
+    db.session.flush()
+
+    for item in invoice.items.order_by(InvoiceItem.position):
+        db.session.add(
+            RecurringInvoiceItem(
+                recurring_invoice_id=recurring.id,
+                description=item.description,
+                quantity=item.quantity,
+                unit=item.unit,
+                unit_price=item.unit_price,
+                tax_rate=item.tax_rate,
+                position=item.position,
+            )
+        )
+    db.session.commit()
+    return recurring
@@ -0,0 +1,117 @@
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, insert
+from app.models import db, Customer, Invoice, InvoiceItem
+from app.services.numbering import last_sequence
+
+CITIES = [
+    ("Sofia", "1000", "BG"),
+    ("Berlin", "10115", "DE"),
+    ("Vienna", "1010", "AT"),
+    ("Paris", "75001", "FR"),
+    ("Amsterdam", "1011", "NL"),
+    ("London", "EC1A 1BB", "GB"),
+    ("New York", "10001", "US"),
+]
+CURRENCIES = [("EUR", Decimal("1.0")), ("USD", Decimal("0.92")), ("GBP", Decimal("1.17"))]
+SERVICES = [
+    ("Software development", "hours", 85),
+    ("Consulting", "hours", 120),
+    ("Code review", "hours", 95),
+    ("Hosting", "months", 49),
+    ("Support retainer", "months", 450),
+    ("License", "pcs", 199),
+]
+
+
+def generate_sample_data(customers=100, invoices_per_customer=10, items_per_invoice=3, years=3, seed=0):
+    """Bulk-insert a reproducible dataset of customers, invoices and items.
+
+    Meant for benchmarks and load tests on an empty database. Invoices are
+    spread over the last ``years`` years; older ones are mostly paid, recent
+    ones issued, and a few are drafts. Returns the number of invoices created.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    first_day = date(today.year - years + 1, 1, 1)
+    span = (today - first_day).days
+
+    next_customer_id = (db.session.query(func.max(Customer.id)).scalar() or 0) + 1
+    next_invoice_id = (db.session.query(func.max(Invoice.id)).scalar() or 0) + 1
+
+    customer_rows = []
+    for i in range(customers):
+        city, zipcode, country = rng.choice(CITIES)
+        customer_rows.append({
+            "id": next_customer_id + i,
+            "name": f"Customer {next_customer_id + i:06d}",
+            "legal_name": f"Customer {next_customer_id + i:06d} Ltd.",
+            "vat_number": f"{country}{rng.randrange(10**8, 10**9)}",
+            "email": f"billing{next_customer_id + i}@example.com",
+            "address_line1": f"{rng.randrange(1, 200)} Main Street",
+            "city": city,
+            "zipcode": zipcode,
+            "country": country,
+            "payment_terms": rng.choice([7, 14, 14, 30]),
+            "created_at": datetime.utcnow(),
+        })
+
+    invoice_rows = []
+    for customer in customer_rows:
+        for _ in range(invoices_per_customer):
+            issue_date = first_day + timedelta(days=rng.randrange(span + 1))
+            age = (today - issue_date).days
+            if age > 60:
+                status = "paid" if rng.random() < 0.95 else "issued"
+            elif age > 7:
+                status = rng.choice(["issued", "issued", "paid"])
+            else:
+                status = rng.choice(["draft", "issued"])
+            currency, rate = CURRENCIES[0] if rng.random() < 0.8 else rng.choice(CURRENCIES[1:])
+            invoice_rows.append({
+                "customer_id": customer["id"],
+                "template": rng.choice(["default", "default", "detailed", "minimal"]),
+                "issue_date": issue_date,
+                "delivery_date": issue_date,
+                "due_date": issue_date + timedelta(days=customer["payment_terms"]),
+                "currency": currency,
+                "exchange_rate": rate,
+                "optional_texts": ["bank_details", "payment_terms"],
+                "status": status,
+                "created_at": datetime.utcnow(),
+            })
+
+    # Number issued invoices in issue date order, continuing each year's sequence
+    invoice_rows.sort(key=lambda row: row["issue_date"])
+    sequences = {}
+    for i, row in enumerate(invoice_rows):
+        row["id"] = next_invoice_id + i
+        row["number"] = None
+        if row["status"] != "draft":
+            year = row["issue_date"].strftime("%y")
+            if year not in sequences:
+                sequences[year] = last_sequence(year)
+            sequences[year] += 1
+            row["number"] = f"{year}-{sequences[year]:04d}"
+
+    item_rows = []
+    for row in invoice_rows:
+        for position in range(items_per_invoice):
+            description, unit, price = rng.choice(SERVICES)
+            item_rows.append({
+                "invoice_id": row["id"],
+                "description": description,
+                "quantity": Decimal(rng.randrange(1, 40)),
+                "unit": unit,
+                "unit_price": Decimal(price),
+                "tax_rate": Decimal(rng.choice([0, 20, 20])),
+                "position": position,
+            })
+
+    db.session.execute(insert(Customer), customer_rows)
+    db.session.execute(insert(Invoice), invoice_rows)
+    db.session.execute(insert(InvoiceItem), item_rows)
+    db.session.commit()
+    return len(invoice_rows)
+
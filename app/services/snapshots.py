@@ -0,0 +1,77 @@
+"""Freeze the render context of invoices when they are issued.
+
+An issued invoice is a legal document: it must keep looking the way it did
+when it was sent, even after the customer's address, the optional texts or
+the company details change. Each issued invoice gets an ``InvoiceSnapshot``
+holding its template context as JSON, which previews and PDFs render from.
+"""
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import joinedload
+from app.models import db, Invoice, InvoiceItem, InvoiceSnapshot, OptionalText
+from app.services.pdf import get_company_info, get_invoice_context
+
+
+def build_contexts(invoice_ids):
+    """Current render contexts of the given invoices, as {invoice id: context}.
+
+    Loads everything in a handful of queries whatever the number of invoices.
+    """
+    # Bulk updates (and changed foreign keys) leave loaded invoices stale, so reload them
+    db.session.flush()
+    invoices = (
+        Invoice.query.options(joinedload(Invoice.customer))
+        .filter(Invoice.id.in_(invoice_ids))
+        .populate_existing()
+        .all()
+    )
+    items = defaultdict(list)
+    for item in (
+        InvoiceItem.query.filter(InvoiceItem.invoice_id.in_(invoice_ids))
+        .order_by(InvoiceItem.invoice_id, InvoiceItem.position)
+    ):
+        items[item.invoice_id].append(item)
+    optional_texts = OptionalText.query.order_by(OptionalText.id).all()
+    company = get_company_info()
+    return {
+        invoice.id: get_invoice_context(invoice, items[invoice.id], optional_texts, company)
+        for invoice in invoices
+    }
+
+
+def capture_snapshots(invoice_ids):
+    """Snapshot the current render context of the given invoices.
+
+    Replaces existing snapshots. Doesn't commit, so the snapshots are written
+    in the same transaction that issues the invoices.
+    """
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return 0
+    now = datetime.utcnow()
+    rows = [
+        {"invoice_id": invoice_id, "context": InvoiceSnapshot.encode(context), "created_at": now}
+        for invoice_id, context in build_contexts(invoice_ids).items()
+    ]
+    db.session.execute(delete(InvoiceSnapshot).where(InvoiceSnapshot.invoice_id.in_(invoice_ids)))
+    if rows:
+        db.session.execute(insert(InvoiceSnapshot), rows)
+    return len(rows)
+
+
+def capture_snapshot(invoice):
+    """Snapshot a single invoice; see ``capture_snapshots``."""
+    capture_snapshots([invoice.id])
+    # The invoice may have a stale (or no) snapshot loaded
+    db.session.expire(invoice, ["snapshot"])
+
+
+def missing_snapshots():
+    """Issued and paid invoices that have no snapshot yet."""
+    return (
+        db.session.query(Invoice.id)
+        .outerjoin(InvoiceSnapshot, InvoiceSnapshot.invoice_id == Invoice.id)
+        .filter(Invoice.status != "draft", InvoiceSnapshot.invoice_id.is_(None))
+        .order_by(Invoice.id)
+    )
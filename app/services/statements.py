@@ -0,0 +1,102 @@
+"""Customer statements: a summary page and the customer's invoices in one PDF.
+
+The whole statement is a single HTML document laid out by WeasyPrint once,
+instead of one PDF per invoice merged afterwards. Each invoice is the
+``content`` block of its ``pdf/*.html`` template rendered with the
+invoice's own context, on a page of its own.
+"""
+from collections import OrderedDict
+from datetime import date
+from flask import current_app, render_template
+from markupsafe import Markup
+from sqlalchemy.orm import joinedload
+from app.models import Invoice
+from app.services.pdf import get_company_info, pdf_profile_for, render_pdf
+from app.services.snapshots import build_contexts
+
+
+def statement_invoices(customer_id, start=None, end=None):
+    """A customer's issued and paid invoices from ``start`` to ``end``, or its open ones without a period."""
+    query = Invoice.query.options(joinedload(Invoice.snapshot)).filter(Invoice.customer_id == customer_id)
+    if start is None and end is None:
+        query = query.filter(Invoice.status == "issued")
+    else:
+        query = query.filter(Invoice.status != "draft")
+        if start is not None:
+            query = query.filter(Invoice.issue_date >= start)
+        if end is not None:
+            query = query.filter(Invoice.issue_date <= end)
+    return query.order_by(Invoice.issue_date, Invoice.number).all()
+
+
+def describe_period(start=None, end=None):
+    if start is None and end is None:
+        return "Open invoices"
+    if start is None:
+        return f"Until {end}"
+    if end is None:
+        return f"Since {start}"
+    return f"{start} to {end}"
+
+
+def render_statement_html(customer, invoices, period, template="default"):
+    """Render the statement of ``invoices`` as one HTML document.
+
+    All invoices use the same invoice template, since the templates' styles
+    would otherwise apply to each other's pages.
+    """
+    # Snapshots where there are, the rest built in one batch
+    contexts = {
+        invoice.id: invoice.snapshot.render_context(invoice.status)
+        for invoice in invoices if invoice.snapshot is not None
+    }
+    missing = [invoice.id for invoice in invoices if invoice.id not in contexts]
+    if missing:
+        contexts.update(build_contexts(missing))
+
+    invoice_template = current_app.jinja_env.get_template(f"pdf/{template}.html")
+    content_block = invoice_template.blocks["content"]
+    sections = [
+        Markup("".join(content_block(invoice_template.new_context(contexts[invoice.id]))))
+        for invoice in invoices
+    ]
+    styles_block = invoice_template.blocks.get("extra_styles")
+    invoice_styles = Markup("".join(styles_block(invoice_template.new_context({})))) if styles_block else ""
+
+    today = date.today()
+    rows, totals = [], OrderedDict()
+    for invoice in invoices:
+        total = contexts[invoice.id]["totals"]["total"]
+        is_open = invoice.status == "issued"
+        rows.append({
+            "number": invoice.display_number,
+            "issue_date": invoice.issue_date,
+            "due_date": invoice.due_date,
+            "status": invoice.status,
+            "currency": invoice.currency,
+            "total": total,
+            "open": total if is_open else 0,
+            "overdue": is_open and invoice.due_date < today,
+        })
+        amounts = totals.setdefault(invoice.currency, {"total": 0, "open": 0})
+        amounts["total"] += total
+        amounts["open"] += total if is_open else 0
+
+    return render_template(
+        "pdf/statement.html",
+        customer=customer.to_dict(),
+        company=get_company_info(),
+        period=period,
+        statement_date=today,
+        rows=rows,
+        totals=totals,
+        sections=sections,
+        invoice_styles=invoice_styles,
+    )
+
+
+def generate_statement_pdf(customer, start=None, end=None, template="default", profile=None):
+    """PDF bytes of a customer's statement for a period, or of its open invoices."""
+    invoices = statement_invoices(customer.id, start, end)
+    html_content = render_statement_html(customer, invoices, describe_period(start, end), template)
+    return render_pdf(html_content, profile or pdf_profile_for(template), current_app.root_path)
@@ -0,0 +1,76 @@
+from sqlalchemy import case, distinct, func, select
+from app.models import db, Invoice, InvoiceItem
+
+
+def item_total_with_tax(item_model=InvoiceItem):
+    """SQL expression for an item's line total including tax.
+
+    Works for any item model with quantity, unit_price and tax_rate columns.
+    """
+    tax_rate = func.coalesce(item_model.tax_rate, 0)
+    # Divide by a float so SQLite doesn't fall back to integer division
+    return item_model.quantity * item_model.unit_price * (100 + tax_rate) / 100.0
+
+
+def customer_totals_subquery(customer_ids=None):
+    """Aggregate invoice count, open/paid amounts and last issue date per customer.
+
+    Amounts are in native currency. Pass ``customer_ids`` (a list or subquery)
+    to aggregate only those customers instead of the whole invoices table.
+    """
+    rate = func.coalesce(Invoice.exchange_rate, 1)
+    native_total = func.coalesce(item_total_with_tax(), 0) * rate
+
+    stmt = (
+        select(
+            Invoice.customer_id.label("customer_id"),
+            func.count(distinct(Invoice.id)).label("invoice_count"),
+            func.sum(case((Invoice.status == "issued", native_total), else_=0)).label("open_amount"),
+            func.sum(case((Invoice.status == "paid", native_total), else_=0)).label("paid_amount"),
+            func.max(Invoice.issue_date).label("last_issue_date"),
+        )
+        .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        .group_by(Invoice.customer_id)
+    )
+    if customer_ids is not None:
+        stmt = stmt.where(Invoice.customer_id.in_(customer_ids))
+
+    return stmt.subquery("customer_totals")
+
+
+def invoices_with_totals(*criteria, session=None):
+    """Query (invoice, total) rows with totals summed in SQL rather than per invoice."""
+    total = func.coalesce(func.sum(item_total_with_tax()), 0).label("total")
+    return (
+        (session or db.session).query(Invoice, total)
+        .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        .filter(*criteria)
+        .group_by(Invoice.id)
+    )
+
+
+def totals_by_status(*criteria, session=None, overdue=None):
+    """Invoice count and native-currency total per status, as {status: (count, total)}.
+
+    ``overdue`` is an optional SQL condition; invoices matching it are also
+    counted under "overdue", in the same query.
+    """
+    native_total = func.coalesce(item_total_with_tax(), 0) * func.coalesce(Invoice.exchange_rate, 1)
+    groups = [Invoice.status]
+    if overdue is not None:
+        groups.append(case((overdue, True), else_=False))
+    rows = (
+        (session or db.session).query(
+            *groups, func.count(distinct(Invoice.id)), func.coalesce(func.sum(native_total), 0)
+        )
+        .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        .filter(*criteria)
+        .group_by(*groups)
+    )
+    totals = {}
+    for row in rows:
+        status, count, total = row[0], row[-2], row[-1]
+        for key in (status, "overdue") if overdue is not None and row[1] else (status,):
+            previous_count, previous_total = totals.get(key, (0, 0))
+            totals[key] = (previous_count + count, previous_total + total)
+    return totals
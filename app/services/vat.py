@@ -0,0 +1,512 @@
+"""Validate customers' VAT numbers, locally and against a registry, with a cache.
+
+Every number is first checked against its country's format and check digit,
+which needs no network and catches most typos. Numbers that pass are then
+looked up through the ``VAT_BACKEND``: the EU's VIES registry by default,
+``none`` for local rules only, or ``module:factory`` for another backend
+(``VAT_VIES_URL`` can also point VIES lookups at a local stand-in such as
+scripts/vies_stub.py).
+
+Results are stored in ``vat_checks`` for ``VAT_CACHE_TTL`` days, or
+``VAT_RETRY_AFTER`` minutes when the registry couldn't answer, behind a
+per-process LRU. Requests only ever read the cache. A number missing from it
+is answered by the local rules and queued for a background thread to look
+up. ``flask validate-vat`` refreshes all customers' numbers with at most
+``VAT_LOOKUP_CONCURRENCY`` lookups at a time.
+"""
+import http.client
+import importlib
+import json
+import queue
+import re
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from flask import current_app
+from sqlalchemy import delete, insert, select
+from app.models import db, Customer, VatCheck, normalize_vat
+from app.services.background import HttpClient, start_on_first_request
+from app.services.customer_search import PrefixCache
+from app.tenancy import current_tenant, tenant_context
+
+VIES_URL = "https://ec.europa.eu/taxation_customs/vies/rest-api"
+
+# Optional text whose invoices need a valid VAT number to be issued
+REVERSE_CHARGE_TEXT = "vat_reverse_charge"
+
+VatResult = namedtuple("VatResult", ["vat_number", "status", "name", "address", "error"])
+ValidationRun = namedtuple("ValidationRun", ["numbers", "lookups", "statuses"])
+
+# Results read in this process, as (tenant slug, VAT number); short-lived,
+# so other processes' lookups show up soon
+_memory = PrefixCache(max_entries=4096, ttl=300)
+
+# Cache misses waiting for the background lookup thread, as (tenant slug, VAT number)
+_lookups = queue.Queue()
+_queued = set()
+_queued_lock = threading.Lock()
+_lookups_running = threading.Event()
+
+
+class VatError(Exception):
+    pass
+
+
+def _weighted(digits, weights):
+    return sum(int(digit) * weight for digit, weight in zip(digits, weights))
+
+
+def _luhn(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        digit = int(digit)
+        if position % 2:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        total += digit
+    return total % 10 == 0
+
+
+def _mod_11_10(digits):
+    # ISO 7064 MOD 11,10
+    product = 10
+    for digit in digits[:-1]:
+        product = ((int(digit) + product) % 10 or 10) * 2 % 11
+    return (11 - product) % 10 == int(digits[-1])
+
+
+def _check_at(number):
+    digits = number[1:]
+    total = sum(
+        int(digit) if i % 2 == 0 else sum(divmod(int(digit) * 2, 10)) for i, digit in enumerate(digits[:7])
+    )
+    return (10 - (total + 4) % 10) % 10 == int(digits[7])
+
+
+def _check_bg(number):
+    if len(number) == 10:
+        return True  # Personal and foreigners' numbers have rules of their own
+    check = _weighted(number, range(1, 9)) % 11
+    if check == 10:
+        check = _weighted(number, range(3, 11)) % 11 % 10
+    return check == int(number[8])
+
+
+def _check_dk(number):
+    return _weighted(number, (2, 7, 6, 5, 4, 3, 2, 1)) % 11 == 0
+
+
+def _check_el(number):
+    total = _weighted(number, (256, 128, 64, 32, 16, 8, 4, 2))
+    return total % 11 % 10 == int(number[8])
+
+
+def _check_fi(number):
+    return _weighted(number, (7, 9, 10, 5, 8, 4, 2, 1)) % 11 == 0
+
+
+def _check_fr(number):
+    key, siren = number[:2], number[2:]
+    # The SIREN has a Luhn check digit, except for a few public bodies' 000... numbers
+    if not siren.startswith("000") and not _luhn(siren):
+        return False
+    if not key.isdigit():
+        return True  # Newer keys with letters have no published check
+    return int(key) == (12 + 3 * (int(siren) % 97)) % 97
+
+
+def _check_hu(number):
+    return _weighted(number, (9, 7, 3, 1, 9, 7, 3, 1)) % 10 == 0
+
+
+def _check_mt(number):
+    return _weighted(number, (3, 4, 6, 7, 8, 9, 10, 1)) % 37 == 0
+
+
+def _check_nl(number):
+    digits = number[:9]
+    # Legal entities: eleven-test; sole traders since 2020: ISO 7064 MOD 97-10 over "NL" + number
+    eleven = _weighted(digits, range(9, 1, -1)) - int(digits[8])
+    return eleven % 11 == 0 or int("2321" + digits + "11" + number[10:]) % 97 == 1
+
+
+def _check_pl(number):
+    check = _weighted(number, (6, 5, 7, 2, 3, 4, 5, 6, 7)) % 11
+    return check == int(number[9])
+
+
+def _check_pt(number):
+    check = 11 - _weighted(number, range(9, 1, -1)) % 11
+    return (0 if check > 9 else check) == int(number[8])
+
+
+def _check_ro(number):
+    digits = number.zfill(10)
+    check = _weighted(digits, (7, 5, 3, 2, 1, 7, 5, 3, 2)) * 10 % 11 % 10
+    return check == int(digits[9])
+
+
+def _check_si(number):
+    check = 11 - _weighted(number, range(8, 1, -1)) % 11
+    return check != 11 and check % 10 == int(number[7])
+
+
+# Country code (VIES uses EL for Greece) -> (number without the country code, check digit test)
+RULES = {
+    "AT": (re.compile(r"U\d{8}"), _check_at),
+    "BE": (re.compile(r"[01]\d{9}"), lambda n: (int(n[:8]) + int(n[8:])) % 97 == 0),
+    "BG": (re.compile(r"\d{9,10}"), _check_bg),
+    "CY": (re.compile(r"[013459]\d{7}[A-Z]"), None),
+    "CZ": (re.compile(r"\d{8,10}"), None),
+    "DE": (re.compile(r"[1-9]\d{8}"), _mod_11_10),
+    "DK": (re.compile(r"[1-9]\d{7}"), _check_dk),
+    "EE": (re.compile(r"10\d{7}"), lambda n: _weighted(n, (3, 7, 1, 3, 7, 1, 3, 7, 1)) % 10 == 0),
+    "EL": (re.compile(r"\d{9}"), _check_el),
+    "ES": (re.compile(r"[0-9A-Z]\d{7}[0-9A-Z]"), None),
+    "FI": (re.compile(r"\d{8}"), _check_fi),
+    "FR": (re.compile(r"[0-9A-HJ-NP-Z]{2}\d{9}"), _check_fr),
+    "HR": (re.compile(r"\d{11}"), _mod_11_10),
+    "HU": (re.compile(r"\d{8}"), _check_hu),
+    "IE": (re.compile(r"\d{7}[A-W][A-IW]?|\d[A-Z+*]\d{5}[A-W]"), None),
+    "IT": (re.compile(r"\d{11}"), _luhn),
+    "LT": (re.compile(r"\d{9}|\d{12}"), None),
+    "LU": (re.compile(r"\d{8}"), lambda n: int(n[:6]) % 89 == int(n[6:])),
+    "LV": (re.compile(r"\d{11}"), None),
+    "MT": (re.compile(r"[1-9]\d{7}"), _check_mt),
+    "NL": (re.compile(r"\d{9}B\d{2}"), _check_nl),
+    "PL": (re.compile(r"\d{10}"), _check_pl),
+    "PT": (re.compile(r"\d{9}"), _check_pt),
+    "RO": (re.compile(r"[1-9]\d{1,9}"), _check_ro),
+    "SE": (re.compile(r"\d{10}01"), lambda n: _luhn(n[:10])),
+    "SI": (re.compile(r"[1-9]\d{7}"), _check_si),
+    "SK": (re.compile(r"[1-9]\d[2-47-9]\d{7}"), lambda n: int(n) % 11 == 0),
+    "XI": (re.compile(r"\d{9}|\d{12}|GD\d{3}|HA\d{3}"), None),
+}
+
+COUNTRY_ALIASES = {"GR": "EL"}
+
+
+def vat_key(vat_number, country=None):
+    """The normalized number with its country code, e.g. ("123 456 789", "DE") -> "DE123456789".
+
+    Numbers entered without a country code get the customer's country if
+    that is a two-letter code. Returns None for an empty number.
+    """
+    number = normalize_vat(vat_number)
+    if not number:
+        return None
+    if not number[:2].isalpha():
+        country = (country or "").strip().upper()
+        if len(country) != 2 or not country.isalpha():
+            return number
+        number = country + number
+    return COUNTRY_ALIASES.get(number[:2], number[:2]) + number[2:]
+
+
+def check_number(vat_number):
+    """Check a number (as returned by ``vat_key``) against its country's format and check digit.
+
+    Numbers that pass are "unconfirmed" until a registry confirms them.
+    """
+    country, number = vat_number[:2], vat_number[2:]
+    rule = RULES.get(country) if country.isalpha() else None
+    if rule is None:
+        return VatResult(vat_number, "unsupported", None, None, "Not an EU VAT number.")
+    pattern, check = rule
+    if not pattern.fullmatch(number):
+        return VatResult(vat_number, "invalid", None, None, f"Not in the format of {country} VAT numbers.")
+    if check is not None and not check(number):
+        return VatResult(vat_number, "invalid", None, None, "The check digit doesn't match.")
+    return VatResult(vat_number, "unconfirmed", None, None, None)
+
+
+class ViesBackend:
+    """Looks numbers up in the VIES REST API, or anything answering like it.
+
+    Each thread keeps its own connection alive across lookups. Answers other
+    than valid or invalid (a member state's service being down, too many
+    concurrent requests) and network errors leave the number unconfirmed.
+    """
+
+    def __init__(self, url=VIES_URL, timeout=10):
+        self.url = url.rstrip("/")
+        self.client = HttpClient(timeout)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("VAT_VIES_URL") or VIES_URL, timeout=config.get("VAT_TIMEOUT", 10))
+
+    def lookup(self, vat_number):
+        url = f"{self.url}/ms/{vat_number[:2]}/vat/{quote(vat_number[2:])}"
+        try:
+            status, body = self.client.request("GET", url, headers={"Accept": "application/json"})
+            if status != 200:
+                raise OSError(f"HTTP {status}")
+            data = json.loads(body)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            return VatResult(vat_number, "unconfirmed", None, None, f"VIES lookup failed: {e}")
+        if data.get("isValid"):
+            return VatResult(vat_number, "valid", _registered(data.get("name")), _registered(data.get("address")), None)
+        error = data.get("userError") or "INVALID"
+        if error == "INVALID":
+            return VatResult(vat_number, "invalid", None, None, "Not registered for VAT (VIES).")
+        return VatResult(vat_number, "unconfirmed", None, None, f"VIES couldn't answer: {error}")
+
+
+def _registered(value):
+    # VIES answers "---" for details a member state doesn't share
+    value = (value or "").strip()
+    return value if value and value != "---" else None
+
+
+def lookup_backend(config=None):
+    """The configured registry backend, or None for local rules only."""
+    config = config if config is not None else current_app.config
+    name = config.get("VAT_BACKEND") or "none"
+    if name == "none":
+        return None
+    if name == "vies":
+        return ViesBackend.from_config(config)
+    module_name, _, factory = name.partition(":")
+    try:
+        return getattr(importlib.import_module(module_name), factory)(config)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise VatError(f"VAT_BACKEND must be vies, none or module:factory, not {name!r}: {e}")
+
+
+def _lookup(backend, vat_number):
+    try:
+        return backend.lookup(vat_number)
+    except Exception as e:
+        return VatResult(vat_number, "unconfirmed", None, None, f"Lookup failed: {e}")
+
+
+def cached_result(vat_number, country=None):
+    """The cached result for a customer's VAT number, never waiting for a lookup.
+
+    Returns None without a number.
+    """
+    vat_number = vat_key(vat_number, country)
+    return cached_results([vat_number])[vat_number] if vat_number else None
+
+
+def cached_results(vat_numbers):
+    """Cached results for numbers as returned by ``vat_key``, as {number: VatResult}.
+
+    Numbers not in the per-process LRU are read with one query. Those missing
+    or expired there are checked against local rules; the ones that pass get
+    the expired result, if any, or "unconfirmed" and are queued for lookup.
+    """
+    slug = _tenant_slug()
+    results, misses = {}, []
+    for vat_number in set(vat_numbers):
+        result = _memory.get((slug, vat_number))
+        if result is None:
+            misses.append(vat_number)
+        else:
+            results[vat_number] = result
+    if not misses:
+        return results
+
+    now = datetime.utcnow()
+    checks = {check.vat_number: check for check in VatCheck.query.filter(VatCheck.vat_number.in_(misses))}
+    stale = []
+    for vat_number in misses:
+        check = checks.get(vat_number)
+        if check is not None and check.expires_at > now:
+            result = _result(check)
+        else:
+            result = check_number(vat_number)
+            if result.status == "unconfirmed":
+                stale.append(vat_number)
+                if check is not None:
+                    result = _result(check)
+        # Queued ones are replaced in memory once looked up
+        _memory.set((slug, vat_number), result)
+        results[vat_number] = result
+    queue_lookups(stale)
+    return results
+
+
+def _tenant_slug():
+    # Each tenant has its own vat_checks table, so cached results are kept per tenant
+    tenant = current_tenant()
+    return tenant.slug if tenant is not None else None
+
+
+def _result(check):
+    return VatResult(check.vat_number, check.status, check.name, check.address, check.error)
+
+
+def store_results(results):
+    """Replace the cached results for these numbers; the caller commits.
+
+    A failed lookup doesn't replace the registry's last answer, it only
+    schedules the next try ``VAT_RETRY_AFTER`` minutes later.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    retry_at = now + timedelta(minutes=config.get("VAT_RETRY_AFTER", 60))
+    expires_at = now + timedelta(days=config.get("VAT_CACHE_TTL", 30))
+    failed = {result.vat_number for result in results if result.status == "unconfirmed" and result.error}
+    answered = {}
+    if failed:
+        answered = {
+            check.vat_number: check
+            for check in VatCheck.query.filter(VatCheck.vat_number.in_(failed), VatCheck.status.in_(("valid", "invalid")))
+        }
+    rows = {}
+    for result in results:
+        check = answered.get(result.vat_number)
+        if check is not None:
+            rows[result.vat_number] = {**_result(check)._asdict(), "checked_at": check.checked_at, "expires_at": retry_at}
+        else:
+            rows[result.vat_number] = {
+                **result._asdict(),
+                "error": result.error and result.error[:500],
+                "checked_at": now,
+                "expires_at": retry_at if result.vat_number in failed else expires_at,
+            }
+    if not rows:
+        return
+    db.session.execute(delete(VatCheck).where(VatCheck.vat_number.in_(list(rows))))
+    db.session.execute(insert(VatCheck), list(rows.values()))
+    slug = _tenant_slug()
+    for vat_number, row in rows.items():
+        _memory.set((slug, vat_number), VatResult(*(row[field] for field in VatResult._fields)))
+
+
+def validate_customers(concurrency=None, refresh=False, backend=None, chunk_size=200):
+    """Validate all customers' VAT numbers whose cached result expired, or all with ``refresh``.
+
+    Numbers failing the local rules are settled without a lookup. The rest
+    are looked up ``concurrency`` at a time and their results committed every
+    ``chunk_size`` numbers, so an interrupted run keeps what it got. Returns
+    the numbers checked, lookups made and a Counter of statuses.
+    """
+    config = current_app.config
+    if backend is None:
+        backend = lookup_backend()
+    concurrency = concurrency or config.get("VAT_LOOKUP_CONCURRENCY", 4)
+    customers = db.session.query(Customer.vat_number, Customer.country).filter(Customer.search_vat.isnot(None))
+    vat_numbers = {vat_key(vat_number, country) for vat_number, country in customers} - {None}
+    if not refresh:
+        vat_numbers -= set(db.session.scalars(select(VatCheck.vat_number).where(VatCheck.expires_at > datetime.utcnow())))
+
+    results = [check_number(vat_number) for vat_number in sorted(vat_numbers)]
+    pending = [result.vat_number for result in results if result.status == "unconfirmed"] if backend else []
+    settled = [result for result in results if result.status != "unconfirmed" or not backend]
+    statuses = Counter(result.status for result in settled)
+    for start in range(0, len(settled), chunk_size):
+        store_results(settled[start:start + chunk_size])
+        db.session.commit()
+
+    if pending:
+        chunk = []
+        # Only the worker threads talk to the registry; results are stored from this one
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for result in pool.map(lambda vat_number: _lookup(backend, vat_number), pending):
+                statuses[result.status] += 1
+                chunk.append(result)
+                if len(chunk) >= chunk_size:
+                    store_results(chunk)
+                    db.session.commit()
+                    chunk = []
+        store_results(chunk)
+        db.session.commit()
+    return ValidationRun(len(vat_numbers), len(pending), statuses)
+
+
+def reverse_charge_error(customer_id):
+    """Why a reverse-charge invoice can't be issued to this customer, or None.
+
+    Customers without a number and numbers known to be invalid are refused;
+    unconfirmed ones pass, since issuing never waits for a lookup.
+    """
+    customer = db.session.query(Customer.vat_number, Customer.country).filter(Customer.id == customer_id).first()
+    if customer is None:
+        return None
+    if not vat_key(customer.vat_number, customer.country):
+        return "the customer has no VAT number"
+    result = cached_result(customer.vat_number, customer.country)
+    if result is None or result.status != "invalid":
+        return None
+    return f"the customer's VAT number {result.vat_number} is invalid ({result.error.rstrip('.')})"
+
+
+def reverse_charge_errors(invoices):
+    """{invoice: reason} for the reverse-charge invoices whose customer has no or an invalid VAT number."""
+    invoices = [invoice for invoice in invoices if REVERSE_CHARGE_TEXT in (invoice.optional_texts or [])]
+    if not invoices:
+        return {}
+    customers = {
+        id: vat_key(vat_number, country)
+        for id, vat_number, country in db.session.query(Customer.id, Customer.vat_number, Customer.country)
+        .filter(Customer.id.in_({invoice.customer_id for invoice in invoices}))
+    }
+    results = cached_results(vat_number for vat_number in customers.values() if vat_number)
+    errors = {}
+    for invoice in invoices:
+        if not customers.get(invoice.customer_id):
+            errors[invoice] = "has reverse charge, but the customer has no VAT number"
+            continue
+        result = results.get(customers[invoice.customer_id])
+        if result is not None and result.status == "invalid":
+            errors[invoice] = (
+                f"has reverse charge, but the customer's VAT number {result.vat_number} "
+                f"is invalid ({result.error.rstrip('.')})"
+            )
+    return errors
+
+
+def queue_lookups(vat_numbers):
+    """Queue numbers for the background lookup thread, if it runs in this process."""
+    if not _lookups_running.is_set():
+        return
+    slug = _tenant_slug()
+    with _queued_lock:
+        for vat_number in vat_numbers:
+            if (slug, vat_number) not in _queued:
+                _queued.add((slug, vat_number))
+                _lookups.put((slug, vat_number))
+
+
+def start_vat_lookups(app):
+    """Look up numbers missing from the cache from a background thread of a serving process.
+
+    Only with a registry backend configured. Lookups run one at a time; bulk
+    checks are for ``flask validate-vat``.
+    """
+    if (app.config.get("VAT_BACKEND") or "none") == "none":
+        return
+    start_on_first_request(app, _run_lookups, running=_lookups_running)
+
+
+def _run_lookups(app):
+    try:
+        backend = lookup_backend(app.config)
+    except VatError as e:
+        _lookups_running.clear()
+        app.logger.error("VAT lookups are off: %s", e)
+        return
+    while True:
+        slug, vat_number = _lookups.get()
+        try:
+            result = _lookup(backend, vat_number)
+            with app.app_context():
+                if slug is None:
+                    _store_one(result)
+                else:
+                    with tenant_context(slug):
+                        _store_one(result)
+        except Exception:
+            app.logger.exception("Storing the VAT lookup of %s failed", vat_number)
+        finally:
+            with _queued_lock:
+                _queued.discard((slug, vat_number))
+
+
+def _store_one(result):
+    store_results([result])
+    db.session.commit()
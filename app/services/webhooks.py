@@ -0,0 +1,345 @@
+"""Tell other systems about invoice changes through webhooks.
+
+Every change records an ``OutboxEvent``, plus a pending ``WebhookDelivery``
+for each ``WEBHOOK_URLS`` endpoint, in the same transaction as the change.
+So an event exists exactly when its change was committed, and requests never
+wait on a remote endpoint. A dispatcher POSTs pending events to each endpoint
+in batches over kept-alive connections. It runs as a background thread of the
+app, woken up by commits that recorded events, or as ``flask
+dispatch-webhooks``.
+
+Events of one invoice arrive in order. A batch holds an invoice's events in
+order, and while one of them waits for a retry the later ones wait with it.
+Failed batches are retried with exponential backoff. After
+``WEBHOOK_MAX_ATTEMPTS`` attempts, or right away when the endpoint rejects
+them with a 4xx, the deliveries are dead-lettered. They are then listed
+under Settings > Webhooks until retried. Receivers should deduplicate by
+event ID, since a batch whose response was lost is sent again. Delivered
+events are deleted after ``WEBHOOK_RETENTION_DAYS``.
+"""
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, event, exists, func, insert, select
+from sqlalchemy.orm import Session, contains_eager
+from app.models import db, Invoice, OutboxEvent, WebhookDelivery
+from app.services.background import HttpClient, exclusive_lock, start_on_first_request
+from app.services.totals import invoices_with_totals
+from app.tenancy import tenant_context, tenant_setting
+
+EVENT_TYPES = ("invoice.created", "invoice.issued", "invoice.paid", "invoice.deleted")
+
+# Rejections that are worth retrying despite being 4xx
+RETRYABLE_STATUSES = {408, 425, 429}
+
+DispatchRun = namedtuple("DispatchRun", ["batches", "delivered", "failed", "dead", "pruned"], defaults=[0])
+
+# How often dispatching also deletes delivered events past WEBHOOK_RETENTION_DAYS
+PRUNE_INTERVAL = timedelta(hours=1)
+
+# Set by commits that recorded events, so the background dispatcher sends them right away
+_wakeup = threading.Event()
+
+# When each database (by tenant slug) was last pruned in this process
+_pruned_at = {}
+
+
+def webhook_endpoints():
+    value = tenant_setting("WEBHOOK_URLS") or []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [url.strip() for url in value if url.strip()]
+
+
+def record_invoice_events(invoice_ids, *event_types):
+    """Add events of the given types for each invoice, and their deliveries, to the current transaction.
+
+    Call it after the change and before the commit (before the delete, for
+    deleted invoices). The payloads are built from the invoices as they are
+    in the transaction, with totals summed in one query, and events and
+    deliveries are inserted with one statement each. Without endpoints
+    nothing is recorded. Returns the event IDs.
+    """
+    for event_type in event_types:
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type {event_type!r}")
+    endpoints = webhook_endpoints()
+    if not endpoints:
+        return []
+    db.session.flush()
+    rows = (
+        invoices_with_totals(Invoice.id.in_(list(invoice_ids)))
+        .order_by(Invoice.id)
+        # Bulk updates by primary key leave loaded invoices stale
+        .populate_existing()
+        .all()
+    )
+    if not rows:
+        return []
+    now = datetime.utcnow()
+    events = []
+    for invoice, total in rows:
+        payload = json.dumps(_payload(invoice, total))
+        events.extend(
+            {"event_type": event_type, "invoice_id": invoice.id, "payload": payload, "created_at": now}
+            for event_type in event_types
+        )
+    # Only IDs and invoices are needed back, in any order, so this is a single multi-row INSERT
+    inserted = db.session.execute(insert(OutboxEvent).returning(OutboxEvent.id, OutboxEvent.invoice_id), events).all()
+    db.session.execute(
+        insert(WebhookDelivery),
+        [
+            {
+                "event_id": event_id,
+                "endpoint": endpoint,
+                "invoice_id": invoice_id,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+            }
+            for event_id, invoice_id in sorted(inserted)
+            for endpoint in endpoints
+        ],
+    )
+    db.session.info["webhook_events"] = True
+    return sorted(event_id for event_id, _ in inserted)
+
+
+def record_invoice_event(invoice, *event_types):
+    return record_invoice_events([invoice.id], *event_types)
+
+
+def _payload(invoice, total):
+    payload = invoice.to_dict()
+    payload["total"] = round(float(total), 2)
+    return payload
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session):
+    if session.info.pop("webhook_events", False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_events(session):
+    session.info.pop("webhook_events", None)
+
+
+class WebhookClient(HttpClient):
+    """HTTP connections to webhook endpoints, kept alive and reused across batches."""
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout, user_agent="InvoiciPy-Webhooks")
+
+    def post(self, url, body, secret=None):
+        """POST a JSON body, signed with ``secret`` if given, and return the response status."""
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-InvoiciPy-Signature"] = f"sha256={signature}"
+        status, _ = self.request("POST", url, body, headers)
+        return status
+
+
+def dispatch_pending(client=None, batch_size=None, now=None):
+    """Send every pending delivery that is due, in batches per endpoint.
+
+    Each batch is committed once its outcome is known. Pass a ``client`` to
+    keep its connections open across runs. Returns counts of batches and of
+    delivered, failed (to be retried) and dead deliveries.
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get("WEBHOOK_BATCH_SIZE", 100)
+    now = now or datetime.utcnow()
+    counts = {"batches": 0, "delivered": 0, "failed": 0, "dead": 0}
+    endpoints = [
+        endpoint for (endpoint,) in db.session.query(WebhookDelivery.endpoint)
+        .filter(WebhookDelivery.status == "pending", WebhookDelivery.next_attempt_at <= now)
+        .distinct()
+    ]
+    if not endpoints:
+        return DispatchRun(**counts)
+
+    own_client = client is None
+    client = client or WebhookClient(timeout=config.get("WEBHOOK_TIMEOUT", 10))
+    secret = tenant_setting("WEBHOOK_SECRET")
+    try:
+        for endpoint in endpoints:
+            while True:
+                batch = _next_batch(endpoint, now, batch_size)
+                if not batch:
+                    break
+                delivered = _send_batch(client, endpoint, batch, secret)
+                counts["batches"] += 1
+                for delivery in batch:
+                    counts["failed" if delivery.status == "pending" else delivery.status] += 1
+                db.session.commit()
+                if not delivered:
+                    # The endpoint is down or rejecting; try its other events next round
+                    break
+    finally:
+        if own_client:
+            client.close()
+    return DispatchRun(**counts)
+
+
+def _next_batch(endpoint, now, batch_size):
+    # Invoices whose oldest pending event waits for a retry hold back their later events
+    waiting = select(WebhookDelivery.invoice_id).where(
+        WebhookDelivery.endpoint == endpoint,
+        WebhookDelivery.status == "pending",
+        WebhookDelivery.next_attempt_at > now,
+    )
+    return (
+        WebhookDelivery.query.join(WebhookDelivery.event)
+        .options(contains_eager(WebhookDelivery.event))
+        .filter(
+            WebhookDelivery.endpoint == endpoint,
+            WebhookDelivery.status == "pending",
+            WebhookDelivery.invoice_id.notin_(waiting),
+        )
+        .order_by(WebhookDelivery.id)
+        .limit(batch_size)
+        .all()
+    )
+
+
+def _send_batch(client, endpoint, batch, secret):
+    """POST one batch and record the outcome on its deliveries; returns whether it was delivered."""
+    config = current_app.config
+    body = json.dumps({"events": [delivery.event.document() for delivery in batch]}).encode()
+    permanent = False
+    try:
+        status = client.post(endpoint, body, secret)
+        error = None if 200 <= status < 300 else f"HTTP {status}"
+        permanent = 400 <= status < 500 and status not in RETRYABLE_STATUSES
+    except (OSError, http.client.HTTPException) as e:
+        error = str(e) or e.__class__.__name__
+
+    now = datetime.utcnow()
+    max_attempts = config.get("WEBHOOK_MAX_ATTEMPTS", 8)
+    backoff = config.get("WEBHOOK_RETRY_BACKOFF", 30)
+    for delivery in batch:
+        delivery.attempts += 1
+        delivery.last_error = error
+        if error is None:
+            delivery.status = "delivered"
+            delivery.delivered_at = now
+        elif permanent or delivery.attempts >= max_attempts:
+            delivery.status = "dead"
+        else:
+            delivery.next_attempt_at = now + timedelta(seconds=backoff * 2 ** (delivery.attempts - 1))
+    return error is None
+
+
+def prune_delivered(days=None, now=None):
+    """Delete deliveries made more than ``days`` ago, and events left without deliveries.
+
+    ``days`` defaults to ``WEBHOOK_RETENTION_DAYS``; 0 keeps everything.
+    Pending and dead deliveries are kept. Returns the number of events deleted.
+    """
+    days = tenant_setting("WEBHOOK_RETENTION_DAYS") if days is None else days
+    if not days:
+        return 0
+    cutoff = (now or datetime.utcnow()) - timedelta(days=float(days))
+    db.session.execute(
+        delete(WebhookDelivery).where(WebhookDelivery.status == "delivered", WebhookDelivery.delivered_at < cutoff)
+    )
+    pruned = db.session.execute(
+        delete(OutboxEvent).where(
+            OutboxEvent.created_at < cutoff,
+            ~exists().where(WebhookDelivery.event_id == OutboxEvent.id),
+        )
+    ).rowcount
+    db.session.commit()
+    return pruned
+
+
+def delivery_counts():
+    """Number of deliveries per status, as {status: count}."""
+    return dict(
+        db.session.query(WebhookDelivery.status, func.count(WebhookDelivery.id)).group_by(WebhookDelivery.status)
+    )
+
+
+def retry_dead(delivery_ids=None):
+    """Queue dead deliveries (all, or the given ones) again; returns how many."""
+    query = WebhookDelivery.query.filter(WebhookDelivery.status == "dead")
+    if delivery_ids is not None:
+        query = query.filter(WebhookDelivery.id.in_(delivery_ids))
+    retried = query.update(
+        {"status": "pending", "attempts": 0, "next_attempt_at": datetime.utcnow(), "updated_at": datetime.utcnow()},
+        synchronize_session=False,
+    )
+    db.session.info["webhook_events"] = bool(retried)
+    db.session.commit()
+    return retried
+
+
+def start_webhook_dispatcher(app):
+    """Dispatch webhooks from a background thread of a serving process, if webhooks are configured.
+
+    The thread runs when a commit recorded events and every
+    ``WEBHOOK_DISPATCH_INTERVAL`` seconds for retries. Only one worker
+    process dispatches at a time; the others' events are picked up by its
+    next round.
+    """
+    interval = app.config.get("WEBHOOK_DISPATCH_INTERVAL") or 0
+    if interval <= 0 or not _webhooks_configured(app):
+        return
+    start_on_first_request(app, _run_dispatcher, interval)
+
+
+def _webhooks_configured(app):
+    if app.config.get("WEBHOOK_URLS"):
+        return True
+    tenancy = app.extensions.get("tenancy")
+    return tenancy is not None and any(tenant.config.get("WEBHOOK_URLS") for tenant in tenancy.tenants.values())
+
+
+def _run_dispatcher(app, interval):
+    # Connections stay open between rounds
+    client = WebhookClient(timeout=app.config.get("WEBHOOK_TIMEOUT", 10))
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        with app.app_context():
+            try:
+                dispatch_all(client)
+            except Exception:
+                app.logger.exception("Webhook dispatch failed")
+
+
+def dispatch_all(client=None, batch_size=None):
+    """Dispatch for the database, or every tenant's, unless another process is at it.
+
+    Returns {tenant slug or None: DispatchRun}, empty if another process holds the lock.
+    """
+    with exclusive_lock(os.path.join(current_app.instance_path, "webhooks.lock")) as locked:
+        if not locked:
+            return {}
+        tenancy = current_app.extensions.get("tenancy")
+        runs = {}
+        for slug in tenancy.tenants if tenancy is not None else [None]:
+            if slug is None:
+                runs[slug] = _dispatch(slug, client, batch_size)
+            else:
+                with tenant_context(slug):
+                    runs[slug] = _dispatch(slug, client, batch_size)
+        return runs
+
+
+def _dispatch(slug, client, batch_size):
+    run = dispatch_pending(client, batch_size=batch_size)
+    now = datetime.utcnow()
+    if slug in _pruned_at and now - _pruned_at[slug] < PRUNE_INTERVAL:
+        return run
+    _pruned_at[slug] = now
+    return run._replace(pruned=prune_delivered(now=now))
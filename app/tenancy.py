@@ -0,0 +1,176 @@
+"""Serve several companies from one process, each with its own database.
+
+Tenants come from the JSON file in ``TENANTS_FILE`` (see README). Without it
+the app runs single-tenant on ``SQLALCHEMY_DATABASE_URI``.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from flask import abort, current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+
+Tenant = namedtuple("Tenant", ["slug", "hosts", "database_url", "config"])
+
+ENVIRON_KEY = "invoicipy.tenant"
+
+
+class TenantSession(Session):
+    """Session that binds to the current tenant's engine when there is one."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            tenant = current_tenant()
+            if tenant is not None:
+                return current_app.extensions["tenancy"].engines.get(tenant)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class TenantEngines:
+    """Engines per tenant, keeping at most ``max_engines`` and evicting the least recently used.
+
+    Engines with checked-out connections are never evicted, so the cache can
+    grow past the limit while many tenants are busy at once.
+    """
+
+    def __init__(self, max_engines, engine_options=None):
+        self.max_engines = max_engines
+        self.engine_options = engine_options or {}
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant):
+        with self._lock:
+            engine = self._engines.get(tenant.slug)
+            if engine is not None:
+                self._engines.move_to_end(tenant.slug)
+                return engine
+
+            engine = create_engine(tenant.database_url, **self.engine_options)
+            self._engines[tenant.slug] = engine
+            self._evict()
+            return engine
+
+    def _evict(self):
+        for slug in list(self._engines):
+            if len(self._engines) <= self.max_engines:
+                break
+            engine = self._engines[slug]
+            checkedout = getattr(engine.pool, "checkedout", None)
+            if checkedout is not None and checkedout():
+                continue
+            del self._engines[slug]
+            engine.dispose()
+
+    def __len__(self):
+        return len(self._engines)
+
+    def dispose_all(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+
+class TenantRouter:
+    """WSGI middleware that works out the tenant of each request.
+
+    With path routing the ``/<tenant>`` prefix moves from ``PATH_INFO`` to
+    ``SCRIPT_NAME``, so routes match as usual and ``url_for`` keeps the prefix.
+    """
+
+    def __init__(self, wsgi_app, tenants, routing):
+        self.wsgi_app = wsgi_app
+        self.routing = routing
+        self.by_slug = tenants
+        self.by_host = {host.lower(): tenant for tenant in tenants.values() for host in tenant.hosts}
+
+    def __call__(self, environ, start_response):
+        if self.routing == "path":
+            path = environ.get("PATH_INFO", "")
+            slug, _, rest = path.lstrip("/").partition("/")
+            if slug in self.by_slug:
+                environ[ENVIRON_KEY] = slug
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + f"/{slug}"
+                environ["PATH_INFO"] = f"/{rest}"
+        else:
+            host = environ.get("HTTP_HOST", environ.get("SERVER_NAME", "")).split(":")[0].lower()
+            tenant = self.by_host.get(host)
+            if tenant is not None:
+                environ[ENVIRON_KEY] = tenant.slug
+        return self.wsgi_app(environ, start_response)
+
+
+class Tenancy:
+    def __init__(self, tenants, routing, max_engines, engine_options=None):
+        self.tenants = tenants
+        self.routing = routing
+        self.engines = TenantEngines(max_engines, engine_options)
+
+
+def init_tenancy(app):
+    """Enable tenant routing if ``TENANTS_FILE`` is configured."""
+    tenants_file = app.config.get("TENANTS_FILE")
+    if not tenants_file:
+        return
+
+    tenants = load_tenants(tenants_file, app.config.get("TENANT_DATABASE_DIR") or app.instance_path)
+    routing = app.config.get("TENANT_ROUTING", "host")
+    app.extensions["tenancy"] = Tenancy(
+        tenants,
+        routing,
+        app.config.get("TENANT_MAX_ENGINES", 32),
+        app.config.get("SQLALCHEMY_ENGINE_OPTIONS"),
+    )
+    app.wsgi_app = TenantRouter(app.wsgi_app, tenants, routing)
+
+    @app.before_request
+    def select_tenant():
+        slug = request.environ.get(ENVIRON_KEY)
+        if slug is None:
+            abort(404)
+        g.tenant = tenants[slug]
+
+
+def load_tenants(path, database_dir):
+    """Read tenant definitions; tenants without a database URL get ``<database_dir>/<slug>.db``."""
+    with open(path) as f:
+        data = json.load(f)
+
+    tenants = {}
+    for slug, entry in data.items():
+        database_url = entry.get("database_url") or f"sqlite:///{os.path.join(database_dir, slug + '.db')}"
+        tenants[slug] = Tenant(slug, entry.get("hosts", []), database_url, entry.get("config", {}))
+    return tenants
+
+
+def current_tenant():
+    if not has_app_context():
+        return None
+    return g.get("tenant")
+
+
+def tenant_setting(key, default=None):
+    """Read a config value, preferring the current tenant's override."""
+    tenant = current_tenant()
+    if tenant is not None and key in tenant.config:
+        return tenant.config[key]
+    return current_app.config.get(key, default)
+
+
+@contextmanager
+def tenant_context(slug):
+    """Bind the database session to a tenant outside of a request (CLI, background jobs)."""
+    from app.models import db
+
+    tenancy = current_app.extensions["tenancy"]
+    previous = g.get("tenant")
+    db.session.remove()
+    g.tenant = tenancy.tenants[slug]
+    try:
+        yield g.tenant
+    finally:
+        db.session.remove()
+        g.tenant = previous
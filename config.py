@@ -11,6 +11,84 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or f"sqlite:///{os.path.join(basedir, 'invoicing.db')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Multiple companies in one process: JSON file of tenants, routed by "host" or "path" prefix
+    TENANTS_FILE = os.environ.get("TENANTS_FILE")
+    TENANT_ROUTING = os.environ.get("TENANT_ROUTING", "host")
+    TENANT_DATABASE_DIR = os.environ.get("TENANT_DATABASE_DIR")  # Default: instance folder
+    TENANT_MAX_ENGINES = int(os.environ.get("TENANT_MAX_ENGINES", 32))
+
+    # Per-year archive files of closed fiscal years (default: instance/archive)
+    ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR")
+
+    # Online backups (`flask backup`, default directory instance/backups). With BACKUP_INTERVAL
+    # (hours) set, serving processes also back up in the background.
+    BACKUP_DIR = os.environ.get("BACKUP_DIR")
+    BACKUP_INTERVAL = float(os.environ.get("BACKUP_INTERVAL", 0))
+    BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", 14))
+    # Pages copied per step and seconds between steps; writers wait for at most one step
+    BACKUP_STEP_PAGES = int(os.environ.get("BACKUP_STEP_PAGES", 256))
+    BACKUP_STEP_PAUSE = float(os.environ.get("BACKUP_STEP_PAUSE", 0.01))
+    BACKUP_MAX_RESTARTS = int(os.environ.get("BACKUP_MAX_RESTARTS", 3))
+
+    # Compiled Jinja templates are cached on disk and shared by all workers
+    # (defaults to instance/jinja_cache). Precompile with `flask compile-templates`.
+    JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR")
+    # In production templates only change on deploy, so don't stat them on every render
+    TEMPLATES_AUTO_RELOAD = False if os.environ.get("APP_ENV") == "production" else None
+
+    # Response compression (brotli needs requirements-compression.txt). PDFs are never compressed again.
+    COMPRESS_ENABLED = os.environ.get("COMPRESS_ENABLED", "true").lower() in ("1", "true", "yes")
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))  # Bytes; smaller responses aren't worth it
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+    COMPRESS_MIMETYPES = (
+        "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+        "application/javascript", "application/json", "image/svg+xml",
+    )
+
+    # PDF output profile: "compact" (default), "archival" (PDF/A-3b) or "print".
+    # PDF_TEMPLATE_PROFILES overrides it per invoice template, e.g. "detailed=print,minimal=compact".
+    PDF_PROFILE = os.environ.get("PDF_PROFILE", "compact")
+    PDF_TEMPLATE_PROFILES = dict(
+        pair.strip().split("=", 1) for pair in os.environ.get("PDF_TEMPLATE_PROFILES", "").split(",") if "=" in pair
+    )
+
+    # Outgoing email for sending invoices (`flask send-invoices`, "Send by Email")
+    MAIL_SERVER = os.environ.get("MAIL_SERVER")
+    MAIL_PORT = int(os.environ.get("MAIL_PORT", 25))
+    MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
+    MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
+    MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS", "").lower() in ("1", "true", "yes")  # STARTTLS
+    MAIL_USE_SSL = os.environ.get("MAIL_USE_SSL", "").lower() in ("1", "true", "yes")
+    MAIL_SENDER = os.environ.get("MAIL_SENDER")  # Default: COMPANY_EMAIL
+    MAIL_TIMEOUT = int(os.environ.get("MAIL_TIMEOUT", 30))
+    MAIL_MESSAGES_PER_CONNECTION = int(os.environ.get("MAIL_MESSAGES_PER_CONNECTION", 100))
+    MAIL_MAX_RETRIES = int(os.environ.get("MAIL_MAX_RETRIES", 3))
+    MAIL_RETRY_BACKOFF = float(os.environ.get("MAIL_RETRY_BACKOFF", 1.0))  # Seconds, doubled per retry
+    MAIL_RENDER_WORKERS = int(os.environ.get("MAIL_RENDER_WORKERS", 0)) or None  # Default: one per CPU
+
+    # Webhooks for invoice events: comma-separated URLs, POSTed to by a background thread
+    # (every WEBHOOK_DISPATCH_INTERVAL seconds and right after changes; 0 leaves it to `flask dispatch-webhooks`)
+    WEBHOOK_URLS = os.environ.get("WEBHOOK_URLS", "")
+    WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # Signs bodies with HMAC-SHA256
+    WEBHOOK_DISPATCH_INTERVAL = float(os.environ.get("WEBHOOK_DISPATCH_INTERVAL", 5))
+    WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 100))  # Events per request
+    WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", 10))
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 8))
+    WEBHOOK_RETRY_BACKOFF = float(os.environ.get("WEBHOOK_RETRY_BACKOFF", 30))  # Seconds, doubled per retry
+    WEBHOOK_RETENTION_DAYS = float(os.environ.get("WEBHOOK_RETENTION_DAYS", 30))  # Delivered events kept; 0 keeps all
+
+    # VAT number validation: "vies", "none" for format and check digit rules only, or "module:factory"
+    VAT_BACKEND = os.environ.get("VAT_BACKEND", "vies")
+    VAT_VIES_URL = os.environ.get("VAT_VIES_URL")  # Default: the EU's VIES REST API
+    VAT_TIMEOUT = float(os.environ.get("VAT_TIMEOUT", 10))
+    VAT_CACHE_TTL = int(os.environ.get("VAT_CACHE_TTL", 30))  # Days results are kept
+    VAT_RETRY_AFTER = int(os.environ.get("VAT_RETRY_AFTER", 60))  # Minutes, when the registry couldn't answer
+    VAT_LOOKUP_CONCURRENCY = int(os.environ.get("VAT_LOOKUP_CONCURRENCY", 4))  # Parallel lookups of `flask validate-vat`
+
+    # Payment reminders (`flask run-dunning`): days after the due date at which each level is reached
+    DUNNING_LEVELS = os.environ.get("DUNNING_LEVELS", "7,21,45")
+
     # Your company details (shown on invoices)
     COMPANY_NAME = os.environ.get("COMPANY_NAME", "Your Company Name")
     COMPANY_LEGAL_NAME = os.environ.get("COMPANY_LEGAL_NAME", "Your Company Ltd.")
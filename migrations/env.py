@@ -16,6 +16,12 @@ logger = logging.getLogger('alembic.env')
 
 
 def get_engine():
+    # `flask tenants upgrade` runs migrations once per tenant database
+    from app.tenancy import current_tenant
+    tenant = current_tenant()
+    if tenant is not None:
+        return current_app.extensions['tenancy'].engines.get(tenant)
+
     try:
         # this works with Flask-SQLAlchemy<3 and Alchemical
         return current_app.extensions['migrate'].db.get_engine()
@@ -106,6 +112,13 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+        at_head = set(context.get_context().get_current_heads()) == set(context.script.get_heads())
+
+    # Archive files of closed years follow the latest schema, outside of requests
+    if at_head:
+        from app.services.archive import upgrade_archives
+        upgrade_archives()
+
 
 if context.is_offline_mode():
     run_migrations_offline()
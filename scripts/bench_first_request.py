@@ -0,0 +1,100 @@
+"""Benchmark first-request latency of a freshly started worker.
+
+Each trial runs in a new interpreter, once with an empty Jinja bytecode cache
+and once with a cache filled by `flask compile-templates`, against a small
+generated dataset in a temporary database.
+
+Usage:
+    python scripts/bench_first_request.py [--trials 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PATHS = [
+    "/invoices/",
+    "/invoices/1",
+    "/invoices/1/preview",
+    "/customers/",
+    "/customers/1",
+    "/settings/",
+]
+
+
+def run_worker():
+    """Start the app and time the first request to each page."""
+    start = time.perf_counter()
+    from app import create_app
+
+    app = create_app()
+    timings = {"startup": time.perf_counter() - start}
+    client = app.test_client()
+    for path in PATHS:
+        request_start = time.perf_counter()
+        response = client.get(path)
+        timings[path] = time.perf_counter() - request_start
+        assert response.status_code == 200, f"{path} returned {response.status_code}"
+    print(json.dumps(timings))
+
+
+def spawn_worker(env):
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"],
+        env=env,
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label, runs):
+    print(f"\n{label}")
+    for key in ["startup"] + PATHS:
+        values = [run[key] * 1000 for run in runs]
+        print(f"  {key:<22} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+    totals = [sum(run[path] for path in PATHS) * 1000 for run in runs]
+    print(f"  {'all first requests':<22} median {statistics.median(totals):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return
+
+    workdir = tempfile.mkdtemp(prefix="invoicipy-bench-")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}", APP_ENV="production")
+    flask = [sys.executable, "-m", "flask", "--app", "app"]
+
+    subprocess.run(flask + ["db", "upgrade"], env=env, cwd=ROOT, check=True, capture_output=True)
+    subprocess.run(flask + ["seed-sample-data", "--customers", "20"], env=env, cwd=ROOT, check=True)
+
+    cold = []
+    for trial in range(args.trials):
+        cold_env = dict(env, JINJA_CACHE_DIR=os.path.join(workdir, f"cold-{trial}"))
+        cold.append(spawn_worker(cold_env))
+
+    warm_env = dict(env, JINJA_CACHE_DIR=os.path.join(workdir, "warm"))
+    subprocess.run(flask + ["compile-templates"], env=warm_env, cwd=ROOT, check=True)
+    warm = [spawn_worker(warm_env) for _ in range(args.trials)]
+
+    report("Fresh worker, empty template cache", cold)
+    report("Fresh worker, precompiled template cache", warm)
+
+
+if __name__ == "__main__":
+    main()
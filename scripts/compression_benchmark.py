@@ -0,0 +1,86 @@
+"""Compare bytes transferred and latency of the main pages per content encoding.
+
+Requests each page of a generated dataset without compression, with gzip
+and (when installed) with brotli, and prints the response size, the server
+time including compression, and the estimated time to load it over a slow
+link such as a VPN.
+
+Usage:
+    python scripts/compression_benchmark.py [--customers 100] [--bandwidth 2000] [--rtt 80]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=100, help="Customers in the generated dataset.")
+    parser.add_argument("--invoices-per-customer", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=10, help="Requests per page and encoding.")
+    parser.add_argument("--bandwidth", type=float, default=2000, help="Link bandwidth in kbit/s.")
+    parser.add_argument("--rtt", type=float, default=80, help="Link round-trip time in ms.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="invoicipy-compression-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["JINJA_CACHE_DIR"] = os.path.join(workdir, "jinja")
+
+    from flask_migrate import upgrade
+    from app import create_app, _seed_default_optional_texts
+    from app.compression import ENCODINGS, compress_static
+    from app.models import Customer, Invoice
+    from app.services.sample_data import generate_sample_data
+
+    app = create_app()
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+        _seed_default_optional_texts()
+        generate_sample_data(customers=args.customers, invoices_per_customer=args.invoices_per_customer)
+        invoice_id = Invoice.query.filter(Invoice.number.isnot(None)).order_by(Invoice.id.desc()).first().id
+        customer_id = Customer.query.order_by(Customer.id).first().id
+        compress_static(app.static_folder, app.config["COMPRESS_MIN_SIZE"])
+
+    year = date.today().year
+    pages = [
+        f"/invoices/?year={year}",
+        f"/invoices/{invoice_id}",
+        f"/invoices/{invoice_id}/preview",
+        "/customers/",
+        f"/customers/{customer_id}",
+        "/settings/",
+        "/static/css/app.css",
+    ]
+    client = app.test_client()
+    print(f"Link: {args.bandwidth:.0f} kbit/s, {args.rtt:.0f} ms RTT\n")
+    print(f"{'page':<32} {'encoding':<9} {'bytes':>9} {'ratio':>6} {'server ms':>10} {'on link ms':>11}")
+    for page in pages:
+        identity_size = None
+        for encoding in ("identity",) + ENCODINGS:
+            sizes, timings = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(page, headers={"Accept-Encoding": encoding})
+                data = response.get_data()
+                timings.append(time.perf_counter() - start)
+                sizes.append(len(data))
+            size = sizes[-1]
+            identity_size = identity_size or size
+            server_ms = statistics.median(timings) * 1000
+            link_ms = server_ms + args.rtt + size * 8 / args.bandwidth
+            print(
+                f"{page[:32]:<32} {response.headers.get('Content-Encoding', 'identity'):<9} {size:>9,} "
+                f"{size / identity_size:>6.0%} {server_ms:>10.1f} {link_ms:>11.0f}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
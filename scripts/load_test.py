@@ -0,0 +1,308 @@
+"""Load test the whole app with concurrent simulated users.
+
+Generates a dataset in a temporary database, starts the app on a local
+threaded server in a separate process, and runs a weighted mix of scenarios
+from concurrent users: browsing the invoice list with filters, opening
+invoices, previews and PDFs, creating and issuing invoices, and customer
+search. Prints throughput and p50/p95/p99 latency per route, and exits with
+status 1 if a route's p95 exceeds its budget or more than 1% of its requests
+fail. Needs nothing but this machine.
+
+Usage:
+    python scripts/load_test.py [--users 10] [--duration 30] [--customers 200]
+        [--budget "GET /invoices/<id>/pdf=800"] [--budgets budgets.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# p95 latency budgets per route in milliseconds
+DEFAULT_BUDGETS = {
+    "GET /invoices/": 500,
+    "GET /invoices/<id>": 200,
+    "GET /invoices/<id>/preview": 200,
+    "GET /invoices/<id>/pdf": 1500,
+    "GET /invoices/new": 300,
+    "POST /invoices/new": 300,
+    "POST /invoices/<id>/issue": 200,
+    "GET /customers/search": 100,
+}
+
+MAX_ERROR_RATE = 0.01
+
+
+def serve(port, processes):
+    """Run the app on a local server until killed."""
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app()
+    threaded = processes == 1
+    server = make_server("127.0.0.1", port, app, threaded=threaded, processes=processes)
+    print("ready", flush=True)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class User:
+    """One simulated user with its own keep-alive connection."""
+
+    def __init__(self, port, dataset, rng, results):
+        self.port = port
+        self.dataset = dataset
+        self.rng = rng
+        self.results = results
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def request(self, route, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = urlencode(body, doseq=True)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            ok = response.status < 400
+            location = response.getheader("Location")
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            ok, location = False, None
+        self.results.record(route, time.perf_counter() - start, ok)
+        return location
+
+    def browse_list(self):
+        params = {"year": self.rng.choice(self.dataset["years"])}
+        if self.rng.random() < 0.5:
+            params["status"] = self.rng.choice(["draft", "issued", "paid"])
+        if self.rng.random() < 0.3:
+            params["search"] = self.rng.choice(self.dataset["customer_names"])
+        self.request("GET /invoices/", "GET", f"/invoices/?{urlencode(params)}")
+
+    def open_detail(self):
+        self.request("GET /invoices/<id>", "GET", f"/invoices/{self.rng.choice(self.dataset['invoices'])}")
+
+    def preview(self):
+        self.request("GET /invoices/<id>/preview", "GET", f"/invoices/{self.rng.choice(self.dataset['invoices'])}/preview")
+
+    def download_pdf(self):
+        self.request("GET /invoices/<id>/pdf", "GET", f"/invoices/{self.rng.choice(self.dataset['invoices'])}/pdf")
+
+    def create_and_issue(self):
+        self.request("GET /invoices/new", "GET", "/invoices/new")
+        today = date.today()
+        form = {
+            "customer_id": self.rng.choice(self.dataset["customers"]),
+            "template": "default",
+            "issue_date": today.isoformat(),
+            "due_date": (today + timedelta(days=14)).isoformat(),
+            "currency": "EUR",
+            "item_description[]": ["Consulting", "Support"],
+            "item_quantity[]": ["2", "1"],
+            "item_unit[]": ["hours", "pcs"],
+            "item_price[]": ["95.00", "40.00"],
+            "item_tax[]": ["20", "20"],
+            "action": "save",
+        }
+        location = self.request("POST /invoices/new", "POST", "/invoices/new", form)
+        if location:
+            invoice_path = location.split("://", 1)[-1].partition("/")[2]
+            self.request("POST /invoices/<id>/issue", "POST", f"/{invoice_path}/issue", {})
+
+    def search_customers(self):
+        # A prefix as typed into the search box, e.g. "customer 0004" of "Customer 000042"
+        name = self.rng.choice(self.dataset["customer_names"])
+        query = name[:self.rng.randrange(len("Customer 0"), len(name) + 1)].lower()
+        self.request("GET /customers/search", "GET", f"/customers/search?{urlencode({'q': query})}")
+
+
+# (scenario, weight)
+SCENARIOS = [
+    (User.browse_list, 25),
+    (User.open_detail, 25),
+    (User.preview, 10),
+    (User.download_pdf, 10),
+    (User.create_and_issue, 5),
+    (User.search_customers, 25),
+]
+
+
+class Results:
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self.recording = False
+
+    def record(self, route, elapsed, ok):
+        if not self.recording:
+            return
+        with self.lock:
+            self.timings[route].append(elapsed)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_user(port, dataset, seed, results, stop):
+    rng = random.Random(seed)
+    user = User(port, dataset, rng, results)
+    scenarios, weights = zip(*SCENARIOS)
+    while not stop.is_set():
+        rng.choices(scenarios, weights)[0](user)
+
+
+def load_dataset(database):
+    with sqlite3.connect(database) as connection:
+        invoices = [row[0] for row in connection.execute("SELECT id FROM invoices")]
+        customers = list(connection.execute("SELECT id, name FROM customers"))
+        years = [int(row[0]) for row in connection.execute("SELECT DISTINCT strftime('%Y', issue_date) FROM invoices")]
+    return {
+        "invoices": invoices,
+        "customers": [id for id, _ in customers],
+        "customer_names": [name for _, name in customers],
+        "years": years,
+    }
+
+
+def report(results, duration, budgets):
+    failures = []
+    print(f"\n{'route':<30} {'requests':>8} {'req/s':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'budget':>7}")
+    for route in sorted(results.timings):
+        timings = [t * 1000 for t in results.timings[route]]
+        errors = results.errors[route]
+        p95 = percentile(timings, 0.95)
+        budget = budgets.get(route)
+        status = ""
+        if budget is not None and p95 > budget:
+            status = "  OVER BUDGET"
+            failures.append(f"{route}: p95 {p95:.0f} ms > {budget} ms")
+        if errors > len(timings) * MAX_ERROR_RATE:
+            status += "  ERRORS"
+            failures.append(f"{route}: {errors} of {len(timings)} requests failed")
+        print(
+            f"{route:<30} {len(timings):>8} {len(timings) / duration:>7.1f} {errors:>6} "
+            f"{percentile(timings, 0.5):>8.1f} {p95:>8.1f} {percentile(timings, 0.99):>8.1f} "
+            f"{budget if budget is not None else '-':>7}{status}"
+        )
+    total = sum(len(timings) for timings in results.timings.values())
+    print(f"\n{total} requests in {duration:.0f}s, {total / duration:.1f} req/s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users.")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds, after warm-up.")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unmeasured warm-up.")
+    parser.add_argument("--customers", type=int, default=200, help="Customers in the generated dataset.")
+    parser.add_argument("--invoices-per-customer", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=1, help="Server processes (1 = one threaded process).")
+    parser.add_argument("--budgets", help="JSON file of p95 budgets in ms per route.")
+    parser.add_argument("--budget", action="append", default=[], help='Override one budget, e.g. "GET /invoices/=300".')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.processes)
+        return
+
+    budgets = dict(DEFAULT_BUDGETS)
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets.update(json.load(f))
+    for override in args.budget:
+        route, _, milliseconds = override.rpartition("=")
+        budgets[route] = float(milliseconds)
+
+    workdir = tempfile.mkdtemp(prefix="invoicipy-load-")
+    database = os.path.join(workdir, "load.db")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{database}",
+        APP_ENV="production",
+        JINJA_CACHE_DIR=os.path.join(workdir, "jinja"),
+    )
+    flask = [sys.executable, "-m", "flask", "--app", "app"]
+    subprocess.run(flask + ["db", "upgrade"], env=env, cwd=ROOT, check=True, capture_output=True)
+    subprocess.run(
+        flask + [
+            "seed-sample-data",
+            "--customers", str(args.customers),
+            "--invoices-per-customer", str(args.invoices_per_customer),
+            "--seed", str(args.seed),
+        ],
+        env=env, cwd=ROOT, check=True,
+    )
+    subprocess.run(flask + ["compile-templates"], env=env, cwd=ROOT, check=True, capture_output=True)
+    subprocess.run(flask + ["compress-static"], env=env, cwd=ROOT, check=True, capture_output=True)
+    dataset = load_dataset(database)
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(port), "--processes", str(args.processes)],
+        env=env, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        if server.stdout.readline().strip() != "ready":
+            sys.exit("The server failed to start.")
+
+        results = Results()
+        stop = threading.Event()
+        users = [
+            threading.Thread(target=run_user, args=(port, dataset, args.seed + i, results, stop), daemon=True)
+            for i in range(args.users)
+        ]
+        print(f"{args.users} users against {len(dataset['invoices'])} invoices; warming up for {args.warmup:.0f}s")
+        for user in users:
+            user.start()
+        time.sleep(args.warmup)
+        results.recording = True
+        start = time.perf_counter()
+        time.sleep(args.duration)
+        results.recording = False
+        duration = time.perf_counter() - start
+        stop.set()
+        for user in users:
+            user.join(timeout=60)
+    finally:
+        server.terminate()
+        server.wait()
+
+    failures = report(results, duration, budgets)
+    if failures:
+        print("\nBudgets exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Report PDF sizes and render times per output profile.
+
+Renders a sample of invoices from a generated dataset in a temporary
+database with every profile in ``PDF_PROFILES`` and prints size and time per
+profile and invoice template.
+
+Usage:
+    python scripts/pdf_size_report.py [--invoices 50] [--customers 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=50, help="Invoices rendered per profile.")
+    parser.add_argument("--customers", type=int, default=20, help="Customers in the generated dataset.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="invoicipy-pdf-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from flask_migrate import upgrade
+    from app import create_app
+    from app.models import Invoice
+    from app.services.pdf import PDF_PROFILES, generate_invoice_pdf
+    from app.services.sample_data import generate_sample_data
+
+    app = create_app()
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+        generate_sample_data(customers=args.customers)
+        invoices = Invoice.query.filter(Invoice.number.isnot(None)).order_by(Invoice.id).limit(args.invoices).all()
+
+        results = {}
+        for profile in PDF_PROFILES:
+            sizes, timings = {}, []
+            for invoice in invoices:
+                start = time.perf_counter()
+                pdf = generate_invoice_pdf(invoice, profile=profile)
+                timings.append(time.perf_counter() - start)
+                sizes.setdefault(invoice.template, []).append(len(pdf))
+            results[profile] = (sizes, timings)
+
+    print(f"{len(invoices)} invoices per profile\n")
+    print(f"{'profile':<10} {'template':<10} {'count':>6} {'mean KB':>9} {'p95 KB':>9} {'total MB':>9}")
+    for profile, (sizes, timings) in results.items():
+        every = [size for template_sizes in sizes.values() for size in template_sizes]
+        for template, template_sizes in sorted(sizes.items()) + [("all", every)]:
+            print(
+                f"{profile:<10} {template:<10} {len(template_sizes):>6} "
+                f"{statistics.mean(template_sizes) / 1024:>9.1f} {percentile(template_sizes, 0.95) / 1024:>9.1f} "
+                f"{sum(template_sizes) / 1024 / 1024:>9.2f}"
+            )
+        print(f"{profile:<10} render median {statistics.median(timings) * 1000:.0f} ms, "
+              f"p95 {percentile(timings, 0.95) * 1000:.0f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
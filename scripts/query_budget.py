@@ -0,0 +1,296 @@
+"""Check the number of SQL queries every invoice, customer and settings route runs.
+
+Requests each route of the ``invoices``, ``customers`` and ``settings``
+blueprints against a small and a large generated database and records the
+statements with ``QueryRecorder``. Fails (exit status 1) when a route runs
+more queries than its budget, or more queries on the large database than on
+the small one: a count that grows with the number of rows is an N+1. The
+statements of every failing request are printed.
+
+Usage:
+    python scripts/query_budget.py [--small 5] [--large 100] [--verbose]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BLUEPRINTS = ("invoices", "customers", "settings")
+
+# Most queries each route may run, by endpoint and method
+# Invoice state changes include 3 statements for their webhook events: totals, events, deliveries.
+# Issuing a reverse-charge invoice reads its customer's VAT number, plus its cached check unless
+# that is in the process's memory already (as it is here).
+BUDGETS = {
+    ("invoices.list_invoices", "GET"): 4,
+    ("invoices.bulk_action", "POST"): 14,
+    ("invoices.create_invoice", "GET"): 3,
+    ("invoices.create_invoice", "POST"): 16,
+    ("invoices.get_invoice", "GET"): 6,
+    ("invoices.edit_invoice", "GET"): 6,
+    ("invoices.edit_invoice", "POST"): 19,
+    ("invoices.delete_invoice", "POST"): 11,
+    ("invoices.download_pdf", "GET"): 3,
+    ("invoices.preview_invoice", "GET"): 5,
+    ("invoices.issue_invoice", "POST"): 14,
+    ("invoices.email_invoice", "POST"): 1,
+    ("invoices.mark_paid", "POST"): 6,
+    ("customers.list_customers", "GET"): 3,  # 2, plus the archived years left out of the totals
+    ("customers.create_customer", "GET"): 0,
+    ("customers.create_customer", "POST"): 2,
+    ("customers.get_customer", "GET"): 2,
+    ("customers.statement_pdf", "GET"): 6,  # 2, plus 4 to build invoices without snapshots
+    ("customers.edit_customer", "GET"): 1,
+    ("customers.edit_customer", "POST"): 3,
+    ("customers.delete_customer", "POST"): 4,
+    ("customers.search_customers_json", "GET"): 2,
+    ("customers.get_customer_json", "GET"): 2,
+    ("settings.index", "GET"): 1,
+    ("settings.create_optional_text", "GET"): 0,
+    ("settings.create_optional_text", "POST"): 3,
+    ("settings.edit_optional_text", "GET"): 1,
+    ("settings.edit_optional_text", "POST"): 3,
+    ("settings.delete_optional_text", "POST"): 2,
+    ("settings.webhooks", "GET"): 2,
+    ("settings.retry_webhooks", "POST"): 1,
+}
+
+
+def invoice_form(customer_id, action="save"):
+    today = date.today()
+    return {
+        "customer_id": customer_id,
+        "template": "default",
+        "issue_date": today.isoformat(),
+        "due_date": (today + timedelta(days=14)).isoformat(),
+        "currency": "EUR",
+        "optional_texts": ["bank_details", "payment_terms", "vat_reverse_charge"],
+        "item_description[]": ["Consulting", "Support"],
+        "item_quantity[]": ["2", "1"],
+        "item_unit[]": ["hours", "pcs"],
+        "item_price[]": ["95.00", "40.00"],
+        "item_tax[]": ["20", "20"],
+        "action": action,
+    }
+
+
+def customer_form(name):
+    return {
+        "name": name, "email": "billing@example.com", "vat_number": "BG175074752", "city": "Sofia", "country": "BG",
+        "payment_terms": "14",
+    }
+
+
+def requests_for(ids):
+    """(endpoint, method, path, form data) for every route, in a safe order.
+
+    Reads come first; each write acts on rows set aside for it, so it finds
+    the same state on both databases.
+    """
+    year = date.today().year
+    return [
+        ("invoices.list_invoices", "GET", f"/invoices/?year={year}", None),
+        ("invoices.list_invoices", "GET", f"/invoices/?year={year}&status=issued&search=Customer", None),
+        ("invoices.list_invoices", "GET", f"/invoices/?year={year}&status=overdue", None),
+        ("invoices.create_invoice", "GET", "/invoices/new", None),
+        ("invoices.get_invoice", "GET", f"/invoices/{ids['issued']}", None),
+        ("invoices.edit_invoice", "GET", f"/invoices/{ids['draft']}/edit", None),
+        ("invoices.download_pdf", "GET", f"/invoices/{ids['issued']}/pdf", None),
+        ("invoices.preview_invoice", "GET", f"/invoices/{ids['issued']}/preview", None),
+        ("invoices.preview_invoice", "GET", f"/invoices/{ids['draft']}/preview", None),
+        ("customers.list_customers", "GET", "/customers/", None),
+        ("customers.list_customers", "GET", "/customers/?sort=open_amount&direction=desc", None),
+        ("customers.create_customer", "GET", "/customers/new", None),
+        ("customers.get_customer", "GET", f"/customers/{ids['customer']}", None),
+        ("customers.statement_pdf", "GET", f"/customers/{ids['customer']}/statement", None),
+        ("customers.statement_pdf", "GET", f"/customers/{ids['customer']}/statement?start={year}-01-01", None),
+        ("customers.edit_customer", "GET", f"/customers/{ids['customer']}/edit", None),
+        ("customers.search_customers_json", "GET", "/customers/search?q=budget", None),
+        ("customers.get_customer_json", "GET", f"/customers/{ids['customer']}/json", None),
+        ("settings.index", "GET", "/settings/", None),
+        ("settings.create_optional_text", "GET", "/settings/optional-texts/new", None),
+        ("settings.edit_optional_text", "GET", f"/settings/optional-texts/{ids['text']}/edit", None),
+        ("settings.webhooks", "GET", "/settings/webhooks", None),
+        ("invoices.create_invoice", "POST", "/invoices/new", invoice_form(ids["customer"])),
+        ("invoices.create_invoice", "POST", "/invoices/new", invoice_form(ids["customer"], "issue")),
+        ("invoices.edit_invoice", "POST", f"/invoices/{ids['draft']}/edit", invoice_form(ids["customer"])),
+        ("invoices.edit_invoice", "POST", f"/invoices/{ids['draft']}/edit", invoice_form(ids["customer"], "issue")),
+        ("invoices.issue_invoice", "POST", f"/invoices/{ids['to_issue']}/issue", {}),
+        ("invoices.mark_paid", "POST", f"/invoices/{ids['issued']}/paid", {}),
+        ("invoices.email_invoice", "POST", f"/invoices/{ids['issued']}/send", {}),
+        ("invoices.bulk_action", "POST", "/invoices/bulk",
+         {"action": "issue", "year": year, "invoice_ids": ids["bulk"]}),
+        ("invoices.delete_invoice", "POST", f"/invoices/{ids['to_delete']}/delete", {}),
+        ("customers.create_customer", "POST", "/customers/new", customer_form("Budget New")),
+        ("customers.edit_customer", "POST", f"/customers/{ids['customer']}/edit", customer_form("Budget Customer")),
+        ("customers.delete_customer", "POST", f"/customers/{ids['empty_customer']}/delete", {}),
+        ("settings.create_optional_text", "POST", "/settings/optional-texts/new",
+         {"key": "budget_note", "label": "Budget note", "content": "Thank you."}),
+        ("settings.edit_optional_text", "POST", f"/settings/optional-texts/{ids['text']}/edit",
+         {"label": "Bank Details", "content": "IBAN: {iban}", "default_enabled": "on"}),
+        ("settings.delete_optional_text", "POST", f"/settings/optional-texts/{ids['to_delete_text']}/delete", {}),
+        ("settings.retry_webhooks", "POST", "/settings/webhooks/retry", {"delivery_ids": ids["dead_delivery"]}),
+    ]
+
+
+def prepare(workdir, name, customers, invoices_per_customer):
+    """Create an app on a fresh database with a generated dataset.
+
+    Returns (app, ids of the rows set aside for write requests, invoice count).
+    """
+    from flask_migrate import upgrade
+    from config import Config
+    from app import create_app, _seed_default_optional_texts
+    from app.models import db, Customer, Invoice, InvoiceItem, OptionalText, WebhookDelivery
+    from app.services.sample_data import generate_sample_data
+    from app.services.webhooks import record_invoice_events
+
+    config = type(f"{name.title()}Config", (Config,), {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, name + '.db')}",
+        "TESTING": True,
+        "MAIL_SERVER": None,  # Sending fails before connecting, the same on every machine
+        # Changes write webhook deliveries; nothing sends them
+        "WEBHOOK_URLS": "http://127.0.0.1:9/invoicipy",
+        "WEBHOOK_DISPATCH_INTERVAL": 0,
+        "VAT_BACKEND": "none",  # Local VAT number rules only, no lookups
+    })
+    app = create_app(config)
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+        _seed_default_optional_texts()
+        generate_sample_data(customers=customers, invoices_per_customer=invoices_per_customer)
+
+        # Dead letters, as many as there are customers
+        record_invoice_events(db.session.scalars(db.select(Invoice.id).limit(customers)).all(), "invoice.created")
+        WebhookDelivery.query.update({"status": "dead", "attempts": 8, "last_error": "HTTP 500"})
+        db.session.commit()
+
+        # Rows each write request acts on, the same on every dataset
+        customer = Customer(
+            name="Budget Customer", email="billing@example.com", vat_number="BG175074752", country="BG",
+            payment_terms=14,
+        )
+        empty_customer = Customer(name="Budget Empty")
+        db.session.add_all([customer, empty_customer])
+        db.session.flush()
+        invoices = {}
+        for key in ("issued", "draft", "to_issue", "to_delete", "bulk_1", "bulk_2"):
+            invoice = Invoice(
+                customer_id=customer.id,
+                issue_date=date.today(),
+                due_date=date.today() + timedelta(days=14),
+                optional_texts=["bank_details", "payment_terms", "vat_reverse_charge"],
+                status="draft",
+            )
+            db.session.add(invoice)
+            db.session.flush()
+            for position in range(3):
+                db.session.add(InvoiceItem(
+                    invoice_id=invoice.id, description=f"Item {position}", quantity=1,
+                    unit_price=100, tax_rate=20, position=position,
+                ))
+            invoices[key] = invoice.id
+        to_delete_text = OptionalText(key="budget_to_delete", label="Delete me", content="-")
+        db.session.add(to_delete_text)
+        db.session.commit()
+
+        # Issued through the app so it has a number and a snapshot
+        app.test_client().post(f"/invoices/{invoices['issued']}/issue")
+
+        ids = {
+            "customer": customer.id,
+            "empty_customer": empty_customer.id,
+            "issued": invoices["issued"],
+            "draft": invoices["draft"],
+            "to_issue": invoices["to_issue"],
+            "to_delete": invoices["to_delete"],
+            "bulk": [invoices["bulk_1"], invoices["bulk_2"]],
+            "text": OptionalText.query.filter_by(key="bank_details").one().id,
+            "to_delete_text": to_delete_text.id,
+            "dead_delivery": WebhookDelivery.query.filter_by(status="dead").first().id,
+        }
+        invoice_count = Invoice.query.count()
+    return app, ids, invoice_count
+
+
+def measure(app, ids):
+    """Record the statements of every request; returns [(request, status code, recorder)]."""
+    from app.services.query_log import QueryRecorder
+
+    client = app.test_client()
+    results = []
+    for request in requests_for(ids):
+        endpoint, method, path, data = request
+        with QueryRecorder() as queries:
+            response = client.open(path, method=method, data=data)
+        results.append((request, response.status_code, queries))
+    return results
+
+
+def check_coverage(app):
+    """Routes of the checked blueprints that have no budget, as "endpoint METHOD"."""
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint.partition(".")[0] not in BLUEPRINTS:
+            continue
+        for method in rule.methods - {"HEAD", "OPTIONS"}:
+            if (rule.endpoint, method) not in BUDGETS:
+                missing.append(f"{rule.endpoint} {method}")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--small", type=int, default=5, help="Customers in the small dataset.")
+    parser.add_argument("--large", type=int, default=100, help="Customers in the large dataset.")
+    parser.add_argument("--invoices-per-customer", type=int, default=10)
+    parser.add_argument("--verbose", action="store_true", help="Print the statements of every request.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="invoicipy-queries-")
+    os.environ["JINJA_CACHE_DIR"] = os.path.join(workdir, "jinja")
+
+    small_app, small_ids, small_invoices = prepare(workdir, "small", args.small, args.invoices_per_customer)
+    large_app, large_ids, large_invoices = prepare(workdir, "large", args.large, args.invoices_per_customer)
+    small = measure(small_app, small_ids)
+    large = measure(large_app, large_ids)
+
+    failures = [f"{route}: no query budget" for route in check_coverage(large_app)]
+    print(f"{'route':<60} {'status':>6} {small_invoices:>7} {large_invoices:>7} {'budget':>6}")
+    print(f"{'':<60} {'':>6} {'inv.':>7} {'inv.':>7}")
+    for (request, _, small_queries), (_, status, large_queries) in zip(small, large):
+        endpoint, method, path, _ = request
+        budget = BUDGETS[(endpoint, method)]
+        problems = []
+        if status >= 500:
+            problems.append(f"status {status}")
+        if large_queries.count > budget:
+            problems.append(f"{large_queries.count} queries, budget {budget}")
+        if large_queries.count > small_queries.count:
+            problems.append(f"grows with data: {small_queries.count} -> {large_queries.count} queries")
+        label = f"{method} {path}"
+        print(
+            f"{label[:60]:<60} {status:>6} {small_queries.count:>7} {large_queries.count:>7} {budget:>6}"
+            f"{'  FAIL' if problems else ''}"
+        )
+        if problems or args.verbose:
+            print(large_queries.format(limit=40))
+            for sql, times in large_queries.repeated():
+                print(f"      run {times} times: {' '.join(sql.split())[:160]}")
+        if problems:
+            failures.append(f"{label}: {', '.join(problems)}")
+
+    if failures:
+        print("\nQuery budgets exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nAll routes within their query budgets.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare a single-pass statement PDF with rendering each invoice separately.
+
+Generates a dataset in a temporary database, picks the customer with the
+most issued or paid invoices, and times one statement of all of them
+against ``generate_invoice_pdf`` once per invoice (what merging separate
+PDFs would cost before merging).
+
+Usage:
+    python scripts/statement_benchmark.py [--invoices-per-customer 30] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=5)
+    parser.add_argument("--invoices-per-customer", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of each approach.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="invoicipy-statement-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from flask_migrate import upgrade
+    from sqlalchemy import func
+    from app import create_app, _seed_default_optional_texts
+    from app.models import db, Customer, Invoice
+    from app.services.pdf import generate_invoice_pdf
+    from app.services.sample_data import generate_sample_data
+    from app.services.statements import generate_statement_pdf, statement_invoices
+
+    app = create_app()
+    with app.test_request_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+        _seed_default_optional_texts()
+        generate_sample_data(customers=args.customers, invoices_per_customer=args.invoices_per_customer)
+        customer_id, _ = (
+            db.session.query(Invoice.customer_id, func.count(Invoice.id))
+            .filter(Invoice.status != "draft")
+            .group_by(Invoice.customer_id)
+            .order_by(func.count(Invoice.id).desc())
+            .first()
+        )
+        customer = db.session.get(Customer, customer_id)
+        # A period covering everything, so paid invoices are included too
+        start = db.session.query(func.min(Invoice.issue_date)).scalar()
+        invoices = statement_invoices(customer_id, start=start)
+
+        separate, single = [], []
+        for _ in range(args.repeat):
+            began = time.perf_counter()
+            separate_bytes = sum(len(generate_invoice_pdf(invoice)) for invoice in invoices)
+            separate.append(time.perf_counter() - began)
+
+            began = time.perf_counter()
+            single_bytes = len(generate_statement_pdf(customer, start=start))
+            single.append(time.perf_counter() - began)
+
+    print(f"{len(invoices)} invoices of {customer.name}, median of {args.repeat} runs\n")
+    print(f"{'approach':<26} {'seconds':>8} {'per invoice ms':>15} {'bytes':>11}")
+    for label, timings, size in (
+        (f"{len(invoices)} separate PDFs", separate, separate_bytes),
+        ("one statement PDF", single, single_bytes),
+    ):
+        median = statistics.median(timings)
+        print(f"{label:<26} {median:>8.2f} {median / max(len(invoices), 1) * 1000:>15.1f} {size:>11,}")
+    print(f"\nSpeed-up: {statistics.median(separate) / statistics.median(single):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""A local stand-in for the VIES VAT number registry, to try and test VAT validation.
+
+Answers ``GET /ms/<country>/vat/<number>`` like the VIES REST API. Numbers
+that pass the app's format and check digit rules are registered, except for
+a ``--unregistered`` share of them (picked by number, so answers are stable
+across runs). ``--latency`` slows every answer down and ``--unavailable``
+makes a share of them fail like a member state being down. Requests beyond
+``--max-concurrent`` at a time are refused with MS_MAX_CONCURRENT_REQ, as
+VIES does; the peak concurrency is printed as it grows.
+
+Usage:
+    python scripts/vies_stub.py [--port 8040] [--latency 0.2] [--unregistered 0.1] [--unavailable 0.05]
+
+Then set VAT_VIES_URL=http://localhost:8040.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class Registry:
+    def __init__(self, latency=0.0, unregistered=0.0, unavailable=0.0, max_concurrent=10, seed=None):
+        self.latency = latency
+        self.unregistered = unregistered
+        self.unavailable = unavailable
+        self.max_concurrent = max_concurrent
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+
+    def answer(self, country, number):
+        """The JSON document to answer a lookup with."""
+        from app.services.vat import check_number
+
+        with self.lock:
+            self.requests += 1
+            if self.active >= self.max_concurrent:
+                return self._document(country, number, False, "MS_MAX_CONCURRENT_REQ")
+            self.active += 1
+            if self.active > self.peak:
+                self.peak = self.active
+                print(f"Peak concurrency: {self.peak}")
+            failing = self.rng.random() < self.unavailable
+        try:
+            time.sleep(self.latency)
+            if failing:
+                return self._document(country, number, False, "MS_UNAVAILABLE")
+            well_formed = check_number(country + number).status == "unconfirmed"
+            # Stable per number: the same numbers are unregistered on every run
+            registered = well_formed and zlib.crc32(number.encode()) % 1000 >= self.unregistered * 1000
+            if not registered:
+                return self._document(country, number, False, "INVALID")
+            return self._document(
+                country, number, True, "VALID",
+                name=f"Company {country}{number}", address=f"{number[-3:]} Main Street\n{country}",
+            )
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    @staticmethod
+    def _document(country, number, valid, user_error, name="---", address="---"):
+        return {
+            "isValid": valid,
+            "requestDate": datetime.utcnow().isoformat() + "Z",
+            "userError": user_error,
+            "name": name,
+            "address": address,
+            "requestIdentifier": "",
+            "originalVatNumber": number,
+            "vatNumber": number,
+            "countryCode": country,
+        }
+
+
+def make_handler(registry):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep connections alive
+        disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) < 4 or parts[-4] != "ms" or parts[-2] != "vat":
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.dumps(registry.answer(parts[-3].upper(), parts[-1].upper())).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8040)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each answer.")
+    parser.add_argument("--unregistered", type=float, default=0.0, help="Share of well-formed numbers that aren't registered.")
+    parser.add_argument("--unavailable", type=float, default=0.0, help="Share of lookups answered with MS_UNAVAILABLE.")
+    parser.add_argument("--max-concurrent", type=int, default=10, help="Lookups served at a time.")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    registry = Registry(args.latency, args.unregistered, args.unavailable, args.max_concurrent, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(registry))
+    print(f"Answering VAT lookups on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{registry.requests} lookups, at most {registry.peak} at a time.")
+
+
+if __name__ == "__main__":
+    main()
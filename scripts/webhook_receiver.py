@@ -0,0 +1,103 @@
+"""A local stand-in for a webhook endpoint, to try and test webhook delivery.
+
+Listens for POSTed event batches on keep-alive connections, checks their
+signature when given the secret, and prints one line per event. It reports
+events that arrive out of order for their invoice and duplicates, which
+receivers must tolerate. ``--fail-rate`` answers a share of the batches with
+``--fail-status`` to exercise retries and dead-lettering.
+
+Usage:
+    python scripts/webhook_receiver.py [--port 8030] [--secret SECRET] [--fail-rate 0.2] [--fail-status 503]
+
+Then set WEBHOOK_URLS=http://localhost:8030/ and WEBHOOK_SECRET to the same secret.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Receiver:
+    def __init__(self, secret=None, fail_rate=0.0, fail_status=503, seed=None):
+        self.secret = secret
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.last_event = {}  # Invoice ID -> last event ID received
+        self.seen = set()
+        self.batches = 0
+        self.connections = set()
+
+    def handle(self, body, signature, connection):
+        """Process one batch; returns the HTTP status to answer with."""
+        if self.secret:
+            expected = "sha256=" + hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(expected, signature or ""):
+                print("Rejected a batch with a bad signature")
+                return 401
+        with self.lock:
+            self.connections.add(connection)
+            if self.rng.random() < self.fail_rate:
+                print(f"Failing a batch with {self.fail_status}")
+                return self.fail_status
+            self.batches += 1
+            events = json.loads(body)["events"]
+            for event in events:
+                invoice_id = event["invoice"]["id"]
+                notes = []
+                if event["id"] in self.seen:
+                    notes.append("DUPLICATE")
+                elif event["id"] < self.last_event.get(invoice_id, 0):
+                    notes.append("OUT OF ORDER")
+                self.seen.add(event["id"])
+                self.last_event[invoice_id] = max(event["id"], self.last_event.get(invoice_id, 0))
+                print(f"#{event['id']} {event['type']} invoice {invoice_id} {' '.join(notes)}".rstrip())
+            print(
+                f"-- batch {self.batches}: {len(events)} events, "
+                f"{len(self.seen)} distinct so far over {len(self.connections)} connections"
+            )
+        return 200
+
+
+def make_handler(receiver):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep connections alive
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status = receiver.handle(body, self.headers.get("X-InvoiciPy-Signature"), self.client_address)
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8030)
+    parser.add_argument("--secret", help="Verify signatures with this WEBHOOK_SECRET.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of batches to fail, 0 to 1.")
+    parser.add_argument("--fail-status", type=int, default=503, help="Status of failed batches.")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    receiver = Receiver(args.secret, args.fail_rate, args.fail_status, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(receiver))
+    print(f"Receiving webhooks on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()